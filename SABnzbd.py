@@ -16,8 +16,8 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import sys
-if sys.version_info < (2, 5):
-    print "Sorry, requires Python 2.5, 2.6 or 2.7."
+if sys.version_info < (2, 7, 9) or sys.version_info >= (3, 0):
+    print "Sorry, requires Python 2.7.9 or a later 2.7 version."
     sys.exit(1)
 
 import logging
@@ -70,7 +70,7 @@ from sabnzbd.constants import *
 import sabnzbd.newsunpack
 from sabnzbd.misc import get_user_shellfolders, real_path, \
      check_latest_version, exit_sab, \
-     split_host, get_ext, create_https_certificates, \
+     split_host, get_ext, create_https_certificates, HAVE_PYOPENSSL, \
      windows_variant, ip_extract, set_serv_parms, get_serv_parms, globber
 from sabnzbd.panic import panic_tmpl, panic_port, panic_host, panic_fwall, \
      panic_sqlite, panic, launch_a_browser, panic_xport
@@ -496,9 +496,14 @@ def print_modules():
             logging.info("ionice binary... NOT found!")
 
     if sabnzbd.newswrapper.HAVE_SSL:
-        logging.info("pyOpenSSL... found (%s)", sabnzbd.newswrapper.HAVE_SSL)
+        logging.info("SSL module... found (%s)", sabnzbd.newswrapper.ssl.OPENSSL_VERSION)
     else:
-        logging.info("pyOpenSSL... NOT found - try apt-get install python-pyopenssl (SSL is optional)")
+        logging.info("SSL module... NOT found - Python was built without SSL support (SSL is optional)")
+
+    if HAVE_PYOPENSSL:
+        logging.info("pyOpenSSL... found")
+    else:
+        logging.info("pyOpenSSL... NOT found - try apt-get install python-pyopenssl (HTTPS access is optional)")
 
 
 #------------------------------------------------------------------------------
@@ -1095,6 +1100,9 @@ def main():
     # Determine web host address
     cherryhost, cherryport, browserhost, https_port = get_webhost(cherryhost, cherryport, https_port)
     enable_https = sabnzbd.cfg.enable_https()
+    if enable_https and not HAVE_PYOPENSSL:
+        # Without pyOpenSSL CherryPy cannot serve HTTPS
+        enable_https = False
 
     # When this is a daemon, just check and bail out if port in use
     if sabnzbd.DAEMON:
@@ -1353,6 +1361,9 @@ def main():
     if not (sabnzbd.cfg.https_chain() and os.path.exists(https_chain)):
         https_chain = None
 
+    if sabnzbd.cfg.enable_https() and not HAVE_PYOPENSSL:
+        logging.warning(Ta('pyopenssl module missing, please install for https access'))
+
     if enable_https:
         # If either the HTTPS certificate or key do not exist, make some self-signed ones.
         if not (https_cert and os.path.exists(https_cert)) or not (https_key and os.path.exists(https_key)):
@@ -87,6 +87,7 @@ import sabnzbd.newsunpack
 import sabnzbd.encoding as encoding
 import sabnzbd.config as config
 from sabnzbd.bpsmeter import BPSMeter
+from sabnzbd.missingarticles import MissingArticles
 import sabnzbd.cfg as cfg
 import sabnzbd.database
 import sabnzbd.lang as lang
@@ -298,6 +299,7 @@ def initialize(pause_downloader = False, clean_up = False, evalSched=False, repa
     rss.init()
 
     paused = BPSMeter.do.read()
+    MissingArticles.do.read()
 
     PostProcessor()
 
@@ -500,6 +502,7 @@ def save_state(flag=False):
     ArticleCache.do.flush_articles()
     NzbQueue.do.save()
     BPSMeter.do.save()
+    MissingArticles.do.save()
     rss.save()
     Bookmarks.do.save()
     DirScanner.do.save()
@@ -950,7 +953,7 @@ def load_admin(_id, remove=False, do_pickle=True):
 def pp_to_opts(pp):
     """ Convert numeric processinf options to (repair, unpack, delete) """
     # Convert the pp to an int
-    pp = sabnzbd.interface.int_conv(pp)
+    pp = misc.int_conv(pp)
     if pp == 0 : return (False, False, False)
     if pp == 1 : return (True, False, False)
     if pp == 2 : return (True, True, False)
@@ -1080,6 +1083,10 @@ def active_primaries():
     return sabnzbd.downloader.Downloader.do.active_primaries()
 
 
+def max_retention():
+    return sabnzbd.downloader.Downloader.do.max_retention()
+
+
 def proxy_pre_queue(name, pp, cat, script, priority, size, groups):
     return sabnzbd.newsunpack.pre_queue(name, pp, cat, script, priority, size, groups)
 
@@ -59,6 +59,7 @@ from sabnzbd.articlecache import ArticleCache
 from sabnzbd.utils.servertests import test_nntp_server_dict
 from sabnzbd.newzbin import Bookmarks
 from sabnzbd.bpsmeter import BPSMeter
+from sabnzbd.missingarticles import MissingArticles
 from sabnzbd.database import build_history_info, unpack_history_info, get_history_handle
 import sabnzbd.growler
 import sabnzbd.rss
@@ -232,6 +233,17 @@ def _api_queue_priority(output, value, kwargs):
         return report(output, _MSG_NO_VALUE2)
 
 
+def _api_queue_speedlimit(output, value, kwargs):
+    """ API: accepts output, value(=nzo_id), value2(=speed in KB/s, 0 = none) """
+    value2 = kwargs.get('value2', '0')
+    if value and value2.isdigit():
+        if NzbQueue.do.change_speed_limit(value, value2):
+            return report(output)
+        return report(output, _MSG_NO_ITEM)
+    else:
+        return report(output, _MSG_NO_VALUE2)
+
+
 def _api_queue_sort(output, value, kwargs):
     """ API: accepts output, sort, dir """
     sort = kwargs.get('sort')
@@ -447,7 +459,7 @@ def _api_history(name, output, kwargs):
         else:
             return report(output, _MSG_NO_VALUE)
     elif not name:
-        history, pnfo_list, bytespersec = build_header(True)
+        history, bytespersec = build_header(True)
         grand, month, week, day = BPSMeter.do.get_sums()
         history['total_size'], history['month_size'], history['week_size'], history['day_size'] = \
                to_units(grand), to_units(month), to_units(week), to_units(day)
@@ -458,10 +470,23 @@ def _api_history(name, output, kwargs):
 
 
 def _api_get_files(name, output, kwargs):
-    """ API: accepts output, value(=nzo_id) """
+    """ API: accepts output, value(=nzo_id), start, limit, status(=finished,active,queued) """
     value = kwargs.get('value')
     if value:
-        return report(output, keyword='files', data=build_file_list(value))
+        start = int_conv(kwargs.get('start'))
+        limit = int_conv(kwargs.get('limit'))
+        statuses = kwargs.get('status')
+        if statuses:
+            statuses = [status.strip() for status in statuses.split(',')]
+        total, files = NzbQueue.do.get_files(value, statuses, start, limit)
+        if output == 'json' and not kwargs.get('callback') and len(files) > _FILE_LIST_STREAM:
+            # Avoid building one huge string for jobs with many files
+            cherrypy.response.headers['Content-Type'] = "application/json;charset=UTF-8"
+            cherrypy.response.headers['Pragma'] = 'no-cache'
+            cherrypy.response.stream = True
+            return stream_file_list(total, files)
+        # 'total' is the length of the complete selection, for paging
+        return report(output, keyword='', data={'total' : total, 'files' : [file_line(tup) for tup in files]})
     else:
         return report(output, _MSG_NO_VALUE)
 
@@ -552,6 +577,16 @@ def _api_version(name, output, kwargs):
     return report(output, keyword='version', data=sabnzbd.__version__)
 
 
+def _api_server_stats(name, output, kwargs):
+    """ API: accepts output """
+    return report(output, keyword='servers', data=Downloader.do.server_stats())
+
+
+def _api_missing_stats(name, output, kwargs):
+    """ API: accepts output """
+    return report(output, keyword='missing', data=MissingArticles.do.stats())
+
+
 def _api_auth(name, output, kwargs):
     """ API: accepts output """
     auth = 'None'
@@ -786,6 +821,8 @@ _api_table = {
     'get_cats'        : _api_get_cats,
     'get_scripts'     : _api_get_scripts,
     'version'         : _api_version,
+    'server_stats'    : _api_server_stats,
+    'missing_stats'   : _api_missing_stats,
     'auth'            : _api_auth,
     'newzbin'         : _api_newzbin,
     'restart'         : _api_restart,
@@ -811,6 +848,7 @@ _api_queue_table = {
     'pause'                   : _api_queue_pause,
     'resume'                  : _api_queue_resume,
     'priority'                : _api_queue_priority,
+    'speedlimit'              : _api_queue_speedlimit,
     'sort'                    : _api_queue_sort
 }
 
@@ -1015,7 +1053,7 @@ def build_queue(web_dir=None, root=None, verbose=False, prim=True, webdir='', ve
     else:
         dictn = []
     #build up header full of basic information
-    info, pnfo_list, bytespersec = build_header(prim, webdir)
+    info, bytespersec = build_header(prim, webdir)
     info['isverbose'] = verbose
     cookie = cherrypy.request.cookie
     if cookie.has_key('queue_details'):
@@ -1055,7 +1093,25 @@ def build_queue(web_dir=None, root=None, verbose=False, prim=True, webdir='', ve
     else:
         slotinfo = []
 
-    info['noofslots'] = len(pnfo_list) + len(slotinfo)
+    # Page of the lock-free queue snapshot, the downloader is never kept waiting
+    # Only jobs whose files are shown get loaded
+    details = web_dir and (verbose or verbose_list)
+    if limit:
+        q_size, lead, pnfo_list = NzbQueue.do.queue_page(start, limit, details)
+        n = start
+    else:
+        q_size, lead, pnfo_list = NzbQueue.do.queue_page(details=details)
+    for status, bytesleft in lead:
+        if not Downloader.do.paused and status not in (Status.PAUSED, Status.FETCHING):
+            found_active = True
+        if not (Downloader.do.paused or Downloader.do.postproc) and status in (Status.DOWNLOADING, Status.QUEUED):
+            running_bytes += bytesleft
+            try:
+                datestart = datestart + datetime.timedelta(seconds=bytesleft / bytespersec)
+            except:
+                datestart = datetime.datetime.now()
+
+    info['noofslots'] = q_size + len(slotinfo)
 
     info['start'] = start
     info['limit'] = limit
@@ -1083,9 +1139,10 @@ def build_queue(web_dir=None, root=None, verbose=False, prim=True, webdir='', ve
         mb = (bytes / MEBI)
         missing = pnfo[PNFO_MISSING_FIELD]
         if verbose or verbose_list:
-            finished_files = pnfo[PNFO_FINISHED_FILES_FIELD]
-            active_files = pnfo[PNFO_ACTIVE_FILES_FIELD]
-            queued_files = pnfo[PNFO_QUEUED_FILES_FIELD]
+            # None when the job could not be loaded
+            finished_files = pnfo[PNFO_FINISHED_FILES_FIELD] or []
+            active_files = pnfo[PNFO_ACTIVE_FILES_FIELD] or []
+            queued_files = pnfo[PNFO_QUEUED_FILES_FIELD] or []
 
         nzo_ids.append(nzo_id)
 
@@ -1206,8 +1263,7 @@ def build_queue(web_dir=None, root=None, verbose=False, prim=True, webdir='', ve
             slot['queued'] = queued
 
 
-        if (start <= n  and n < start + limit) or not limit:
-            slotinfo.append(slot)
+        slotinfo.append(slot)
         n += 1
 
     if slotinfo:
@@ -1216,23 +1272,6 @@ def build_queue(web_dir=None, root=None, verbose=False, prim=True, webdir='', ve
         info['slots'] = []
         verbose_list = []
 
-    #Paging of the queue using limit and/or start values
-    if limit > 0:
-        try:
-            if start > 0:
-                if start > len(pnfo_list):
-                    pnfo_list = []
-                else:
-                    end = start+limit
-                    if start+limit > len(pnfo_list):
-                        end = len(pnfo_list)
-                    pnfo_list = pnfo_list[start:end]
-            else:
-                if not limit > len(pnfo_list):
-                    pnfo_list = pnfo_list[:limit]
-        except:
-            pass
-
     return info, pnfo_list, bytespersec, verbose_list, dictn
 
 
@@ -1251,7 +1290,7 @@ def qstatus_data():
     """Build up the queue status as a nested object and output as a JSON object
     """
 
-    qnfo = NzbQueue.do.queue_info()
+    qnfo = NzbQueue.do.queue_snapshot()
     pnfo_list = qnfo[QNFO_PNFO_LIST_FIELD]
 
     jobs = []
@@ -1298,65 +1337,35 @@ def qstatus_data():
 
 
 #------------------------------------------------------------------------------
-def build_file_list(id):
-    qnfo = NzbQueue.do.queue_info()
-    pnfo_list = qnfo[QNFO_PNFO_LIST_FIELD]
-
-    jobs = []
-    for pnfo in pnfo_list:
-        nzo_id = pnfo[PNFO_NZO_ID_FIELD]
-        if nzo_id == id:
-            finished_files = pnfo[PNFO_FINISHED_FILES_FIELD]
-            active_files = pnfo[PNFO_ACTIVE_FILES_FIELD]
-            queued_files = pnfo[PNFO_QUEUED_FILES_FIELD]
-
-
-            n = 0
-            for tup in finished_files:
-                bytes_left, bytes, fn, date = tup
-                fn = xml_name(fn)
-
-                age = calc_age(date)
-
-                line = {'filename':fn,
-                        'mbleft':"%.2f" % (bytes_left / MEBI),
-                        'mb':"%.2f" % (bytes / MEBI),
-                        'bytes':"%.2f" % bytes,
-                        'age':age, 'id':str(n), 'status':'finished'}
-                jobs.append(line)
-                n += 1
-
-            for tup in active_files:
-                bytes_left, bytes, fn, date, nzf_id = tup
-                fn = xml_name(fn)
-
-                age = calc_age(date)
-
-                line = {'filename':fn,
-                        'mbleft':"%.2f" % (bytes_left / MEBI),
-                        'mb':"%.2f" % (bytes / MEBI),
-                        'bytes':"%.2f" % bytes,
-                        'nzf_id':nzf_id,
-                        'age':age, 'id':str(n), 'status':'active'}
-                jobs.append(line)
-                n += 1
-
-            for tup in queued_files:
-                _set, bytes_left, bytes, fn, date = tup
-                fn = xml_name(fn)
-                _set = xml_name(_set)
-
-                age = calc_age(date)
-
-                line = {'filename':fn, 'set':_set,
-                        'mbleft':"%.2f" % (bytes_left / MEBI),
-                        'mb':"%.2f" % (bytes / MEBI),
-                        'bytes':"%.2f" % bytes,
-                        'age':age, 'id':str(n), 'status':'queued'}
-                jobs.append(line)
-                n += 1
-
-    return jobs
+_FILE_LIST_STREAM = 1000    # Stream JSON file lists longer than this
+
+def file_line(tup):
+    """ Convert file tuple from NzbObject.gather_files to API dictionary """
+    n, status, _set, bytes_left, bytes, fn, date, nzf_id = tup
+    line = {'filename':xml_name(fn),
+            'mbleft':"%.2f" % (bytes_left / MEBI),
+            'mb':"%.2f" % (bytes / MEBI),
+            'bytes':"%.2f" % bytes,
+            'age':calc_age(date), 'id':str(n), 'status':status}
+    if status == 'active':
+        line['nzf_id'] = nzf_id
+    elif status == 'queued':
+        line['set'] = xml_name(_set)
+    return line
+
+
+def stream_file_list(total, files):
+    """ Generate JSON output for a file list in pieces """
+    writer = JsonWriter()
+    yield '{"total":%d,"files":[' % total
+    first = True
+    for tup in files:
+        if first:
+            first = False
+            yield writer.write(file_line(tup))
+        else:
+            yield ',' + writer.write(file_line(tup))
+    yield ']}'
 
 
 #------------------------------------------------------------------------------
@@ -1379,7 +1388,7 @@ def json_list(section, lst):
 def rss_qstatus():
     """ Return a RSS feed with the queue status
     """
-    qnfo = NzbQueue.do.queue_info()
+    qnfo = NzbQueue.do.queue_snapshot()
     pnfo_list = qnfo[QNFO_PNFO_LIST_FIELD]
 
     rss = RSS()
@@ -1580,10 +1589,7 @@ def build_header(prim, webdir=''):
     header['uniconfig'] = cfg.uniconfig() and sabnzbd.WEB_DIRC
 
     bytespersec = BPSMeter.do.get_bps()
-    qnfo = NzbQueue.do.queue_info()
-
-    bytesleft = qnfo[QNFO_BYTES_LEFT_FIELD]
-    bytes = qnfo[QNFO_BYTES_FIELD]
+    bytes, bytesleft, q_size, dummy = NzbQueue.do.get_totals()
 
     header['kbpersec'] = "%.2f" % (bytespersec / KIBI)
     header['speed'] = to_units(bytespersec, spaces=1, dec_limit=1)
@@ -1628,7 +1634,7 @@ def build_header(prim, webdir=''):
         datestart = datetime.datetime.now()
         header['eta'] = T('unknown')
 
-    return (header, qnfo[QNFO_PNFO_LIST_FIELD], bytespersec)
+    return (header, bytespersec)
 
 
 #------------------------------------------------------------------------------
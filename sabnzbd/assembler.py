@@ -41,7 +41,7 @@ import sabnzbd.cfg as cfg
 from sabnzbd.articlecache import ArticleCache
 from sabnzbd.postproc import PostProcessor
 import sabnzbd.downloader
-from sabnzbd.utils.rarfile import RarFile, is_rarfile
+from sabnzbd.utils.rarfile import RarFile, is_rarfile, RAR_ID
 from sabnzbd.encoding import latin1, unicoder, is_utf8
 
 
@@ -308,3 +308,24 @@ def check_encrypted_rar(nzo, filepath):
             logging.debug('RAR file %s cannot be inspected', filepath)
     return encrypted
 
+
+def check_encrypted_article(nzo, nzf, data):
+    """ Check the headers in the first article of a RAR volume,
+        pause the job when it is encrypted or cloaked
+    """
+    encrypted = False
+    if not nzo.password and not nzo.encrypted and cfg.pause_on_pwrar() and data.startswith(RAR_ID):
+        name = nzf.filename or nzf.subject
+        try:
+            zf = RarFile(name, all_names=True, data=data)
+            encrypted = zf.encrypted or is_cloaked(name, zf.namelist())
+            zf.close()
+            del zf
+        except:
+            logging.debug('RAR headers of %s cannot be inspected', name)
+        if encrypted:
+            nzo.encrypted = 1
+            logging.warning(Ta('WARNING: Paused job "%s" because of encrypted RAR file'), latin1(nzo.final_name))
+            nzo.pause()
+    return encrypted
+
@@ -104,6 +104,8 @@ allow_64bit_tools = OptionBool('misc', 'allow_64bit_tools', True)
 allow_streaming = OptionBool('misc', 'allow_streaming', False)
 pre_check = OptionBool('misc', 'pre_check', False)
 req_completion_rate = OptionNumber('misc', 'req_completion_rate', 100.2, 100, 200)
+precheck_sample = OptionNumber('misc', 'precheck_sample', 0, 0, 100)
+header_first = OptionBool('misc', 'header_first', False)
 
 newzbin_username = OptionStr('newzbin', 'username')
 newzbin_password = OptionPassword('newzbin', 'password')
@@ -114,6 +116,7 @@ newzbin_url = OptionStr('newzbin', 'url', 'www.newzbin2.es')
 
 top_only = OptionBool('misc', 'top_only', False)
 autodisconnect = OptionBool('misc', 'auto_disconnect', True)
+warm_connections = OptionNumber('misc', 'warm_connections', 0, 0, 10)
 queue_complete = OptionStr('misc', 'queue_complete')
 queue_complete_pers = OptionBool('misc', 'queue_complete_pers', False)
 
@@ -131,6 +134,9 @@ prio_sort_list = OptionList('misc', 'prio_sort_list')
 safe_postproc = OptionBool('misc', 'safe_postproc', True)
 empty_postproc = OptionBool('misc', 'empty_postproc', False)
 pause_on_post_processing = OptionBool('misc', 'pause_on_post_processing', False)
+pp_verify_jobs = OptionNumber('misc', 'pp_verify_jobs', 1, 1, 16)
+pp_unpack_jobs = OptionNumber('misc', 'pp_unpack_jobs', 1, 1, 16)
+pp_finish_jobs = OptionNumber('misc', 'pp_finish_jobs', 1, 1, 16)
 ampm = OptionBool('misc', 'ampm', False)
 rss_filenames = OptionBool('misc', 'rss_filenames', False)
 rss_odd_titles = OptionList('misc', 'rss_odd_titles', ['nzbindex.nl/', 'nzbindex.com/', 'nzbclub.com/'])
@@ -219,6 +225,7 @@ unpack_check = OptionBool('misc', 'unpack_check', True)
 no_penalties = OptionBool('misc', 'no_penalties', False)
 randomize_server_ip = OptionBool('misc', 'randomize_server_ip', False)
 ipv6_servers = OptionNumber('misc', 'ipv6_servers', 1, 0, 2)
+ipv6_test_host = OptionStr('misc', 'ipv6_test_host', 'www.google.com')
 
 # Internal options, not saved in INI file
 debug_delay = OptionNumber('misc', 'debug_delay', 0, add=False)
@@ -232,6 +239,9 @@ max_art_tries = OptionNumber('misc', 'max_art_tries', 3, 2)
 max_art_opt = OptionBool('misc', 'max_art_opt', False)
 use_pickle = OptionBool('misc', 'use_pickle', False)
 no_ipv6 = OptionBool('misc', 'no_ipv6', False)
+queue_journal = OptionBool('misc', 'queue_journal', True)
+queue_db = OptionBool('misc', 'queue_db', False)
+lazy_queue = OptionBool('misc', 'lazy_queue', True)
 
 growl_server = OptionStr('growl', 'growl_server')
 growl_password = OptionPassword('growl', 'growl_password')
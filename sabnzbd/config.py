@@ -20,6 +20,7 @@ sabnzbd.config - Configuration Support
 """
 
 import os
+import socket
 import logging
 import threading
 import shutil
@@ -348,6 +349,11 @@ class ConfigServer(object):
         self.enable = OptionBool(name, 'enable', True, add=False)
         self.optional = OptionBool(name, 'optional', False, add=False)
         self.retention = OptionNumber(name, 'retention', add=False)
+        self.speedlimit = OptionNumber(name, 'speedlimit', 0, 0, add=False)
+        self.autotune = OptionBool(name, 'autotune', False, add=False)
+        self.min_connections = OptionNumber(name, 'min_connections', 1, 1, 100, add=False)
+        self.bind_ips = OptionList(name, 'bind_ips', validation=validate_ips, add=False)
+        self.compress = OptionBool(name, 'compress', False, add=False)
 
         self.set_dict(values)
         add_to_database('servers', self.__name, self)
@@ -355,7 +361,8 @@ class ConfigServer(object):
     def set_dict(self, values):
         """ Set one or more fields, passed as dictionary """
         for kw in ('host', 'port', 'timeout', 'username', 'password', 'connections',
-                   'fillserver', 'ssl', 'enable', 'optional', 'retention'):
+                   'fillserver', 'ssl', 'enable', 'optional', 'retention', 'speedlimit',
+                   'autotune', 'min_connections', 'bind_ips', 'compress'):
             try:
                 value = values[kw]
             except KeyError:
@@ -381,6 +388,11 @@ class ConfigServer(object):
         dict['enable'] = self.enable()
         dict['optional'] = self.optional()
         dict['retention'] = self.retention()
+        dict['speedlimit'] = self.speedlimit()
+        dict['autotune'] = self.autotune()
+        dict['min_connections'] = self.min_connections()
+        dict['bind_ips'] = self.bind_ips()
+        dict['compress'] = self.compress()
         return dict
 
     def delete(self):
@@ -926,6 +938,21 @@ def validate_octal(value):
         return Ta('%s is not a correct octal value') % value, None
 
 
+def validate_ips(value):
+    """ Check if all entries are IPv4 or IPv6 addresses """
+    for ip in value:
+        try:
+            if ':' in ip:
+                socket.inet_pton(socket.AF_INET6, ip)
+            elif ip.count('.') == 3:
+                socket.inet_aton(ip)
+            else:
+                raise ValueError
+        except (socket.error, ValueError, AttributeError):
+            return Ta('%s is not a valid IP address') % ip, None
+    return None, value
+
+
 def validate_no_unc(root, value, default):
     """ Check if path isn't a UNC path """
     # Only need to check the 'value' part
@@ -44,6 +44,7 @@ QNFO_BYTES_FIELD = 0
 QNFO_BYTES_LEFT_FIELD = 1
 QNFO_PNFO_LIST_FIELD = 2
 QNFO_Q_SIZE_LIST_FIELD = 3
+QNFO_VERSION_FIELD = 4
 
 ANFO_ARTICLE_SUM_FIELD = 0
 ANFO_CACHE_SIZE_FIELD = 1
@@ -56,10 +57,12 @@ KIBI = float(2 ** 10)
 BYTES_FILE_NAME  = 'totals%s.sab' % QUEUE_VERSION
 QUEUE_FILE_TMPL  = 'queue%s.sab'
 QUEUE_FILE_NAME  =  QUEUE_FILE_TMPL % QUEUE_VERSION
+JOURNAL_FILE_NAME = 'queue%s.jnl' % QUEUE_VERSION
 POSTPROC_QUEUE_FILE_NAME  = 'postproc%s.sab' % POSTPROC_QUEUE_VERSION
 RSS_FILE_NAME    = 'rss_data.sab'
 BOOKMARK_FILE_NAME = 'bookmarks.sab'
 SCAN_FILE_NAME    = 'watched_data.sab'
+MISSING_FILE_NAME = 'missing_articles.sab'
 TERM_FLAG_FILE    = 'running.sab'
 FUTURE_Q_FOLDER   = 'future'
 JOB_ADMIN = '__ADMIN__'
@@ -108,6 +111,12 @@ DEF_QRATE        = 0
 MIN_DECODE_QUEUE = 5
 MAX_DECODE_QUEUE = 10
 MAX_WARNINGS     = 20
+JOURNAL_COMPACT_SIZE = 4 * 1024 * 1024
+QUEUE_LOAD_THREADS = 4
+PRECHECK_PIPELINE = 16       # STAT commands in flight per connection
+PRECHECK_MIN_SAMPLE = 10     # Minimum articles checked per file when sampling
+MISSING_MAX = 200000         # Entries kept in the missing-article registry
+MISSING_TTL = 3 * 24 * 3600  # Seconds before a recorded miss is asked again
 
 REPAIR_PRIORITY = 3
 TOP_PRIORITY = 2
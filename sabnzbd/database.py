@@ -32,16 +32,22 @@ import time
 import datetime
 import zlib
 import logging
+import threading
+import cPickle
+import pickle
 
 import sabnzbd
 import sabnzbd.cfg
-from sabnzbd.constants import DB_HISTORY_NAME
+from sabnzbd.constants import DB_HISTORY_NAME, DB_QUEUE_NAME
 from sabnzbd.encoding import unicoder
 from sabnzbd.bpsmeter import this_week, this_month
 from sabnzbd.misc import format_source_url
 
 _HISTORY_DB = None        # Will contain full path to history database
 _DONE_CLEANING = False    # Ensure we only do one Vacuum per session
+_QUEUE_DB = None          # Will contain the queue database instance
+QUEUE_DB_LOCK = threading.RLock()
+QUEUE_DB_VERSION = 2      # Schema version of the queue database, see QueueDB.upgrade_queue_db
 
 def get_history_handle():
     """ Get an instance of the history db hanlder """
@@ -311,6 +317,317 @@ class HistoryDB(object):
                 pass
         return path
 
+
+def queue_db_path():
+    """ Full path of the queue database """
+    return os.path.join(sabnzbd.cfg.admin_dir.get_path(), DB_QUEUE_NAME)
+
+
+def get_queue_handle():
+    """ Get the (shared) instance of the queue db handler """
+    global _QUEUE_DB
+    QUEUE_DB_LOCK.acquire()
+    try:
+        if not _QUEUE_DB:
+            _QUEUE_DB = QueueDB(queue_db_path())
+    finally:
+        QUEUE_DB_LOCK.release()
+    return _QUEUE_DB
+
+
+def close_queue_handle():
+    """ Close the queue database, committing pending writes """
+    global _QUEUE_DB
+    QUEUE_DB_LOCK.acquire()
+    try:
+        if _QUEUE_DB:
+            _QUEUE_DB.close()
+            _QUEUE_DB = None
+    finally:
+        QUEUE_DB_LOCK.release()
+
+
+def _queue_locked(func):
+    """ Serialize access to the shared queue connection """
+    def call_func(*args, **kwargs):
+        QUEUE_DB_LOCK.acquire()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            QUEUE_DB_LOCK.release()
+    return call_func
+
+
+class QueueDB(object):
+    """ Queue storage in SQLite, alternative for the queue file and job pickles.
+        Writes are collected and committed in one transaction by commit().
+        Tables:
+            jobs     : one row per job, with header columns and the pickled job
+            files    : one row per file of a job
+            segments : the articles of each file, replaces the NZF admin files
+            meta     : key/value pairs for the queue itself, including the schema version
+    """
+    def __init__(self, db_path):
+        create_table = not os.path.exists(db_path)
+        if sabnzbd.WIN32 and isinstance(db_path, str):
+            db_path = db_path.decode('latin-1').encode('utf-8')
+        # The connection is shared by all threads, access is serialized by QUEUE_DB_LOCK
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.text_factory = str
+        self.c = self.con.cursor()
+        self.pending = []
+        if create_table:
+            self.create_queue_db()
+        else:
+            self.upgrade_queue_db()
+
+    def execute(self, command, args=(), many=False):
+        ''' Wrapper for executing SQL commands '''
+        try:
+            if many:
+                self.c.executemany(command, args)
+            elif args:
+                self.c.execute(command, args)
+            else:
+                self.c.execute(command)
+            return True
+        except:
+            logging.error(Ta('SQL Command Failed, see log'))
+            logging.debug("SQL: %s" , command)
+            logging.info("Traceback: ", exc_info = True)
+            return False
+
+    def create_queue_db(self):
+        self.execute("""
+        CREATE TABLE "jobs" (
+            "nzo_id" TEXT PRIMARY KEY,
+            "position" INTEGER NOT NULL,
+            "name" TEXT,
+            "filename" TEXT,
+            "category" TEXT,
+            "bytes" INTEGER,
+            "bytes_left" INTEGER,
+            "priority" INTEGER,
+            "status" TEXT,
+            "avg_date" INTEGER,
+            "journal_seq" INTEGER,
+            "header" BLOB,
+            "data" BLOB
+        )
+        """)
+        self.execute('CREATE INDEX "jobs_status" ON "jobs" ("status")')
+        self.execute('CREATE INDEX "jobs_priority" ON "jobs" ("priority")')
+        self.execute("""
+        CREATE TABLE "files" (
+            "nzf_id" TEXT NOT NULL,
+            "nzo_id" TEXT NOT NULL,
+            "filename" TEXT,
+            "bytes" INTEGER,
+            "bytes_left" INTEGER,
+            "status" TEXT
+        )
+        """)
+        self.execute('CREATE INDEX "files_nzo_id" ON "files" ("nzo_id")')
+        self.execute("""
+        CREATE TABLE "segments" (
+            "path" TEXT NOT NULL,
+            "nzf_id" TEXT NOT NULL,
+            "partnum" INTEGER NOT NULL,
+            "article" TEXT,
+            "bytes" INTEGER,
+            PRIMARY KEY ("path", "nzf_id", "partnum")
+        )
+        """)
+        self.execute("""
+        CREATE TABLE "meta" (
+            "key" TEXT PRIMARY KEY,
+            "value" TEXT
+        )
+        """)
+        self.set_version(QUEUE_DB_VERSION)
+        self.con.commit()
+
+    def upgrade_queue_db(self):
+        """ Bring the tables of an older release up to date """
+        version = 1
+        if self.execute('SELECT value FROM meta WHERE key=?', ('version',)):
+            row = self.c.fetchone()
+            if row:
+                version = int(row[0])
+        if version >= QUEUE_DB_VERSION:
+            return
+        logging.info('Upgrading queue database from version %s to %s', version, QUEUE_DB_VERSION)
+        if version < 2 and 'header' not in self.columns('jobs'):
+            # Header info for loading jobs on demand, old rows are loaded completely once
+            self.execute('ALTER TABLE "jobs" ADD COLUMN "header" BLOB')
+        self.set_version(QUEUE_DB_VERSION)
+        self.con.commit()
+
+    def columns(self, table):
+        """ Return names of the columns of `table` """
+        if self.execute('PRAGMA table_info("%s")' % table):
+            return [row[1] for row in self.c.fetchall()]
+        return []
+
+    def set_version(self, version):
+        self.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('version', str(version)))
+
+    def add(self, command, args=(), many=False):
+        """ Queue a write for the next commit """
+        self.pending.append((command, args, many))
+
+    @_queue_locked
+    def commit(self):
+        """ Write all pending changes in one transaction """
+        if not self.pending:
+            return True
+        pending = self.pending
+        self.pending = []
+        ok = True
+        for command, args, many in pending:
+            if not self.execute(command, args, many):
+                ok = False
+                break
+        try:
+            if ok:
+                self.con.commit()
+            else:
+                self.con.rollback()
+        except:
+            logging.error(Ta('SQL Commit Failed, see log'))
+            logging.info("Traceback: ", exc_info = True)
+            ok = False
+        return ok
+
+    @_queue_locked
+    def close(self):
+        self.commit()
+        try:
+            self.c.close()
+            self.con.close()
+        except:
+            logging.error(Ta('Failed to close database, see log'))
+            logging.info("Traceback: ", exc_info = True)
+
+    @_queue_locked
+    def save_segments(self, path, nzf_id, article_db):
+        """ Store article table {partnum : (article, bytes)} of one file """
+        self.add('DELETE FROM segments WHERE path=? AND nzf_id=?', (path, nzf_id))
+        self.add('INSERT INTO segments (path, nzf_id, partnum, article, bytes) VALUES (?, ?, ?, ?, ?)',
+                 [(path, nzf_id, partnum, article_db[partnum][0], article_db[partnum][1]) for partnum in article_db],
+                 many=True)
+
+    @_queue_locked
+    def load_segments(self, path, nzf_id):
+        """ Return article table {partnum : (article, bytes)} of one file """
+        self.commit()
+        article_db = {}
+        if self.execute('SELECT partnum, article, bytes FROM segments WHERE path=? AND nzf_id=?', (path, nzf_id)):
+            for partnum, article, bytes in self.c.fetchall():
+                article_db[partnum] = (article, bytes)
+        return article_db
+
+    @_queue_locked
+    def remove_segments(self, path, nzf_id=None):
+        """ Remove articles of one file, or of all files in `path` """
+        if nzf_id:
+            self.add('DELETE FROM segments WHERE path=? AND nzf_id=?', (path, nzf_id))
+        else:
+            self.add('DELETE FROM segments WHERE path=?', (path,))
+
+    @_queue_locked
+    def save_job(self, nzo):
+        """ Store complete job, including a file list that can be queried separately """
+        if sabnzbd.cfg.use_pickle():
+            data = pickle.dumps(nzo, 2)
+        else:
+            data = cPickle.dumps(nzo, 2)
+        header = cPickle.dumps(nzo.header_info(), 2)
+        self.add("""INSERT OR REPLACE INTO jobs (nzo_id, position, name, filename, category, bytes, bytes_left,
+                    priority, status, avg_date, journal_seq, header, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                 (nzo.nzo_id, -1, nzo.final_name_pw_clean, nzo.filename, nzo.cat, nzo.bytes, nzo.remaining(),
+                  nzo.priority, nzo.status, int(nzo.avg_stamp or 0), nzo.journal_seq,
+                  sqlite3.Binary(header), sqlite3.Binary(data)))
+        files = [(nzf.nzf_id, nzo.nzo_id, nzf.filename or nzf.subject, nzf.bytes, nzf.bytes_left, 'active')
+                 for nzf in nzo.files]
+        for _set in nzo.extrapars:
+            files.extend([(nzf.nzf_id, nzo.nzo_id, nzf.filename or nzf.subject, nzf.bytes, nzf.bytes_left, 'queued')
+                          for nzf in nzo.extrapars[_set]])
+        files.extend([(nzf.nzf_id, nzo.nzo_id, nzf.filename or nzf.subject, nzf.bytes, 0, 'finished')
+                      for nzf in nzo.finished_files])
+        self.add('DELETE FROM files WHERE nzo_id=?', (nzo.nzo_id,))
+        self.add('INSERT INTO files (nzf_id, nzo_id, filename, bytes, bytes_left, status) VALUES (?, ?, ?, ?, ?, ?)',
+                 files, many=True)
+
+    @_queue_locked
+    def save_queue(self, nzo_ids, journal_seq):
+        """ Store order of the queue, drop jobs that are no longer in it """
+        self.add('UPDATE jobs SET position=-1')
+        self.add('UPDATE jobs SET position=? WHERE nzo_id=?',
+                 [(pos, nzo_id) for pos, nzo_id in enumerate(nzo_ids)], many=True)
+        self.add('DELETE FROM files WHERE nzo_id IN (SELECT nzo_id FROM jobs WHERE position<0)')
+        self.add('DELETE FROM jobs WHERE position<0')
+        self.add('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('journal_seq', str(journal_seq)))
+        return self.commit()
+
+    @_queue_locked
+    def load_headers(self):
+        """ Return list of (nzo_id, header-info) of all jobs in queue order
+            and the journal sequence number
+        """
+        self.commit()
+        headers = []
+        journal_seq = 0
+        if self.execute('SELECT value FROM meta WHERE key=?', ('journal_seq',)):
+            row = self.c.fetchone()
+            if row:
+                journal_seq = long(row[0])
+        if self.execute('SELECT nzo_id, header FROM jobs WHERE position>=0 ORDER BY position'):
+            for nzo_id, header in self.c.fetchall():
+                try:
+                    headers.append((nzo_id, cPickle.loads(str(header))))
+                except:
+                    headers.append((nzo_id, None))
+        return headers, journal_seq
+
+    @_queue_locked
+    def load_job_data(self, nzo_id):
+        """ Return the pickled job """
+        self.commit()
+        if self.execute('SELECT data FROM jobs WHERE nzo_id=?', (nzo_id,)):
+            row = self.c.fetchone()
+            if row:
+                return str(row[0])
+        return None
+
+    def load_job(self, nzo_id):
+        """ Return the job, unpickling is done outside the database lock """
+        data = self.load_job_data(nzo_id)
+        if data:
+            try:
+                if sabnzbd.cfg.use_pickle():
+                    return pickle.loads(data)
+                else:
+                    return cPickle.loads(data)
+            except:
+                logging.error(Ta('Loading %s failed'), nzo_id)
+                logging.info("Traceback: ", exc_info = True)
+        return None
+
+    @_queue_locked
+    def get_files(self, nzo_id, status=None):
+        """ Return list of (nzf_id, filename, bytes, bytes_left, status) of a job """
+        self.commit()
+        if status:
+            ok = self.execute('SELECT nzf_id, filename, bytes, bytes_left, status FROM files WHERE nzo_id=? AND status=?',
+                              (nzo_id, status))
+        else:
+            ok = self.execute('SELECT nzf_id, filename, bytes, bytes_left, status FROM files WHERE nzo_id=?', (nzo_id,))
+        if ok:
+            return self.c.fetchall()
+        return []
+
+
 def dict_factory(cursor, row):
     d = {}
     for idx, col in enumerate(cursor.description):
@@ -72,6 +72,7 @@ class Decoder(Thread):
 
     def run(self):
         from sabnzbd.nzbqueue import NzbQueue
+        from sabnzbd.assembler import check_encrypted_article
         while 1:
             sleep(0.001)
             art_tup = self.queue.get()
@@ -175,6 +176,9 @@ class Decoder(Thread):
                     found = False
 
             if data:
+                if article is nzf.initial_article and not nzo.encrypted:
+                    # RAR headers are in the first article, check them early
+                    check_encrypted_article(nzo, nzf, data)
                 ArticleCache.do.save_article(article, data)
 
             if register:
@@ -192,6 +196,9 @@ class Decoder(Thread):
 
         for server in self.servers:
             if server.active and not article.server_in_try_list(server):
+                if server.retention and not nzf.in_retention(server.retention):
+                    # File is too old for this server, it will never be asked
+                    continue
                 if server.fillserver:
                     fill_server_found = True
                 else:
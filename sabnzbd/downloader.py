@@ -26,6 +26,8 @@ from threading import Thread, RLock
 from nntplib import NNTPPermanentError
 import socket
 import random
+import heapq
+import weakref
 
 import sabnzbd
 from sabnzbd.decorators import synchronized, synchronized_CV, CV
@@ -36,7 +38,7 @@ from sabnzbd.constants import *
 import sabnzbd.config as config
 import sabnzbd.cfg as cfg
 from sabnzbd.bpsmeter import BPSMeter
-import sabnzbd.scheduler
+from sabnzbd.missingarticles import MissingArticles
 
 #------------------------------------------------------------------------------
 # Timeout penalty in minutes for each cause
@@ -50,10 +52,56 @@ _PENALTY_SHORT   = 1    # Minimal penalty when no_penalties is set
 
 TIMER_LOCK = RLock()
 
+_BURST_TIME = 0.25      # Seconds of data a bandwidth limit lets through at once
+_STATS_WEIGHT = 0.1     # Weight of a new sample in the server statistics
+_TUNE_INTERVAL = 30     # Seconds between connection tuning steps
+_TUNE_GAIN = 0.05       # Minimal relative speed gain to keep adding connections
+_KEEPALIVE = 60         # Seconds of idle time before a warm connection gets a DATE
+_MISS_SKIP = 0.5        # Miss rate above which a server waits while better servers have work
+
+def ewma(average, sample):
+    """ Exponentially weighted moving average, starting at the first sample """
+    if average is None:
+        return float(sample)
+    return average + _STATS_WEIGHT * (sample - average)
+
+#------------------------------------------------------------------------------
+class TokenBucket(object):
+    """ Bandwidth limiter, `rate` bytes per second (0 = no limit).
+        Tokens flow in at `rate` and are used by the received data.
+        A read may take more than available, the debt then holds
+        further reading until it is paid off.
+    """
+    def __init__(self, rate=0):
+        self.rate = 0.0
+        self.tokens = 0.0
+        self.stamp = time.time()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.rate = float(rate)
+        self.tokens = min(self.tokens, self.rate * _BURST_TIME)
+
+    def consume(self, bytes):
+        if self.rate:
+            self.tokens -= bytes
+
+    def delay(self, now):
+        """ Return seconds until reading is allowed again, 0 when allowed now """
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.rate * _BURST_TIME, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens > 0:
+            return 0.0
+        return -self.tokens / self.rate + 0.001
+
+
 #------------------------------------------------------------------------------
 class Server(object):
     def __init__(self, id, host, port, timeout, threads, fillserver, ssl, username = None,
-                 password = None, optional=False, retention=0):
+                 password = None, optional=False, retention=0, speedlimit=0,
+                 autotune=False, min_threads=1, bind_ips=None, compress=False):
         self.id = id
         self.newid = None
         self.restart = False
@@ -63,8 +111,14 @@ class Server(object):
         self.threads = threads
         self.fillserver = fillserver
         self.ssl = ssl
+        self.ssl_session = None # Last SSL session, for resumption where supported
         self.optional = optional
         self.retention = retention
+        self.bind_ips = bind_ips or []   # Local addresses to connect from
+        self.compress = compress         # Ask for COMPRESS DEFLATE after login
+        self.bytes_wire = 0              # Bytes received from the server
+        self.bytes_data = 0              # Same bytes after decompression
+        self.bucket = TokenBucket(speedlimit * 1024)
 
         self.username = username
         self.password = password
@@ -77,23 +131,154 @@ class Server(object):
         self.warning = ''
         self.info = None     # Will hold getaddrinfo() list
         self.request = False # True if a getaddrinfo() request is pending
+        self.next_ip = 0     # Turn of the next connection in the list of IPs
+        self.bad_ips = {}    # Time of the last failed connect per IP
         self.oddball = 'free.xsusenet.com' in host
 
+        # Measured performance, used for the order of article dispatch
+        self.ttfb = None        # Seconds between BODY and first data
+        self.speed = None       # Bytes/sec of one connection
+        self.miss_rate = None   # Fraction of missing articles
+        self.articles = 0
+
+        # Connection tuning, 'limit' is the number of connections in use
+        self.autotune = autotune
+        self.min_threads = max(1, min(min_threads, threads))
+        if autotune:
+            self.limit = max(self.min_threads, threads / 2)
+        else:
+            self.limit = threads
+        self.saturated = False  # All usable connections were busy
+        self.tune_dir = 1       # Direction of the next step, 0 when settled
+        self.tune_step = 0      # Last change of the limit
+        self.tune_reversals = 0
+        self.tune_rate = None
+        self.tune_bytes = 0
+        self.tune_errors = 0
+        self.tune_stamp = time.time()
+
         for i in range(threads):
             self.idle_threads.append(NewsWrapper(self, i+1))
 
     @property
     def hostip(self):
-        """ Return a random entry from the possible IPs
+        """ Return the address for the next connection.
+            Connections take turns over the possible IPs, skipping the ones
+            that failed recently. Pick at random when randomize_server_ip is set.
         """
-        if cfg.randomize_server_ip() and self.info and len(self.info) > 1:
-            rnd = random.randint(0, len(self.info)-1)
-            ip = self.info[rnd][4][0]
-            logging.debug('For server %s, using IP %s' % (self.host, ip))
+        if not (self.info and len(self.info) > 1):
+            return self.host
+        now = time.time()
+        ips = [entry[4][0] for entry in self.info]
+        good = [ip for ip in ips if self.bad_ips.get(ip, 0) < now - sabnzbd.newswrapper.DNS_TTL] or ips
+        if cfg.randomize_server_ip():
+            ip = random.choice(good)
         else:
-            ip = self.host
+            ip = good[self.next_ip % len(good)]
+            self.next_ip += 1
+        logging.debug('For server %s, using IP %s' % (self.host, ip))
         return ip
 
+    def source_address(self, af, thrdnum):
+        """ Return the local address for connection thrdnum to a server
+            address of family af. Connections are spread in turn over
+            the bind_ips of that family, None means the default route.
+        """
+        if af == socket.AF_INET6:
+            ips = [ip for ip in self.bind_ips if ':' in ip]
+        else:
+            ips = [ip for ip in self.bind_ips if ':' not in ip]
+        if not ips:
+            return None
+        return ips[(thrdnum - 1) % len(ips)]
+
+    def update_ttfb(self, seconds):
+        self.ttfb = ewma(self.ttfb, seconds)
+
+    def update_speed(self, bytes, seconds):
+        if seconds > 0:
+            self.speed = ewma(self.speed, bytes / seconds)
+
+    def count_article(self, found):
+        self.articles += 1
+        self.miss_rate = ewma(self.miss_rate, not found and 1.0 or 0.0)
+
+    def tune(self, now):
+        """ Move the number of used connections one step towards the best speed.
+            Going up is good when it adds enough speed, going down is good
+            as long as the speed doesn't drop. Reverse when a step isn't good,
+            after the second reversal undo a harmful step down and hold.
+            Hold until the speed drops, errors always reduce the number.
+            Return True when the number changed.
+        """
+        rate = self.tune_bytes / max(1.0, now - self.tune_stamp)
+        errors = self.tune_errors
+        saturated = self.saturated
+        self.tune_bytes = 0
+        self.tune_errors = 0
+        self.saturated = False
+        self.tune_stamp = now
+
+        old = self.limit
+        if errors:
+            self.tune_dir = -1
+            self.tune_reversals = 0
+        elif not saturated:
+            # Not enough work to learn anything
+            return False
+        elif self.tune_rate is not None:
+            good = True
+            if self.tune_dir == 0:
+                if rate < self.tune_rate * (1.0 - _TUNE_GAIN):
+                    # Conditions changed, start looking again
+                    self.tune_dir = 1
+                    self.tune_reversals = 0
+            elif self.tune_dir > 0:
+                good = rate >= self.tune_rate * (1.0 + _TUNE_GAIN)
+            else:
+                good = rate >= self.tune_rate * (1.0 - _TUNE_GAIN)
+            if self.tune_dir and not good:
+                self.tune_reversals += 1
+                if self.tune_reversals > 1:
+                    if self.tune_dir < 0:
+                        self.limit -= self.tune_step
+                    self.tune_dir = 0
+                else:
+                    self.tune_dir = -self.tune_dir
+        self.tune_rate = rate
+
+        step = max(1, self.limit / 4) * self.tune_dir
+        self.limit = max(self.min_threads, min(self.threads, self.limit + step))
+        self.tune_step = self.limit - old
+        return self.limit != old
+
+    @property
+    def score(self):
+        """ Expected useful bytes/sec of one connection,
+            servers without measurements come first
+        """
+        if self.speed is None:
+            return float('inf')
+        return self.speed * (1.0 - (self.miss_rate or 0.0))
+
+    def stats(self):
+        """ Return dictionary with the measured performance """
+        return { 'name' : self.id,
+                 'active' : int(self.active),
+                 'fillserver' : int(self.fillserver),
+                 'connections' : self.threads,
+                 'autotune' : int(self.autotune),
+                 'limit' : self.limit,
+                 'busy' : len(self.busy_threads),
+                 'ttfb' : self.ttfb is not None and '%.0f' % (self.ttfb * 1000.0) or '',
+                 'speed' : self.speed is not None and '%.1f' % (self.speed / 1024.0) or '',
+                 'miss_rate' : self.miss_rate is not None and '%.3f' % self.miss_rate or '',
+                 'articles' : self.articles,
+                 'compress' : int(self.compress),
+                 'bytes_wire' : self.bytes_wire,
+                 'bytes_data' : self.bytes_data
+               }
+
     def stop(self, readers, writers):
         for nw in self.idle_threads:
             try:
@@ -128,6 +313,8 @@ class Downloader(Thread):
 
         #used for throttling bandwidth and scheduling bandwidth changes
         self.bandwidth_limit = cfg.bandwidth_limit()
+        self.bucket = TokenBucket(self.bandwidth_limit * 1024)
+        self._job_buckets = weakref.WeakKeyDictionary()
         cfg.bandwidth_limit.callback(self.speed_set)
 
         # Used for reducing speed
@@ -142,12 +329,19 @@ class Downloader(Thread):
         self.__restart = 0
 
         self.force_disconnect = False
+        self.keep_warm = False
 
         self.read_fds = {}
         self.write_fds = {}
 
         self.servers = []
         self._timers = {}
+        # Heap of (stamp, seq, nw, server_id) for connection timeouts,
+        # waiting times before re-use and planned server restarts
+        self._heap = []
+        self._seq = 0
+        self._next_tune = time.time() + _TUNE_INTERVAL
+        self._next_keepalive = time.time() + _KEEPALIVE
 
         for server in config.get_servers():
             self.init_server(None, server)
@@ -174,12 +368,21 @@ class Downloader(Thread):
             timeout = srv.timeout()
             threads = srv.connections()
             fillserver = srv.fillserver()
+            ssl = srv.ssl()
+            if ssl and not sabnzbd.newswrapper.HAVE_SSL:
+                # Never fall back to a plain connection on the SSL port
+                logging.error(Ta('Server %s requires SSL, but this Python has no usable ssl module (2.7.9+ needed)'), newserver)
+                enabled = False
             primary = enabled and (not fillserver) and (threads > 0)
-            ssl = srv.ssl() and sabnzbd.newswrapper.HAVE_SSL
             username = srv.username()
             password = srv.password()
             optional = srv.optional()
             retention = float(srv.retention() * 24 * 3600) # days ==> seconds
+            speedlimit = srv.speedlimit()
+            autotune = srv.autotune()
+            min_threads = srv.min_connections()
+            bind_ips = srv.bind_ips()
+            compress = srv.compress()
             create = True
 
         if oldserver:
@@ -194,7 +397,8 @@ class Downloader(Thread):
 
         if create and enabled and host and port and threads:
             self.servers.append(Server(newserver, host, port, timeout, threads, fillserver, ssl,
-                                            username, password, optional, retention))
+                                            username, password, optional, retention, speedlimit,
+                                            autotune, min_threads, bind_ips, compress))
 
         return primary
 
@@ -219,7 +423,7 @@ class Downloader(Thread):
             if self.is_paused():
                 BPSMeter.do.reset()
             if cfg.autodisconnect():
-                self.disconnect()
+                self.disconnect(keep_warm=True)
             if save:
                 sabnzbd.save_state()
 
@@ -243,12 +447,16 @@ class Downloader(Thread):
         logging.info("Post-processing finished, resuming download")
         self.postproc = False
 
-    def disconnect(self):
+    def disconnect(self, keep_warm=False):
+        """ Close all connections, but keep the warm pool when keep_warm is set """
+        if not (keep_warm and self.force_disconnect):
+            self.keep_warm = keep_warm
         self.force_disconnect = True
 
     @synchronized_CV
     def limit_speed(self, value):
         self.bandwidth_limit = int(value)
+        self.bucket.set_rate(self.bandwidth_limit * 1024)
         logging.info("Bandwidth limit set to %s", value)
 
     def get_limit(self):
@@ -256,6 +464,7 @@ class Downloader(Thread):
 
     def speed_set(self):
         self.bandwidth_limit = cfg.bandwidth_limit()
+        self.bucket.set_rate(self.bandwidth_limit * 1024)
 
     def is_paused(self):
         from sabnzbd.nzbqueue import NzbQueue
@@ -274,6 +483,18 @@ class Downloader(Thread):
                 return True
         return False
 
+    def max_retention(self):
+        """ Longest retention of the active servers in seconds,
+            0 when one of them has no limit
+        """
+        longest = 0
+        for server in self.servers:
+            if server.active:
+                if not server.retention:
+                    return 0
+                longest = max(longest, server.retention)
+        return longest
+
     def maybe_block_server(self, server):
         from sabnzbd.nzbqueue import NzbQueue
         if server.optional and server.active and (server.bad_cons/server.threads) > 3:
@@ -302,16 +523,16 @@ class Downloader(Thread):
         BPSMeter.do.update()
 
         while 1:
-            for server in self.servers:
+            self.__fire_timers()
+            if time.time() > self._next_tune:
+                self.__tune_servers()
+            if time.time() > self._next_keepalive:
+                self.__keepalive()
+
+            order = self.__dispatch_order()
+            caps = self.__dispatch_caps(order)
+            for server in order:
                 assert isinstance(server, Server)
-                for nw in server.busy_threads[:]:
-                    if (nw.nntp and nw.nntp.error_msg) or (nw.timeout and time.time() > nw.timeout):
-                        if (nw.nntp and nw.nntp.error_msg):
-                            self.__reset_nw(nw, "", warn=False)
-                        else:
-                            self.__reset_nw(nw, "timed out")
-                        server.bad_cons += 1
-                        self.maybe_block_server(server)
                 if server.restart:
                     if not server.busy_threads:
                         newid = server.newid
@@ -329,18 +550,30 @@ class Downloader(Thread):
 
                 assert isinstance(server, Server)
                 if not server.idle_threads or server.restart or self.is_paused() or self.shutdown or self.delayed or self.postproc:
+                    if not server.idle_threads:
+                        server.saturated = True
                     continue
 
                 if not (server.active and NzbQueue.do.has_articles_for(server)):
                     continue
 
+                if self.__wait_for_better(server):
+                    continue
+
+                cap = caps.get(server, server.limit)
+                if len(server.busy_threads) >= cap:
+                    if cap >= server.limit:
+                        # All connections in use, the tuner may allow more
+                        server.saturated = True
+                    continue
+
                 for nw in server.idle_threads[:]:
                     assert isinstance(nw, NewsWrapper)
+                    if len(server.busy_threads) >= cap:
+                        break
                     if nw.timeout:
-                        if time.time() < nw.timeout:
-                            continue
-                        else:
-                            nw.timeout = None
+                        # Still waiting before re-use
+                        continue
 
                     if not server.active:
                         break
@@ -355,13 +588,20 @@ class Downloader(Thread):
                     if not article:
                         break
 
-                    if server.retention and article.nzf.nzo.avg_stamp < time.time() - server.retention:
-                        # Article too old for the server, treat as missing
+                    if not article.nzf.in_retention(server.retention):
+                        # Article too old for every server, treat as missing
                         if sabnzbd.LOG_ALL:
                             logging.debug('Article %s too old for %s:%s', article.article, server.host, server.port)
                         self.decoder.decode(article, None)
                         break
 
+                    if MissingArticles.do.known(article.article, server.id):
+                        # Server didn't have it the last time, treat as missing
+                        if sabnzbd.LOG_ALL:
+                            logging.debug('Article %s known missing on %s:%s', article.article, server.host, server.port)
+                        self.decoder.decode(article, None)
+                        continue
+
                     server.idle_threads.remove(nw)
                     server.busy_threads.append(nw)
 
@@ -374,6 +614,7 @@ class Downloader(Thread):
                             logging.info("%s@%s:%s: Initiating connection",
                                               nw.thrdnum, server.host, server.port)
                             nw.init_connect(self.write_fds)
+                            self.schedule(nw)
                         except:
                             logging.error(Ta('Failed to initialize %s@%s:%s'),
                                               nw.thrdnum, server.host,
@@ -401,20 +642,32 @@ class Downloader(Thread):
 
             if self.force_disconnect:
                 for server in self.servers:
+                    warm = self.__warm_threads(server)
                     for nw in server.idle_threads + server.busy_threads:
+                        if nw in warm:
+                            continue
                         quit = nw.connected and server.active
                         self.__reset_nw(nw, "forcing disconnect", warn=False, wait=False, quit=quit)
-                    # Make sure server address resolution is refreshed
-                    server.info = None
+                    if not warm:
+                        # Make sure server address resolution is refreshed
+                        server.info = None
+                self.keep_warm = False
 
                 self.force_disconnect = False
 
             # => Select
-            readkeys = self.read_fds.keys()
+            readkeys, wait = self.__readable()
             writekeys = self.write_fds.keys()
 
             if readkeys or writekeys:
-                read, write, error = select.select(readkeys, writekeys, (), 1.0)
+                # Windows reports a failed connect as an exception, not as writable
+                read, write, error = select.select(readkeys, writekeys, writekeys, min(wait, self.__poll_timeout()))
+                write = set(write).union(error)
+
+            elif self.read_fds:
+                # All reading is on hold because of the bandwidth limits
+                read, write, error = ([], [], [])
+                time.sleep(min(wait, self.__poll_timeout()))
 
             else:
                 read, write, error = ([], [], [])
@@ -426,13 +679,21 @@ class Downloader(Thread):
                 CV.acquire()
                 while (NzbQueue.do.is_empty() or self.is_paused() or self.delayed or self.postproc) and not \
                        self.shutdown and not self.__restart:
-                    CV.wait()
+                    # Bounded, planned server resumes and time-outs must still happen
+                    CV.wait(self.__poll_timeout())
+                    self.__fire_timers()
                 CV.release()
 
                 self.force_disconnect = False
 
             for selected in write:
-                nw = self.write_fds[selected]
+                nw = self.write_fds.get(selected)
+                if not nw:
+                    continue
+
+                if nw.nntp.connecting or nw.nntp.handshaking:
+                    self.__connect_step(nw)
+                    continue
 
                 fileno = nw.nntp.sock.fileno()
 
@@ -447,12 +708,17 @@ class Downloader(Thread):
                 continue
 
             for selected in read:
-                nw = self.read_fds[selected]
+                nw = self.read_fds.get(selected)
+                if not nw:
+                    continue
+                if nw.nntp.handshaking:
+                    self.__connect_step(nw)
+                    continue
+
                 article = nw.article
                 server = nw.server
-
-                if article:
-                    nzo = article.nzf.nzo
+                # Keepalive and login answers belong to no job
+                nzo = article and article.nzf.nzo or None
 
                 try:
                     bytes, done, skip = nw.recv_chunk()
@@ -468,20 +734,30 @@ class Downloader(Thread):
                     continue
 
                 else:
-                    if self.bandwidth_limit:
-                        bps = BPSMeter.do.get_bps()
-                        bps += bytes
-                        limit = self.bandwidth_limit * 1024
-                        if bps > limit:
-                            while BPSMeter.do.get_bps() > limit:
-                                time.sleep(0.05)
-                                BPSMeter.do.update()
+                    self.__consume(nw, bytes)
                     BPSMeter.do.update(server.id, bytes)
+                    server.tune_bytes += bytes
+                    if nw.sent:
+                        if not nw.received:
+                            server.update_ttfb(time.time() - nw.sent)
+                        nw.received += bytes
 
                     if nzo:
                         nzo.bytes_downloaded += bytes
                         nzo.update_avg_kbs(BPSMeter.do.get_bps())
 
+                if nw.keepalive:
+                    if nw.lines:
+                        # Answer to the keepalive, the connection can be used again
+                        nw.soft_reset()
+                        server.busy_threads.remove(nw)
+                        server.idle_threads.append(nw)
+                    continue
+
+                if nw.stat_list and nw.connected:
+                    self.__stat_results(nw)
+                    continue
+
                 if len(nw.lines) == 1:
                     code = nw.lines[0][:3]
                     if not nw.connected or code == '480':
@@ -512,6 +788,8 @@ class Downloader(Thread):
                                     self.__reset_nw(nw, None, warn=False, destroy=True, quit=True)
                                     self.plan_server(server.id, _PENALTY_TOOMANY)
                                     server.threads -= 1
+                                    server.limit = min(server.limit, server.threads)
+                                    server.tune_errors += 1
                             elif ecode in ('502', '481') and clues_too_many_ip(msg):
                                 # Account sharing?
                                 if server.active:
@@ -584,6 +862,7 @@ class Downloader(Thread):
                     elif code in ('411', '423', '430'):
                         done = True
                         nw.lines = None
+                        MissingArticles.do.add(article.article, server.id)
 
                         logging.info('Thread %s@%s:%s: Article ' + \
                                         '%s missing (error=%s)',
@@ -601,6 +880,9 @@ class Downloader(Thread):
 
                 if done:
                     server.bad_cons = 0 # Succesful data, clear "bad" counter
+                    server.count_article(nw.lines is not None)
+                    if nw.sent and nw.lines is not None:
+                        server.update_speed(nw.received, time.time() - nw.sent)
                     if sabnzbd.LOG_ALL:
                         logging.debug('Thread %s@%s:%s: %s done', nw.thrdnum, server.host,
                                        server.port, article.article)
@@ -610,6 +892,170 @@ class Downloader(Thread):
                     server.busy_threads.remove(nw)
                     server.idle_threads.append(nw)
 
+    def __warm_threads(self, server):
+        """ Return the idle, logged-in connections of server
+            that a disconnect should leave open
+        """
+        if not (self.keep_warm and server.active) or server.restart:
+            return []
+        warm = [nw for nw in server.idle_threads if nw.connected and not nw.timeout]
+        return warm[:cfg.warm_connections()]
+
+    def __keepalive(self):
+        """ Send a DATE on the warm connections of each server that were idle
+            for too long, so the server won't drop them
+        """
+        now = time.time()
+        self._next_keepalive = now + _KEEPALIVE / 4
+        count = cfg.warm_connections()
+        if not count:
+            return
+        for server in self.servers:
+            if not server.active or server.restart:
+                continue
+            warm = [nw for nw in server.idle_threads if nw.connected and not nw.timeout]
+            for nw in warm[:count]:
+                if nw.last_used > now - _KEEPALIVE:
+                    continue
+                server.idle_threads.remove(nw)
+                server.busy_threads.append(nw)
+                try:
+                    if sabnzbd.LOG_ALL:
+                        logging.debug('Thread %s@%s:%s: DATE', nw.thrdnum, server.host, server.port)
+                    nw.send_date()
+                    self.schedule(nw)
+                    self.read_fds[nw.nntp.sock.fileno()] = nw
+                except:
+                    self.__reset_nw(nw, "keepalive failed", warn=False, wait=False)
+
+    def __tune_servers(self):
+        """ Let each auto-tuned server adjust its number of connections,
+            closing idle connections that are no longer needed
+        """
+        now = time.time()
+        self._next_tune = now + _TUNE_INTERVAL
+        for server in self.servers:
+            if not (server.autotune and server.active) or server.restart:
+                continue
+            if server.tune(now):
+                logging.info('Server %s: using %s of %s connections (%.0f KB/s)',
+                             server.id, server.limit, server.threads, server.tune_rate / 1024.0)
+                connected = len(server.busy_threads)
+                for nw in server.idle_threads[:]:
+                    if nw.nntp:
+                        connected += 1
+                        if connected > server.limit:
+                            self.__reset_nw(nw, None, warn=False, wait=False, quit=True)
+
+    def __dispatch_order(self):
+        """ Servers in the order they get articles: the best useful
+            throughput first. How much work each gets in flight is set
+            by __dispatch_caps. Fill servers come last.
+        """
+        return sorted(self.servers, key=lambda server: (server.fillserver, -server.score))
+
+    def __dispatch_caps(self, order):
+        """ Return server -> connections it may have in flight, the limit
+            of each primary server scaled by its score relative to the best one.
+            Servers without measurements and fill servers keep their limit.
+        """
+        scores = [server.score for server in order
+                  if server.active and not server.fillserver and server.speed is not None]
+        best = scores and max(scores) or 0.0
+        caps = {}
+        for server in order:
+            if best > 0.0 and not server.fillserver and server.speed is not None:
+                caps[server] = max(1, int(round(server.limit * server.score / best)))
+        return caps
+
+    def __wait_for_better(self, server):
+        """ Return True when server misses too many articles
+            and another primary server with a better record still has work
+        """
+        from sabnzbd.nzbqueue import NzbQueue
+        if server.fillserver or (server.miss_rate or 0.0) <= _MISS_SKIP:
+            return False
+        for other in self.servers:
+            if other is not server and other.active and not other.fillserver and \
+               (other.miss_rate or 0.0) <= _MISS_SKIP and NzbQueue.do.has_articles_for(other):
+                return True
+        return False
+
+    def server_stats(self):
+        """ Return list with the measured performance of each server """
+        return [server.stats() for server in self.__dispatch_order()]
+
+    def __readable(self):
+        """ Return sockets that may be read now within the bandwidth limits
+            and the time until a held socket may be read again
+        """
+        now = time.time()
+        wait = self.bucket.delay(now)
+        if wait:
+            return [], wait
+        if not (self._job_buckets or [server for server in self.servers if server.bucket.rate]):
+            return self.read_fds.keys(), 1.0
+        keys = []
+        wait = 1.0
+        for fileno, nw in self.read_fds.iteritems():
+            delay = nw.server.bucket.delay(now)
+            if not delay and nw.article:
+                bucket = self._job_buckets.get(nw.article.nzf.nzo)
+                if bucket:
+                    delay = bucket.delay(now)
+            if delay:
+                wait = min(wait, delay)
+            else:
+                keys.append(fileno)
+        return keys, wait
+
+    def __consume(self, nw, bytes):
+        """ Charge received data to the bandwidth limits """
+        self.bucket.consume(bytes)
+        nw.server.bucket.consume(bytes)
+        if nw.article:
+            nzo = nw.article.nzf.nzo
+            if nzo.speed_limit:
+                bucket = self._job_buckets.get(nzo)
+                if not bucket:
+                    bucket = self._job_buckets[nzo] = TokenBucket()
+                bucket.set_rate(nzo.speed_limit * 1024)
+                bucket.consume(bytes)
+            elif nzo in self._job_buckets:
+                del self._job_buckets[nzo]
+
+    def __stat_results(self, nw):
+        """ Handle the responses to pipelined STAT commands.
+            Present articles are registered directly, missing ones go
+            through the decoder to find another server.
+        """
+        from sabnzbd.nzbqueue import NzbQueue
+        server = nw.server
+        while nw.lines and nw.stat_list:
+            line = nw.lines.pop(0)
+            code = line[:3]
+            if code not in ('223', '411', '423', '430'):
+                self.__reset_nw(nw, 'unexpected response to STAT: %s' % line)
+                return
+            article = nw.stat_list.pop(0)
+            nw.article = nw.stat_list and nw.stat_list[0] or None
+            server.count_article(code == '223')
+            if code == '223':
+                if sabnzbd.LOG_ALL:
+                    logging.debug('Article <%s> is present', article.article)
+                NzbQueue.do.register_article(article, True)
+            else:
+                logging.info('Thread %s@%s:%s: Article %s missing (error=%s)',
+                             nw.thrdnum, server.host, server.port, article.article, code)
+                MissingArticles.do.add(article.article, server.id)
+                self.decoder.decode(article, None)
+
+        if not nw.stat_list:
+            server.bad_cons = 0 # Succesful data, clear "bad" counter
+            nw.soft_reset()
+            server.busy_threads.remove(nw)
+            server.idle_threads.append(nw)
+
     def __lookup_nw(self, nw):
         ''' Find the fileno matching the nw, needed for closed connections '''
         for f in self.read_fds:
@@ -623,7 +1069,12 @@ class Downloader(Thread):
     def __reset_nw(self, nw, errormsg, warn=True, wait=True, destroy=False, quit=False):
         from sabnzbd.nzbqueue import NzbQueue
         server = nw.server
-        article = nw.article
+        if nw.stat_list:
+            articles = nw.stat_list
+        elif nw.article:
+            articles = [nw.article]
+        else:
+            articles = []
         fileno = None
 
         if nw.nntp:
@@ -652,7 +1103,7 @@ class Downloader(Thread):
         if fileno and fileno in self.read_fds:
             self.read_fds.pop(fileno)
 
-        if article:
+        for article in articles:
             if article.tries > cfg.max_art_tries() and (article.fetcher.optional or not cfg.max_art_opt()):
                 # Too many tries on this server, consider article missing
                 self.decoder.decode(article, None)
@@ -670,8 +1121,36 @@ class Downloader(Thread):
             nw.terminate(quit=quit)
         else:
             nw.hard_reset(wait, quit=quit)
+            self.schedule(nw)
+
+    def __connect_step(self, nw):
+        """ Drive the non-blocking connect and SSL handshake of nw,
+            moving its socket to the set of the event it waits for
+        """
+        fileno = nw.nntp.sock.fileno()
+        try:
+            want = nw.nntp.connect_step()
+        except (socket.error, sabnzbd.newswrapper.SSLError), err:
+            want = err
+        if fileno in self.write_fds:
+            self.write_fds.pop(fileno)
+        if fileno in self.read_fds:
+            self.read_fds.pop(fileno)
+        if isinstance(want, Exception):
+            # Logs the problem and expires the connection in the timer heap
+            nw.nntp.error(want)
+            return
+
+        fileno = nw.nntp.sock.fileno()
+
+        if want == 'write':
+            self.write_fds[fileno] = nw
+        else:
+            # Wait for more handshake data or for the server's greeting
+            self.read_fds[fileno] = nw
 
     def __request_article(self, nw):
+        from sabnzbd.nzbqueue import NzbQueue
         try:
             nzo = nw.article.nzf.nzo
             if cfg.send_group() and nzo.group != nw.group:
@@ -680,11 +1159,24 @@ class Downloader(Thread):
                     logging.debug('Thread %s@%s:%s: GROUP <%s>', nw.thrdnum, nw.server.host,
                                    nw.server.port, group)
                 nw.send_group(group)
+            elif nzo.precheck:
+                # Pre-check only needs status lines, so send a batch of STAT commands
+                articles = [nw.article]
+                for article in NzbQueue.do.get_articles(nw.server, nzo, PRECHECK_PIPELINE - 1):
+                    if MissingArticles.do.known(article.article, nw.server.id):
+                        self.decoder.decode(article, None)
+                    else:
+                        articles.append(article)
+                if sabnzbd.LOG_ALL:
+                    logging.debug('Thread %s@%s:%s: STAT %s articles', nw.thrdnum, nw.server.host,
+                                  nw.server.port, len(articles))
+                nw.stat(articles)
             else:
                 if sabnzbd.LOG_ALL:
                     logging.debug('Thread %s@%s:%s: BODY %s', nw.thrdnum, nw.server.host,
                                   nw.server.port, nw.article.article)
                 nw.body(nzo.precheck)
+            self.schedule(nw)
 
             fileno = nw.nntp.sock.fileno()
             if fileno not in self.read_fds:
@@ -697,6 +1189,78 @@ class Downloader(Thread):
             logging.info("Traceback: ", exc_info = True)
             self.__reset_nw(nw, "server broke off connection", quit=False)
 
+    #------------------------------------------------------------------------------
+    # Timer heap, shared by connection timeouts and planned server restarts.
+    # A connection has at most one live entry, its stamp is kept in nw.deadline.
+    # Because timeouts are only extended while data comes in, an entry
+    # that fires too early is simply put back with the new timeout.
+
+    def __push(self, stamp, nw, server_id):
+        self._seq += 1
+        heapq.heappush(self._heap, (stamp, self._seq, nw, server_id))
+
+    @synchronized(TIMER_LOCK)
+    def schedule(self, nw):
+        """ Make sure the timeout of `nw` is on the heap """
+        if nw.timeout and (nw.deadline is None or nw.timeout < nw.deadline):
+            nw.deadline = nw.timeout
+            self.__push(nw.timeout, nw, None)
+
+    @synchronized(TIMER_LOCK)
+    def expire(self, nw):
+        """ Handle `nw` at once, used when its connection failed """
+        nw.deadline = time.time()
+        self.__push(nw.deadline, nw, None)
+
+    @synchronized(TIMER_LOCK)
+    def __expired(self, now):
+        """ Pop all entries that are due, skipping outdated connection entries """
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            stamp, seq, nw, server_id = heapq.heappop(heap)
+            if nw:
+                if stamp != nw.deadline:
+                    continue
+                nw.deadline = None
+            due.append((stamp, nw, server_id))
+        return due
+
+    @synchronized(TIMER_LOCK)
+    def __poll_timeout(self):
+        """ Time to the next deadline, but never more than a second """
+        if self._heap:
+            return max(0.0, min(1.0, self._heap[0][0] - time.time()))
+        return 1.0
+
+    def __fire_timers(self):
+        """ Handle all timers that are due """
+        now = time.time()
+        for stamp, nw, server_id in self.__expired(now):
+            if not nw:
+                self.trigger_server(server_id, stamp)
+                continue
+            server = nw.server
+            busy = nw in server.busy_threads
+            if busy and nw.nntp and nw.nntp.error_msg:
+                self.__reset_nw(nw, "", warn=False)
+            elif not nw.timeout:
+                continue
+            elif nw.timeout > now:
+                self.schedule(nw)
+                continue
+            elif busy:
+                if nw.nntp and nw.nntp.connecting:
+                    nw.nntp.connect_failed()
+                self.__reset_nw(nw, "timed out")
+                server.tune_errors += 1
+            else:
+                # Waiting time before re-use is over
+                nw.timeout = None
+                continue
+            server.bad_cons += 1
+            self.maybe_block_server(server)
+
     #------------------------------------------------------------------------------
     # Timed restart of servers admin.
     # For each server all planned events are kept in a list.
@@ -713,11 +1277,11 @@ class Downloader(Thread):
         stamp = time.time() + 60.0 * interval
         self._timers[server_id].append(stamp)
         if interval:
-            sabnzbd.scheduler.plan_server(self.trigger_server, [server_id, stamp], interval)
+            self.__push(stamp, None, server_id)
 
     @synchronized(TIMER_LOCK)
     def trigger_server(self, server_id, timestamp):
-        """ Called by scheduler, start server if timer still valid """
+        """ Called from the timer heap, start server if timer still valid """
         logging.debug('Trigger planned server resume %s', server_id)
         if server_id in self._timers:
             if timestamp in self._timers[server_id]:
@@ -272,7 +272,7 @@ class MainPage(object):
             return panic_old_queue()
 
         if kwargs.get('skip_wizard') or config.get_servers():
-            info, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+            info, bytespersec = build_header(self.__prim, self.__web_dir)
 
             if cfg.newzbin_username() and cfg.newzbin_password.get_stars():
                 info['newzbinDetails'] = True
@@ -486,7 +486,7 @@ class NzoPage(object):
                 break
 
         if nzo_id and NzbQueue.do.get_nzo(nzo_id):
-            info, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+            info, bytespersec = build_header(self.__prim, self.__web_dir)
 
             # /SABnzbd_nzo_xxxxx/bulk_operation
             if 'bulk_operation' in args:
@@ -494,11 +494,11 @@ class NzoPage(object):
 
             # /SABnzbd_nzo_xxxxx/details
             elif 'details' in args:
-                info =  self.nzo_details(info, pnfo_list, nzo_id)
+                info =  self.nzo_details(info, nzo_id)
 
             # /SABnzbd_nzo_xxxxx/files
             elif 'files' in args:
-                info =  self.nzo_files(info, pnfo_list, nzo_id)
+                info =  self.nzo_files(info, nzo_id)
 
             # /SABnzbd_nzo_xxxxx/save
             elif 'save' in args:
@@ -507,8 +507,8 @@ class NzoPage(object):
 
             # /SABnzbd_nzo_xxxxx/
             else:
-                info =  self.nzo_details(info, pnfo_list, nzo_id)
-                info =  self.nzo_files(info, pnfo_list, nzo_id)
+                info =  self.nzo_details(info, nzo_id)
+                info =  self.nzo_files(info, nzo_id)
 
             template = Template(file=os.path.join(self.__web_dir, 'nzo.tmpl'),
                                 filter=FILTER, searchList=[info], compilerSettings=DIRECTIVES)
@@ -517,67 +517,57 @@ class NzoPage(object):
             # Job no longer exists, go to main page
             raise dcRaiser(cherrypy._urljoin(self.__root, '../queue/'), {})
 
-    def nzo_details(self, info, pnfo_list, nzo_id):
+    def nzo_details(self, info, nzo_id):
         slot = {}
-        n = 0
-        for pnfo in pnfo_list:
-            if pnfo[PNFO_NZO_ID_FIELD] == nzo_id:
-                nzo = sabnzbd.nzbqueue.get_nzo(nzo_id)
-                repair = pnfo[PNFO_REPAIR_FIELD]
-                unpack = pnfo[PNFO_UNPACK_FIELD]
-                delete = pnfo[PNFO_DELETE_FIELD]
-                unpackopts = sabnzbd.opts_to_pp(repair, unpack, delete)
-                script = pnfo[PNFO_SCRIPT_FIELD]
-                if script is None:
-                    script = 'None'
-                cat = pnfo[PNFO_EXTRA_FIELD1]
-                if not cat:
-                    cat = 'None'
-                filename = xml_name(nzo.final_name_pw_clean)
-                priority = pnfo[PNFO_PRIORITY_FIELD]
-
-                slot['nzo_id'] =  str(nzo_id)
-                slot['cat'] = cat
-                slot['filename'] = filename
-                slot['script'] = script
-                slot['priority'] = str(priority)
-                slot['unpackopts'] = str(unpackopts)
-                info['index'] = n
-                break
-            n += 1
+        nzo = sabnzbd.nzbqueue.get_nzo(nzo_id)
+        if nzo:
+            unpackopts = sabnzbd.opts_to_pp(nzo.repair, nzo.unpack, nzo.delete)
+            script = nzo.script
+            if script is None:
+                script = 'None'
+            cat = nzo.cat
+            if not cat:
+                cat = 'None'
+
+            slot['nzo_id'] =  str(nzo_id)
+            slot['cat'] = cat
+            slot['filename'] = xml_name(nzo.final_name_pw_clean)
+            slot['script'] = script
+            slot['priority'] = str(nzo.priority)
+            slot['unpackopts'] = str(unpackopts)
+            info['index'] = NzbQueue.do.get_position(nzo_id)
 
         info['slot'] = slot
         info['script_list'] = list_scripts()
         info['cat_list'] = list_cats()
-        info['noofslots'] = len(pnfo_list)
+        info['noofslots'] = NzbQueue.do.job_count()
 
         return info
 
-    def nzo_files(self, info, pnfo_list, nzo_id):
+    def nzo_files(self, info, nzo_id):
 
         active = []
-        for pnfo in pnfo_list:
-            if pnfo[PNFO_NZO_ID_FIELD] == nzo_id:
-                info['nzo_id'] = nzo_id
-                info['filename'] = xml_name(pnfo[PNFO_FILENAME_FIELD])
-
-                for tup in pnfo[PNFO_ACTIVE_FILES_FIELD]:
-                    bytes_left, bytes, fn, date, nzf_id = tup
-                    checked = False
-                    if nzf_id in self.__cached_selection and \
-                       self.__cached_selection[nzf_id] == 'on':
-                        checked = True
-
-                    line = {'filename':xml_name(fn),
-                            'mbleft':"%.2f" % (bytes_left / MEBI),
-                            'mb':"%.2f" % (bytes / MEBI),
-                            'size': format_bytes(bytes),
-                            'sizeleft':format_bytes(bytes_left),
-                            'nzf_id':nzf_id,
-                            'age':calc_age(date),
-                            'checked':checked}
-                    active.append(line)
-                break
+        nzo = sabnzbd.nzbqueue.get_nzo(nzo_id)
+        if nzo:
+            info['nzo_id'] = nzo_id
+            info['filename'] = xml_name(nzo.final_name_pw)
+
+            total, files = NzbQueue.do.get_files(nzo_id, ['active'])
+            for n, status, _set, bytes_left, bytes, fn, date, nzf_id in files:
+                checked = False
+                if nzf_id in self.__cached_selection and \
+                   self.__cached_selection[nzf_id] == 'on':
+                    checked = True
+
+                line = {'filename':xml_name(fn),
+                        'mbleft':"%.2f" % (bytes_left / MEBI),
+                        'mb':"%.2f" % (bytes / MEBI),
+                        'size': format_bytes(bytes),
+                        'sizeleft':format_bytes(bytes_left),
+                        'nzf_id':nzf_id,
+                        'age':calc_age(date),
+                        'checked':checked}
+                active.append(line)
 
         info['active_files'] = active
         return info
@@ -874,7 +864,7 @@ class HistoryPage(object):
         if failed_only is None:
             failed_only = self.__failed_only
 
-        history, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        history, bytespersec = build_header(self.__prim, self.__web_dir)
 
         history['isverbose'] = self.__verbose
         history['failed_only'] = failed_only
@@ -1032,7 +1022,7 @@ class ConfigPage(object):
     @cherrypy.expose
     def index(self, **kwargs):
         if not check_access(): return Protected()
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         conf['configfn'] = config.get_filename()
         conf['cmdline'] = sabnzbd.CMDLINE
@@ -1117,7 +1107,7 @@ class ConfigFolders(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         for kw in LIST_DIRPAGE:
             conf[kw] = config.get_config('misc', kw)()
@@ -1173,7 +1163,7 @@ class ConfigSwitches(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         conf['nt'] = sabnzbd.WIN32
         conf['have_nice'] = bool(sabnzbd.newsunpack.NICE_COMMAND)
@@ -1212,11 +1202,14 @@ SPECIAL_BOOL_LIST = \
               'queue_complete_pers', 'api_warnings', 'allow_64bit_tools', 'par2_multicore',
               'never_repair', 'allow_streaming', 'ignore_unrar_dates', 'rss_filenames', 'news_items',
               'osx_menu', 'osx_speed', 'win_menu', 'uniconfig', 'use_pickle', 'allow_incomplete_nzb',
-              'randomize_server_ip', 'no_ipv6', 'keep_awake', 'overwrite_files', 'empty_postproc'
+              'randomize_server_ip', 'no_ipv6', 'keep_awake', 'overwrite_files', 'empty_postproc',
+              'queue_journal', 'queue_db', 'lazy_queue', 'header_first'
             )
 SPECIAL_VALUE_LIST = \
             ( 'size_limit', 'folder_max_length', 'fsys_type', 'movie_rename_limit', 'nomedia_marker',
-              'req_completion_rate', 'wait_ext_drive', 'history_limit', 'show_sysload', 'ipv6_servers'
+              'req_completion_rate', 'wait_ext_drive', 'history_limit', 'show_sysload', 'ipv6_servers',
+              'precheck_sample', 'warm_connections', 'ipv6_test_host', 'pp_verify_jobs',
+              'pp_unpack_jobs', 'pp_finish_jobs'
             )
 SPECIAL_LIST_LIST = \
     ( 'rss_odd_titles', 'prio_sort_list'
@@ -1233,7 +1226,7 @@ class ConfigSpecial(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         conf['nt'] = sabnzbd.WIN32
 
@@ -1302,17 +1295,17 @@ class ConfigGeneral(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         conf['configfn'] = config.get_filename()
 
         # Temporary fix, problem with build_header
         conf['restart_req'] = sabnzbd.RESTART_REQ
 
-        if sabnzbd.newswrapper.HAVE_SSL:
-            conf['have_ssl'] = 1
+        if sabnzbd.misc.HAVE_PYOPENSSL:
+            conf['have_https'] = 1
         else:
-            conf['have_ssl'] = 0
+            conf['have_https'] = 0
 
         wlist = []
         wlist2 = ['None']
@@ -1484,12 +1477,13 @@ class ConfigServer(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         new = {}
         servers = config.get_servers()
         for svr in servers:
             new[svr] = servers[svr].get_dict(safe=True)
+            new[svr]['bind_ips'] = servers[svr].bind_ips.get_string()
             t, m, w, d = BPSMeter.do.amounts(svr)
             if t:
                 new[svr]['amounts'] = to_units(t), to_units(m), to_units(w), to_units(d)
@@ -1607,7 +1601,7 @@ def handle_server(kwargs, root=None, new_svr=False):
     if new_svr:
         server = unique_svr_name(server)
 
-    for kw in ('fillserver', 'ssl', 'enable', 'optional'):
+    for kw in ('fillserver', 'ssl', 'enable', 'optional', 'autotune', 'compress'):
         if kw not in kwargs.keys():
             kwargs[kw] = None
     if svr and not new_svr:
@@ -1643,7 +1637,7 @@ class ConfigRss(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         conf['script_list'] = list_scripts(default=True)
         pick_script = conf['script_list'] != []
@@ -1941,7 +1935,7 @@ class ConfigScheduling(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         actions = []
         actions.extend(_SCHED_ACTIONS)
@@ -2071,7 +2065,7 @@ class ConfigIndexers(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         conf['username_newzbin'] = cfg.newzbin_username()
         conf['password_newzbin'] = cfg.newzbin_password.get_stars()
@@ -2154,7 +2148,7 @@ class ConfigCats(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         if cfg.newzbin_username() and cfg.newzbin_password():
             conf['newzbinDetails'] = True
@@ -2228,7 +2222,7 @@ class ConfigSorting(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
         conf['complete_dir'] = cfg.complete_dir.get_path()
 
         for kw in SORT_LIST:
@@ -2279,7 +2273,7 @@ class Status(object):
     @cherrypy.expose
     def index(self, **kwargs):
         if not check_access(): return Protected()
-        header, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        header, bytespersec = build_header(self.__prim, self.__web_dir)
 
         header['logfile'] = sabnzbd.LOGFILE
         header['weblogfile'] = sabnzbd.WEBLOGFILE
@@ -2636,7 +2630,7 @@ class ConfigNotify(object):
         if cfg.configlock() or not check_access():
             return Protected()
 
-        conf, pnfo_list, bytespersec = build_header(self.__prim, self.__web_dir)
+        conf, bytespersec = build_header(self.__prim, self.__web_dir)
 
         conf['my_home'] = sabnzbd.DIR_HOME
         conf['lastmail'] = self.__lastmail
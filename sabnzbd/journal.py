@@ -0,0 +1,212 @@
+#!/usr/bin/python -OO
+# Copyright 2008-2012 The SABnzbd-Team <team@sabnzbd.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+sabnzbd.journal - append-only journal of queue mutations
+"""
+
+import os
+import logging
+import threading
+import cPickle
+
+import sabnzbd
+from sabnzbd.decorators import synchronized
+from sabnzbd.constants import JOURNAL_FILE_NAME, JOURNAL_COMPACT_SIZE
+import sabnzbd.cfg as cfg
+
+# Record types
+J_ARTICLE = 'article'      # (nzo_id, nzf_id, partnum, found, art_id)
+J_FILE = 'file'            # (nzo_id, nzf_id)
+J_PRIORITY = 'priority'    # (nzo_id, priority)
+J_ORDER = 'order'          # (nzo_ids,)
+
+JOURNAL_LOCK = threading.RLock()
+
+class QueueJournal(object):
+    """ Write-ahead journal for the download queue.
+        Small mutations are appended as records, so that a job does not
+        need to be pickled completely after each finished file.
+        A background compaction folds the records into fresh snapshots.
+    """
+    do = None
+
+    def __init__(self):
+        self.seq = 0L               # Sequence number of the last record
+        self.__fp = None
+        self.__size = 0
+        self.__compacting = False
+        QueueJournal.do = self
+
+    @property
+    def active(self):
+        return cfg.queue_journal()
+
+    @property
+    def path(self):
+        return os.path.join(cfg.admin_dir.get_path(), JOURNAL_FILE_NAME)
+
+    @property
+    def old_path(self):
+        return self.path + '.old'
+
+    @synchronized(JOURNAL_LOCK)
+    def set_seq(self, seq):
+        """ Continue numbering after `seq` (after reading the queue) """
+        self.seq = max(self.seq, long(seq or 0))
+
+    @synchronized(JOURNAL_LOCK)
+    def append(self, *record):
+        """ Append one record, return its sequence number """
+        if not self.active:
+            return 0L
+        self.seq += 1
+        try:
+            if not self.__fp:
+                self.__fp = open(self.path, 'ab')
+                self.__size = self.__fp.tell()
+            data = cPickle.dumps((self.seq, record), 2)
+            self.__fp.write(data)
+            self.__fp.flush()
+            self.__size += len(data)
+        except:
+            logging.error(Ta('Saving %s failed'), self.path)
+            logging.info("Traceback: ", exc_info = True)
+            self.__close()
+        if self.__size > JOURNAL_COMPACT_SIZE:
+            self.compact()
+        return self.seq
+
+    def article_done(self, article, found):
+        nzf = article.nzf
+        return self.append(J_ARTICLE, nzf.nzo.nzo_id, nzf.nzf_id, article.partnum, found, article.art_id)
+
+    def file_done(self, nzf):
+        return self.append(J_FILE, nzf.nzo.nzo_id, nzf.nzf_id)
+
+    def priority(self, nzo):
+        return self.append(J_PRIORITY, nzo.nzo_id, nzo.priority)
+
+    def order(self, nzo_ids):
+        return self.append(J_ORDER, nzo_ids)
+
+    def __close(self):
+        if self.__fp:
+            try:
+                self.__fp.close()
+            except:
+                pass
+        self.__fp = None
+        self.__size = 0
+
+    @synchronized(JOURNAL_LOCK)
+    def close(self):
+        self.__close()
+
+    @synchronized(JOURNAL_LOCK)
+    def reset(self):
+        """ Drop all records, called after a full snapshot of the queue """
+        self.__close()
+        for path in (self.path, self.old_path):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except:
+                logging.info('Failed to remove %s', path)
+
+    @synchronized(JOURNAL_LOCK)
+    def __rotate(self):
+        """ Move current journal aside, so that new records go into a fresh file.
+            An unfinished earlier compaction leaves its records in the old file,
+            these are kept by appending.
+        """
+        self.__close()
+        path = self.path
+        old = self.old_path
+        if not os.path.exists(path):
+            return
+        try:
+            if os.path.exists(old):
+                src = open(path, 'rb')
+                dst = open(old, 'ab')
+                dst.write(src.read())
+                dst.close()
+                src.close()
+                os.remove(path)
+            else:
+                os.rename(path, old)
+        except:
+            logging.error(Ta('Saving %s failed'), old)
+            logging.info("Traceback: ", exc_info = True)
+
+    def read(self, seq=0):
+        """ Return list of (seq, record) of all records newer than `seq` """
+        records = []
+        for path in (self.old_path, self.path):
+            if not os.path.exists(path):
+                continue
+            logging.info('Reading queue journal %s', path)
+            try:
+                f = open(path, 'rb')
+            except:
+                logging.error(Ta('Loading %s failed'), path)
+                continue
+            while True:
+                try:
+                    rec_seq, record = cPickle.load(f)
+                except EOFError:
+                    break
+                except:
+                    # Incomplete last record, written during a crash
+                    logging.info('Truncated record in %s', path)
+                    break
+                if rec_seq > seq:
+                    records.append((rec_seq, record))
+            f.close()
+        records.sort(key=lambda x: x[0])
+        if records:
+            self.set_seq(records[-1][0])
+        return records
+
+    def compact(self):
+        """ Start background compaction, unless one is already running """
+        if self.__compacting:
+            return
+        self.__compacting = True
+        self.__rotate()
+        thread = threading.Thread(target=self.__compact)
+        thread.setDaemon(True)
+        thread.start()
+
+    def __compact(self):
+        """ Fold rotated records into snapshots of the affected jobs """
+        try:
+            logging.debug('Compacting queue journal')
+            if sabnzbd.NzbQueue.do:
+                sabnzbd.NzbQueue.do.snapshot()
+                try:
+                    os.remove(self.old_path)
+                except:
+                    pass
+        except:
+            logging.error(Ta('Saving %s failed'), self.old_path)
+            logging.info("Traceback: ", exc_info = True)
+        self.__compacting = False
+
+
+### Create the instance
+QueueJournal()
@@ -31,11 +31,18 @@ import socket
 import time
 import glob
 import stat
+import math
 try:
     socket.ssl
     _HAVE_SSL = True
 except:
     _HAVE_SSL = False
+try:
+    # HTTPS access to the web interface needs pyOpenSSL (CherryPy and certificates)
+    from OpenSSL import crypto
+    HAVE_PYOPENSSL = True
+except ImportError:
+    HAVE_PYOPENSSL = False
 
 import sabnzbd
 from sabnzbd.decorators import synchronized
@@ -1077,6 +1084,21 @@ def int_conv(value):
     return value
 
 
+def wilson_interval(hits, total, z=1.96):
+    """ Return (low, high) bounds of the fraction hits/total,
+        Wilson score interval (default 95% confidence)
+    """
+    if total < 1:
+        return 0.0, 1.0
+    total = float(total)
+    p = hits / total
+    z2 = z * z
+    center = p + z2 / (2 * total)
+    spread = z * math.sqrt(p * (1 - p) / total + z2 / (4 * total * total))
+    div = 1 + z2 / total
+    return max(0.0, (center - spread) / div), min(1.0, (center + spread) / div)
+
+
 #------------------------------------------------------------------------------
 # Diskfree
 if sabnzbd.WIN32:
@@ -0,0 +1,110 @@
+#!/usr/bin/python -OO
+# Copyright 2008-2012 The SABnzbd-Team <team@sabnzbd.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+sabnzbd.missingarticles - Registry of articles known to be missing on a server
+"""
+
+import time
+import logging
+import threading
+
+import sabnzbd
+from sabnzbd.decorators import synchronized
+from sabnzbd.constants import MISSING_FILE_NAME, MISSING_MAX, MISSING_TTL
+
+
+MISSING_LOCK = threading.Lock()
+class MissingArticles(object):
+    """ Remembers which server didn't have which message-id,
+        so retried jobs and duplicates don't ask for them again.
+        Entries expire after MISSING_TTL, at most MISSING_MAX are kept.
+    """
+    do = None
+
+    def __init__(self):
+        self.__table = {}       # (message-id, server-id) -> time of the miss
+        self.__changed = False
+        self.hits = 0           # Requests skipped because of the registry
+        self.added = 0          # Misses recorded since startup
+        MissingArticles.do = self
+
+    @synchronized(MISSING_LOCK)
+    def add(self, article, server_id):
+        """ Record that server_id doesn't have message-id article """
+        self.__table[(article, server_id)] = time.time()
+        self.__changed = True
+        self.added += 1
+        if len(self.__table) > MISSING_MAX:
+            self.__prune()
+
+    @synchronized(MISSING_LOCK)
+    def known(self, article, server_id):
+        """ Return True when server_id is known to miss message-id article """
+        stamp = self.__table.get((article, server_id))
+        if stamp is None:
+            return False
+        if stamp < time.time() - MISSING_TTL:
+            del self.__table[(article, server_id)]
+            self.__changed = True
+            return False
+        self.hits += 1
+        return True
+
+    def __prune(self):
+        """ Drop expired entries, then the oldest ones down to 90% of MISSING_MAX """
+        limit = time.time() - MISSING_TTL
+        table = dict([(key, stamp) for key, stamp in self.__table.iteritems() if stamp >= limit])
+        if len(table) > MISSING_MAX * 9 / 10:
+            keep = sorted(table.iteritems(), key=lambda item: item[1])[-(MISSING_MAX * 9 / 10):]
+            table = dict(keep)
+        logging.debug('Pruned missing-article registry from %s to %s entries', len(self.__table), len(table))
+        self.__table = table
+
+    @synchronized(MISSING_LOCK)
+    def stats(self):
+        """ Return dictionary with the size and the counters """
+        return { 'entries' : len(self.__table),
+                 'hits' : self.hits,
+                 'added' : self.added
+               }
+
+    @synchronized(MISSING_LOCK)
+    def __changes(self):
+        """ Return a copy of the table when it changed since the last save """
+        if self.__changed:
+            self.__changed = False
+            return self.__table.copy()
+        return None
+
+    def save(self):
+        """ Save admin to disk """
+        data = self.__changes()
+        if data is not None:
+            sabnzbd.save_admin(data, MISSING_FILE_NAME)
+
+    @synchronized(MISSING_LOCK)
+    def read(self):
+        """ Read admin from disk, dropping expired entries """
+        data = sabnzbd.load_admin(MISSING_FILE_NAME)
+        if isinstance(data, dict):
+            limit = time.time() - MISSING_TTL
+            self.__table = dict([(key, stamp) for key, stamp in data.iteritems() if stamp >= limit])
+            logging.debug('Loaded %s known missing articles', len(self.__table))
+
+
+MissingArticles()
@@ -19,8 +19,11 @@
 sabnzbd.newswrapper
 """
 
+import os
+import zlib
 import errno
 import socket
+import threading
 from threading import Thread
 from nntplib import NNTPPermanentError
 import time
@@ -31,28 +34,27 @@ from sabnzbd.constants import *
 import sabnzbd.cfg
 
 try:
-    from OpenSSL import SSL
-    _ssl = SSL
-    WantReadError = _ssl.WantReadError
-    del SSL
-    HAVE_SSL = True
-
+    import ssl
+    # Non-blocking handshakes need SSLContext and the SSLWant* exceptions (Python 2.7.9+)
+    HAVE_SSL = hasattr(ssl, 'SSLContext') and hasattr(ssl, 'SSLWantReadError')
 except ImportError:
-    _ssl = None
     HAVE_SSL = False
 
-    # Dummy class so this exception is ignored by clients without ssl installed
-    class WantReadError(Exception):
-        def __init__(self, value):
-            self.parameter = value
-        def __str__(self):
-            return repr(self.parameter)
-
-import threading
-_RLock = threading.RLock
-del threading
+# Session reuse needs SSLSocket.session (Python 3.6+ style), use it when present
+HAVE_SESSIONS = HAVE_SSL and hasattr(ssl.SSLSocket, 'session')
 
-import select
+if HAVE_SSL:
+    WantReadError = ssl.SSLWantReadError
+    WantWriteError = ssl.SSLWantWriteError
+    SSLError = ssl.SSLError
+else:
+    # Dummy classes so these exceptions are ignored by clients without ssl
+    class WantReadError(Exception):
+        pass
+    class WantWriteError(Exception):
+        pass
+    class SSLError(Exception):
+        pass
 
 
 socket.setdefaulttimeout(DEF_TIMEOUT)
@@ -61,7 +63,12 @@ socket.setdefaulttimeout(DEF_TIMEOUT)
 #------------------------------------------------------------------------------
 # getaddrinfo() can be very slow. In some situations this can lead
 # to delayed starts and timeouts on connections.
-# Because of this, the results will be cached in the server object.
+# Because of this, the results will be cached in the server object
+# and, for DNS_TTL seconds, in a resolver cache shared by all lookups.
+
+DNS_TTL = 300
+_DNS_CACHE = {}     # (host, port) -> (stamp, getaddrinfo() result)
+_DNS_LOCK = threading.Lock()
 
 def _retrieve_info(server):
     """ Async attempt to run getaddrinfo() for specified server
@@ -77,15 +84,39 @@ def _retrieve_info(server):
 
 
 def request_server_info(server):
-    """ Launch async request to resolve server address
+    """ Launch async request to resolve server address,
+        use the resolver cache when it has a fresh answer
     """
     if not server.request:
+        info = GetServerParms(server.host, server.port, cached_only=True)
+        if info:
+            (server.info, server.bad_cons) = (info, 0)
+            return
         server.request = True
         Thread(target=_retrieve_info, args=(server,)).start()
 
 
-def GetServerParms(host, port):
+def interleave(ips):
+    """ Alternate between address families, starting with the family
+        of the first entry and keeping the resolver's order within each
+        family (Happy Eyeballs, RFC 6555)
+    """
+    v6 = [ip for ip in ips if ip[0] == socket.AF_INET6]
+    v4 = [ip for ip in ips if ip[0] != socket.AF_INET6]
+    if ips and ips[0][0] == socket.AF_INET6:
+        first, second = v6, v4
+    else:
+        first, second = v4, v6
+    result = []
+    for n in xrange(max(len(v4), len(v6))):
+        result.extend(first[n:n+1])
+        result.extend(second[n:n+1])
+    return result
+
+
+def GetServerParms(host, port, cached_only=False):
     """ Return processed getaddrinfo() for server
+        With cached_only, return None instead of doing a lookup
     """
     try:
         int(port)
@@ -94,15 +125,33 @@ def GetServerParms(host, port):
     opt = sabnzbd.cfg.ipv6_servers()
     try:
         # Standard IPV4 or IPV6
-        ips = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
-        if opt == 2 or (_EXTERNAL_IPV6 and opt == 1):
+        _DNS_LOCK.acquire()
+        try:
+            stamp, ips = _DNS_CACHE.get((host, port), (0, None))
+        finally:
+            _DNS_LOCK.release()
+        if stamp < time.time() - DNS_TTL:
+            if cached_only:
+                return None
+            ips = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+            _DNS_LOCK.acquire()
+            try:
+                _DNS_CACHE[(host, port)] = (time.time(), ips)
+            finally:
+                _DNS_LOCK.release()
+        if opt == 1 and cached_only and external_ipv6(wait=False) is None:
+            # Don't wait for the IPv6 probe here, let the lookup thread do that
+            return None
+        if opt == 2 or (opt == 1 and external_ipv6()):
             # IPv6 reachable and allowed, or forced by user
-            return ips
+            return interleave(ips)
         else:
             # IPv6 unreachable or not allowed by user
             return [ip for ip in ips if ':' not in ip[4][0]]
     except:
-        if opt == 2 or (_EXTERNAL_IPV6 and opt == 1):
+        if cached_only:
+            return None
+        if opt == 2 or (opt == 1 and external_ipv6()):
             try:
                 # Try IPV6 explicitly
                 return socket.getaddrinfo(host, port, socket.AF_INET6,
@@ -113,42 +162,43 @@ def GetServerParms(host, port):
         return None
 
 
-def con(sock, host, port, sslenabled, write_fds, nntp):
-    assert isinstance(nntp, NNTP)
-    try:
-        sock.connect((host, port))
-        sock.setblocking(0)
-        if sslenabled and _ssl:
-            while True:
-                try:
-                    sock.do_handshake()
-                    break
-                except WantReadError:
-                    select.select([sock], [], [], 1.0)
-
-        # Now it's safe to add the socket to the list of active sockets.
-        # 'write_fds' is an attribute of the Downloader singleton.
-        # This direct access is needed to prevent multi-threading sync problems.
-        if write_fds is not None:
-            write_fds[sock.fileno()] = nntp.nw
-
-    except socket.error, e:
+#------------------------------------------------------------------------------
+# One SSL context per protocol setting, shared by all connections
+
+_CONTEXTS = {}
+
+def ssl_context():
+    """ Return the client SSL context for the current ssl_type setting
+    """
+    ssl_type = sabnzbd.cfg.ssl_type.get()
+    ctx = _CONTEXTS.get(ssl_type)
+    if ctx is None:
+        # Some users benefit from SSLv2 not being capped.
+        protocol = None
+        if ssl_type == 'v2':
+            protocol = getattr(ssl, 'PROTOCOL_SSLv2', None)
+        elif ssl_type == 'v3':
+            protocol = getattr(ssl, 'PROTOCOL_SSLv3', None)
+        if protocol is None:
+            if ssl_type in ('v2', 'v3'):
+                logging.warning(Ta('SSL type %s is not supported by the OpenSSL library, using v23'), ssl_type)
+            protocol = ssl.PROTOCOL_SSLv23
+        ctx = ssl.SSLContext(protocol)
+        ctx.verify_mode = ssl.CERT_NONE
+        _CONTEXTS[ssl_type] = ctx
+    return ctx
+
+
+def _is_ip(host):
+    """ Return True when host is a literal IPv4 or IPv6 address """
+    for af in (socket.AF_INET, socket.AF_INET6):
         try:
-            # socket.error can either return a string or a tuple
-            if isinstance(e, tuple):
-                (_errno, strerror) = e
-            else:
-                # Are we safe to hardcode the ETIMEDOUT error?
-                (_errno, strerror) = (errno.ETIMEDOUT, str(e))
-                e = (_errno, strerror)
-            #expected, do nothing
-            if _errno == errno.EINPROGRESS:
-                pass
-        finally:
-            nntp.error(e)
+            socket.inet_pton(af, host)
+            return True
+        except (socket.error, ValueError, AttributeError):
+            pass
+    return False
 
-    except _ssl.Error, e:
-        nntp.error(e)
 
 class NNTP(object):
     def __init__(self, host, port, info, sslenabled, nw, user=None, password=None, block=False, write_fds=None):
@@ -158,50 +208,46 @@ class NNTP(object):
         self.nw = nw
         self.blocking = block
         self.error_msg = None
+        self.connecting = False     # Non-blocking TCP connect still in progress
+        self.handshaking = False    # SSL handshake still in progress
+        self.sslenabled = sslenabled
         if not info:
             if block:
                 info = GetServerParms(host, port)
             else:
                 raise socket.error(errno.EADDRNOTAVAIL, "Address not available - Check for internet or DNS problems")
 
-        af, socktype, proto, canonname, sa = info[0]
+        # Start with the address picked by server.hostip, the others
+        # are the fallbacks when connecting to it fails
+        self.addresses = list(info)
+        for n in xrange(len(info)):
+            if info[n][4][0] == host:
+                self.addresses = info[n:] + info[:n]
+                break
+        self.address = None
 
-        if sslenabled and _ssl:
-            # Some users benefit from SSLv2 not being capped.
-            ssl_type = sabnzbd.cfg.ssl_type.get()
-            if ssl_type == 'v2':
-                ctx = _ssl.Context(_ssl.SSLv2_METHOD)
-            elif ssl_type == 'v3':
-                ctx = _ssl.Context(_ssl.SSLv3_METHOD)
-            else:
-                ctx = _ssl.Context(_ssl.SSLv23_METHOD)
-
-            self.sock = SSLConnection(ctx, socket.socket(af, socktype, proto))
-        elif sslenabled and not _ssl:
-            logging.error(Ta('Error importing OpenSSL module. Connecting with NON-SSL'))
-            self.sock = socket.socket(af, socktype, proto)
-        else:
-            self.sock = socket.socket(af, socktype, proto)
+        if sslenabled and not HAVE_SSL:
+            # Never fall back to a plain connection on the SSL port
+            raise socket.error(errno.EPROTONOSUPPORT, 'SSL not available, Python 2.7.9+ with ssl support is required')
 
         try:
-            # Windows must do the connection in a seperate thread due to non-blocking issues
-            # If the server wants to be blocked (for testing) then use the linux route
-            if not block:
-                Thread(target=con, args=(self.sock, self.host, self.port, sslenabled, write_fds, self)).start()
-            else:
-                # if blocking (server test) only wait for 4 seconds during connect until timeout
-                if block:
-                    self.sock.settimeout(10)
+            if block:
+                af, socktype, proto, canonname, sa = info[0]
+                self.sock = socket.socket(af, socktype, proto)
+                # if blocking (server test) only wait for 10 seconds during connect until timeout
+                self.sock.settimeout(10)
                 self.sock.connect((self.host, self.port))
-                if not block:
-                    self.sock.setblocking(0)
-                if sslenabled and _ssl:
-                    while True:
-                        try:
-                            self.sock.do_handshake()
-                            break
-                        except WantReadError:
-                            select.select([self.sock], [], [], 1.0)
+                if self.sslenabled:
+                    self.sock = ssl_context().wrap_socket(self.sock, server_hostname=self.server_name())
+            else:
+                # Start the connect and let the downloader's poller drive
+                # the rest of it through connect_step()
+                self.sock = None
+                self.connect_next()
+                # 'write_fds' is an attribute of the Downloader singleton,
+                # the socket becomes writable once the connect is finished.
+                if write_fds is not None:
+                    write_fds[self.sock.fileno()] = nw
 
         except socket.error, e:
             try:
@@ -218,11 +264,89 @@ class NNTP(object):
             finally:
                 self.error(e)
 
-        except _ssl.Error, e:
+        except SSLError, e:
             self.error(e)
 
+    def connect_next(self):
+        """ Start a non-blocking connect to the next address,
+            raise socket.error when none is left
+        """
+        while True:
+            if self.sock:
+                try:
+                    self.sock.close()
+                except:
+                    pass
+            af, socktype, proto, canonname, sa = self.addresses.pop(0)
+            self.address = sa[0]
+            self.sock = socket.socket(af, socktype, proto)
+            self.sock.setblocking(0)
+            self.nw.recv = self.sock.recv
+            source = self.nw.server.source_address(af, self.nw.thrdnum)
+            if source:
+                self.sock.bind((source, 0))
+            _errno = self.sock.connect_ex(sa)
+            if _errno in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035):
+                self.connecting = True
+                return
+            self.connect_failed()
+            if not self.addresses:
+                raise socket.error(_errno, os.strerror(_errno))
+
+    def connect_failed(self):
+        """ Remember that the current address failed """
+        self.nw.server.bad_ips[self.address] = time.time()
+
+    def server_name(self):
+        """ Host name to send for SNI, None for literal addresses """
+        host = self.nw.server.host
+        if _is_ip(host):
+            return None
+        return host
+
+    def connect_step(self):
+        """ Advance a non-blocking connect and SSL handshake.
+            Return 'read' or 'write' for the event to wait for,
+            or None when the connection is ready for the server's greeting.
+            The socket changes when falling back to another address.
+            Raises socket.error or SSLError when the connection fails.
+        """
+        if self.connecting:
+            _errno = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if _errno:
+                self.connect_failed()
+                if not self.addresses:
+                    raise socket.error(_errno, os.strerror(_errno))
+                # Fall back to the next address
+                self.connect_next()
+                return 'write'
+            self.connecting = False
+            if not self.sslenabled:
+                return None
+            kwargs = {}
+            if HAVE_SESSIONS and self.nw.server.ssl_session:
+                kwargs['session'] = self.nw.server.ssl_session
+            self.sock = ssl_context().wrap_socket(self.sock, do_handshake_on_connect=False,
+                                                  server_hostname=self.server_name(), **kwargs)
+            self.nw.recv = self.sock.recv
+            self.handshaking = True
+
+        try:
+            self.sock.do_handshake()
+        except WantReadError:
+            return 'read'
+        except WantWriteError:
+            return 'write'
+        self.handshaking = False
+        if HAVE_SESSIONS:
+            # Keep the session, so the next connection can resume it
+            self.nw.server.ssl_session = self.sock.session
+        return None
+
     def error(self, error):
-        if 'SSL23_GET_SERVER_HELLO' in str(error):
+        error_str = str(error).upper()
+        if 'SSL23_GET_SERVER_HELLO' in error_str or 'WRONG_VERSION_NUMBER' in error_str or \
+           'UNKNOWN_PROTOCOL' in error_str:
             error = 'This server does not allow SSL on this port'
         msg = "Failed to connect: %s" % (str(error))
         msg = "%s %s@%s:%s" % (msg, self.nw.thrdnum, self.host, self.port)
@@ -232,6 +356,9 @@ class NNTP(object):
         else:
             logging.info(msg)
             self.nw.server.warning = msg
+            from sabnzbd.downloader import Downloader
+            if Downloader.do:
+                Downloader.do.expire(self.nw)
 
 class NewsWrapper(object):
     def __init__(self, server, thrdnum, block=False):
@@ -240,7 +367,13 @@ class NewsWrapper(object):
         self.blocking = block
 
         self.timeout = None
+        self.deadline = None        # Stamp of this connection's entry in the timer heap
         self.article = None
+        self.stat_list = []         # Articles with a pipelined STAT command
+        self.sent = None            # Time the BODY command was sent
+        self.received = 0           # Bytes received for the current BODY
+        self.keepalive = False      # Waiting for the answer to a keepalive DATE
+        self.last_used = time.time()
         self.data = ''
         self.lines = []
 
@@ -258,6 +391,11 @@ class NewsWrapper(object):
         self.pass_ok = False
         self.force_login = False
 
+        self.compress_sent = False  # Waiting for the answer to COMPRESS DEFLATE
+        self.compress_done = False  # Negotiation of compression is over
+        self.compressor = None      # Deflate streams, when compression is active
+        self.decompressor = None
+
     def init_connect(self, write_fds):
         self.nntp = NNTP(self.server.hostip, self.server.port, self.server.info, self.server.ssl, self,
                          self.server.username, self.server.password, self.blocking, write_fds)
@@ -266,6 +404,21 @@ class NewsWrapper(object):
         self.timeout = time.time() + self.server.timeout
 
     def finish_connect(self, code):
+        if self.compress_sent:
+            # Answer to COMPRESS DEFLATE (RFC 8054), anything but 206 means no compression
+            self.compress_sent = False
+            self.compress_done = True
+            if code == '206':
+                self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                logging.debug('Compression active on %s@%s:%s', self.thrdnum, self.server.host, self.server.port)
+            else:
+                logging.info('Server %s:%s does not support compression: %s',
+                             self.server.host, self.server.port, self.lines and self.lines[0])
+            self.connected = True
+            self.timeout = time.time() + self.server.timeout
+            return
+
         if not (self.server.username or self.server.password or self.force_login):
             self.connected = True
             self.user_sent = True
@@ -292,7 +445,7 @@ class NewsWrapper(object):
             raise NNTPPermanentError(self.lines[0])
         elif not self.user_sent:
             command = 'authinfo user %s\r\n' % (self.server.username)
-            self.nntp.sock.sendall(command)
+            self.send(command)
             self.user_sent = True
         elif not self.user_ok:
             if code == '381':
@@ -306,7 +459,7 @@ class NewsWrapper(object):
 
         if self.user_ok and not self.pass_sent:
             command = 'authinfo pass %s\r\n' % (self.server.password)
-            self.nntp.sock.sendall(command)
+            self.send(command)
             self.pass_sent = True
         elif self.user_ok and not self.pass_ok:
             if code != '281':
@@ -315,22 +468,52 @@ class NewsWrapper(object):
             else:
                 self.connected = True
 
+        if self.connected and self.server.compress and not self.compress_done:
+            # Logged in, ask for compression before the first real command
+            self.connected = False
+            self.compress_sent = True
+            self.send('COMPRESS DEFLATE\r\n')
+
         self.timeout = time.time() + self.server.timeout
 
+    def send(self, data):
+        """ Send a command, compressed when compression is active """
+        if self.compressor:
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.nntp.sock.sendall(data)
+
     def body(self, precheck):
         self.timeout = time.time() + self.server.timeout
+        if not precheck:
+            self.sent = time.time()
+            self.received = 0
         if precheck:
             command = 'STAT <%s>\r\n' % (self.article.article)
         elif self.server.oddball:
             command = 'ARTICLE <%s>\r\n' % (self.article.article)
         else:
             command = 'BODY <%s>\r\n' % (self.article.article)
-        self.nntp.sock.sendall(command)
+        self.send(command)
+
+    def stat(self, articles):
+        """ Send STAT commands for all articles in one go,
+            the responses are handled in the same order
+        """
+        self.timeout = time.time() + self.server.timeout
+        self.stat_list = articles
+        command = ''.join(['STAT <%s>\r\n' % article.article for article in articles])
+        self.send(command)
+
+    def send_date(self):
+        """ Send DATE to keep an idle connection alive """
+        self.timeout = time.time() + self.server.timeout
+        self.keepalive = True
+        self.send('DATE\r\n')
 
     def send_group(self, group):
         self.timeout = time.time() + self.server.timeout
         command = 'GROUP %s\r\n' % (group)
-        self.nntp.sock.sendall(command)
+        self.send(command)
 
     def recv_chunk(self, block=False):
         """ Receive data, return #bytes, done, skip
@@ -350,7 +533,15 @@ class NewsWrapper(object):
                 else:
                     return (0, False, True)
 
-        self.data += chunk
+        # Count bytes on the wire against the bytes of NNTP data
+        self.server.bytes_wire += len(chunk)
+        if self.decompressor and chunk:
+            data = self.decompressor.decompress(chunk)
+        else:
+            data = chunk
+        self.server.bytes_data += len(data)
+
+        self.data += data
         new_lines = self.data.split('\r\n')
         # See if incorrect newline-only was used
         # Do this as a special case to prevent using extra memory
@@ -370,6 +561,11 @@ class NewsWrapper(object):
     def soft_reset(self):
         self.timeout = None
         self.article = None
+        self.stat_list = []
+        self.keepalive = False
+        self.last_used = time.time()
+        self.sent = None
+        self.received = 0
         self.data = ''
         self.lines = []
 
@@ -377,7 +573,7 @@ class NewsWrapper(object):
         if self.nntp:
             try:
                 if quit:
-                    self.nntp.sock.sendall('QUIT\r\n')
+                    self.send('QUIT\r\n')
                     time.sleep(0.1)
                 self.nntp.sock.close()
             except:
@@ -398,7 +594,7 @@ class NewsWrapper(object):
         if self.nntp:
             try:
                 if quit:
-                    self.nntp.sock.sendall('QUIT\r\n')
+                    self.send('QUIT\r\n')
                     time.sleep(0.1)
                 self.nntp.sock.close()
             except:
@@ -406,32 +602,11 @@ class NewsWrapper(object):
         del self.nntp
 
 
-class SSLConnection(object):
-    def __init__(self, *args):
-        self._ssl_conn = apply(_ssl.Connection, args)
-        self._lock = _RLock()
-
-    for f in ('get_context', 'pending', 'send', 'write', 'recv', 'read',
-              'renegotiate', 'bind', 'listen', 'connect', 'accept',
-              'setblocking', 'fileno', 'shutdown', 'close', 'get_cipher_list',
-              'getpeername', 'getsockname', 'getsockopt', 'setsockopt',
-              'makefile', 'get_app_data', 'set_app_data', 'state_string',
-              'sock_shutdown', 'get_peer_certificate', 'want_read',
-              'want_write', 'set_connect_state', 'set_accept_state',
-              'connect_ex', 'sendall', 'do_handshake', 'settimeout'):
-        exec """def %s(self, *args):
-            self._lock.acquire()
-            try:
-                return apply(self._ssl_conn.%s, args)
-            finally:
-                self._lock.release()\n""" % (f, f)
-
-
 def test_ipv6():
     """ Check if external IPv6 addresses are reachable """
-    # Use google.com to test IPv6 access
+    # Use google.com (or the ipv6_test_host setting) to test IPv6 access
     try:
-        info = socket.getaddrinfo('www.google.com', 80, socket.AF_INET6, socket.SOCK_STREAM,
+        info = socket.getaddrinfo(sabnzbd.cfg.ipv6_test_host(), 80, socket.AF_INET6, socket.SOCK_STREAM,
                                   socket.IPPROTO_IP, socket.AI_CANONNAME)
     except socket.gaierror:
         return False
@@ -446,4 +621,39 @@ def test_ipv6():
     except socket.error:
         return False
 
-_EXTERNAL_IPV6 = test_ipv6()
+
+#------------------------------------------------------------------------------
+# The IPv6 probe takes up to 4 seconds on hosts without IPv6,
+# so it only runs when a lookup needs it and then in its own thread.
+
+_EXTERNAL_IPV6 = None       # Result of test_ipv6(), None while unknown
+_IPV6_PROBE = None          # Thread running test_ipv6()
+_IPV6_LOCK = threading.Lock()
+
+def _run_ipv6_probe():
+    global _EXTERNAL_IPV6
+    try:
+        _EXTERNAL_IPV6 = test_ipv6()
+    except:
+        _EXTERNAL_IPV6 = False
+    logging.debug('External IPv6 reachable: %s', _EXTERNAL_IPV6)
+
+
+def external_ipv6(wait=True):
+    """ Return True when external IPv6 addresses are reachable.
+        Starts the probe on first use. Without wait, return None
+        while the probe is still running.
+    """
+    global _IPV6_PROBE
+    if _EXTERNAL_IPV6 is None:
+        _IPV6_LOCK.acquire()
+        try:
+            if _IPV6_PROBE is None:
+                _IPV6_PROBE = Thread(target=_run_ipv6_probe)
+                _IPV6_PROBE.setDaemon(True)
+                _IPV6_PROBE.start()
+        finally:
+            _IPV6_LOCK.release()
+        if wait:
+            _IPV6_PROBE.join()
+    return _EXTERNAL_IPV6
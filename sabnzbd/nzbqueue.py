@@ -23,19 +23,24 @@ import os
 import logging
 import time
 import datetime
+import cPickle
+import pickle
+from multiprocessing.pool import ThreadPool
 
 import sabnzbd
 from sabnzbd.trylist import TryList
-from sabnzbd.nzbstuff import NzbObject
+from sabnzbd.nzbstuff import NzbObject, NzbHeader
 from sabnzbd.misc import exit_sab, cat_to_opts, \
-                         get_admin_path, remove_all, globber
+                         get_admin_path, remove_all, globber, int_conv
 from sabnzbd.panic import panic_queue
 import sabnzbd.database as database
 from sabnzbd.decorators import NZBQUEUE_LOCK, synchronized, synchronized_CV
 from sabnzbd.constants import QUEUE_FILE_NAME, QUEUE_VERSION, FUTURE_Q_FOLDER, JOB_ADMIN, \
                               LOW_PRIORITY, NORMAL_PRIORITY, HIGH_PRIORITY, TOP_PRIORITY, \
                               REPAIR_PRIORITY, STOP_PRIORITY, VERIFIED_FILE, \
-                              PNFO_BYTES_FIELD, PNFO_BYTES_LEFT_FIELD, Status
+                              QUEUE_LOAD_THREADS, QNFO_VERSION_FIELD, QNFO_PNFO_LIST_FIELD, \
+                              PNFO_STATUS_FIELD, PNFO_BYTES_LEFT_FIELD, PNFO_NZO_ID_FIELD, \
+                              PNFO_ACTIVE_FILES_FIELD, Status
 import sabnzbd.cfg as cfg
 from sabnzbd.articlecache import ArticleCache
 import sabnzbd.downloader
@@ -43,6 +48,7 @@ from sabnzbd.assembler import Assembler, file_has_articles
 import sabnzbd.growler as growler
 from sabnzbd.encoding import latin1, platform_encode
 from sabnzbd.bpsmeter import BPSMeter
+from sabnzbd.journal import QueueJournal, J_ARTICLE, J_FILE, J_PRIORITY, J_ORDER
 
 #-------------------------------------------------------------------------------
 
@@ -59,6 +65,19 @@ class NzbQueue(TryList):
         self.__nzo_list = []
         self.__nzo_table = {}
 
+        # Running totals (bytes, bytes_left, active jobs, active real jobs)
+        # and the share of each job in it
+        self.__totals = (0, 0, 0, 0)
+        self.__job_totals = {}
+
+        # Read-only snapshot for the API, see queue_snapshot()
+        self.__version = 0
+        self.__dirty = set()
+        self.__pnfo_cache = {}
+        self.__snapshot = None
+
+        self.__positions = None     # nzo_id -> index in __nzo_list, see __position()
+
         NzbQueue.do = self
 
     def read_queue(self, repair):
@@ -67,13 +86,26 @@ class NzbQueue(TryList):
             1 = use existing queue, add missing "incomplete" folders
             2 = Discard all queue admin, reconstruct from "incomplete" folders
         """
-        nzo_ids = []
-        if repair < 2:
+        entries = []
+        from_db = False
+        queue_seq = 0
+        if repair < 2 and use_queue_db():
+            # Read the queue from the database
+            from_db = True
+            rows, queue_seq = database.get_queue_handle().load_headers()
+            for nzo_id, info in rows:
+                entries.append(('', nzo_id, info))
+        elif repair < 2:
             # Read the queue from the saved files
             data = sabnzbd.load_admin(QUEUE_FILE_NAME)
             if data:
+                nzo_ids = []
+                headers = {}
                 try:
-                    queue_vers, nzo_ids, dummy = data
+                    queue_vers, nzo_ids, extra = data
+                    if isinstance(extra, dict):
+                        queue_seq = extra.get('journal_seq', 0)
+                        headers = extra.get('headers', {})
                     if not queue_vers == QUEUE_VERSION:
                         nzo_ids = []
                         logging.error(Ta('Incompatible queuefile found, cannot proceed'))
@@ -86,21 +118,48 @@ class NzbQueue(TryList):
                                   os.path.join(cfg.cache_dir.get_path(), QUEUE_FILE_NAME))
                     if not repair:
                         return
+                for nzo_id in nzo_ids:
+                    folder, _id = os.path.split(nzo_id)
+                    entries.append((folder, _id, headers.get(_id)))
+
+        # Only jobs without a usable header are loaded now, in parallel
+        # The others are loaded when needed by the downloader or the API
+        # Leaving the database needs all jobs, they are saved as files
+        if cfg.lazy_queue() and (cfg.queue_db() or not from_db):
+            todo = [entry for entry in entries if not usable_header(entry[2])]
+        else:
+            todo = entries
+        jobs = self.__read_jobs(todo, from_db)
 
         # First handle jobs in the queue file
         folders = []
-        for nzo_id in nzo_ids:
-            folder, _id = os.path.split(nzo_id)
-            # Try as normal job
-            path = get_admin_path(bool(folder), folder, False)
-            nzo = sabnzbd.load_data(_id, path, remove=False)
-            if not nzo:
-                # Try as future job
-                path = get_admin_path(bool(folder), folder, True)
-                nzo = sabnzbd.load_data(_id, path)
-            if nzo:
-                self.add(nzo, save=False, quiet=True)
+        for folder, _id, info in entries:
+            if (folder, _id) in jobs:
+                nzo = jobs[(folder, _id)]
+                if not (nzo or from_db):
+                    # Try as future job
+                    path = get_admin_path(bool(folder), folder, True)
+                    nzo = sabnzbd.load_data(_id, path)
+                if nzo:
+                    self.add(nzo, save=False, quiet=True)
+                    folders.append(folder)
+            else:
+                header = NzbHeader(info, from_db)
+                self.__nzo_table[header.nzo_id] = header
+                self.__insert(header)
+                self.__set_totals(header)
                 folders.append(folder)
+        logging.info('Queue has %s jobs, %s loaded', len(entries), len(jobs))
+
+        # Apply the changes made after the last snapshot
+        QueueJournal.do.set_seq(queue_seq)
+        if repair < 2 and self.replay_journal(queue_seq):
+            self.save()
+        elif from_db != bool(cfg.queue_db()):
+            # Move queue between files and the database
+            self.save()
+        else:
+            QueueJournal.do.reset()
 
         # Scan for any folders in "incomplete" that are not yet in the queue
         if repair:
@@ -198,31 +257,205 @@ class NzbQueue(TryList):
             targetpos = self.__nzo_list.index(nzo)
             self.__nzo_list[targetpos] = new_nzo
             self.__nzo_list.pop(pos)
+            self.__positions = None
             del self.__nzo_table[nzo.nzo_id]
+            self.__set_totals(nzo, remove=True)
             del nzo
         except:
             logging.error('Failed to restart NZB after pre-check (%s)', nzo.nzo_id)
             logging.info("Traceback: ", exc_info = True)
             return
 
+    @synchronized(NZBQUEUE_LOCK)
+    def replay_journal(self, queue_seq):
+        """ Apply journal records that are newer than the loaded snapshots,
+            return True when anything was replayed
+        """
+        records = QueueJournal.do.read()
+        if not records:
+            return False
+        logging.info('Replaying %s queue journal records', len(records))
+        for seq, record in records:
+            try:
+                kind = record[0]
+                if kind == J_ORDER:
+                    if seq > queue_seq:
+                        self.__set_order(record[1])
+                    continue
+                nzo = self.__nzo_table.get(record[1])
+                if not nzo or nzo.deleted or seq <= (nzo.journal_seq or 0):
+                    continue
+                nzo = self.__load(nzo)
+                if not nzo:
+                    continue
+                if kind == J_ARTICLE:
+                    self.__replay_article(nzo, *record[2:])
+                elif kind == J_FILE:
+                    nzf = nzo.get_nzf_by_id(record[2])
+                    if nzf and nzf in nzo.files:
+                        nzo.remove_nzf(nzf)
+                        nzo.handle_par2(nzf, file_done=True)
+                        if not nzo.files:
+                            self.end_job(nzo)
+                elif kind == J_PRIORITY:
+                    self.__set_priority(nzo.nzo_id, record[2])
+            except:
+                logging.info('Skipping bad journal record %s', seq)
+                logging.info("Traceback: ", exc_info = True)
+        return True
+
+    def __replay_article(self, nzo, nzf_id, partnum, found, art_id):
+        """ Register an article from the journal, but only when its data
+            is still available (or not needed)
+        """
+        nzf = nzo.get_nzf_by_id(nzf_id)
+        if not nzf or nzf not in nzo.files:
+            return
+        if found and not nzo.precheck:
+            if not (art_id and os.path.exists(os.path.join(nzo.workpath, art_id))):
+                return
+        if not nzf.import_finished:
+            nzf.finish_import()
+        article = nzf.decodetable.get(partnum)
+        if article is None or article not in nzf.articles:
+            return
+        if found and art_id:
+            article.art_id = art_id
+            nzo.saved_articles.append(article)
+
+        file_done, post_done, reset = nzo.remove_article(article, found)
+        if file_done and not nzo.precheck and nzf.filename and nzf.type:
+            Assembler.do.process((nzo, nzf))
+        if post_done:
+            self.end_job(nzo)
+
+    def __set_order(self, nzo_ids):
+        """ Put jobs in the order of the list of nzo_ids """
+        new_list = [self.__nzo_table[nzo_id] for nzo_id in nzo_ids if nzo_id in self.__nzo_table]
+        present = set([nzo.nzo_id for nzo in new_list])
+        for nzo in self.__nzo_list:
+            if nzo.nzo_id not in present:
+                new_list.append(nzo)
+        self.__nzo_list = new_list
+        self.__positions = None
+        self.__touch()
+
+    def __read_jobs(self, entries, from_db):
+        """ Load complete jobs for list of (folder, nzo_id, header-info),
+            using a thread pool. Return dictionary (folder, nzo_id) -> nzo or None
+        """
+        if not entries:
+            return {}
+
+        def read(entry):
+            folder, _id, info = entry
+            if from_db:
+                return database.get_queue_handle().load_job(_id)
+            else:
+                return read_job_file(_id, get_admin_path(bool(folder), folder, False))
+
+        pool = ThreadPool(min(QUEUE_LOAD_THREADS, len(entries)))
+        try:
+            nzos = pool.map(read, entries)
+        finally:
+            pool.close()
+        return dict(zip([entry[:2] for entry in entries], nzos))
+
+    def __load(self, nzo):
+        """ Return the complete job for `nzo`, which may just be its header.
+            A header is replaced by the loaded job, None is returned when loading fails.
+        """
+        if not isinstance(nzo, NzbHeader):
+            return nzo
+        logging.debug('Loading job %s', nzo.nzo_id)
+        if nzo.from_db:
+            job = database.get_queue_handle().load_job(nzo.nzo_id)
+        else:
+            job = sabnzbd.load_data(nzo.nzo_id, nzo.workpath, remove=False)
+        if job:
+            pos = self.__position(nzo.nzo_id)
+            if pos >= 0:
+                self.__nzo_list[pos] = job
+            self.__nzo_table[job.nzo_id] = job
+            self.__set_totals(job)
+            self.__touch(job)
+        else:
+            logging.error(Ta('Error loading %s, corrupt file detected'), nzo.workpath)
+            nzo.deleted = True
+            self.__nzo_table.pop(nzo.nzo_id, None)
+            self.__set_totals(nzo, remove=True)
+            if nzo in self.__nzo_list:
+                self.__nzo_list.remove(nzo)
+                self.__positions = None
+        return job
+
+    def __save_nzo(self, nzo):
+        """ Save one nzo, marking which journal records it contains """
+        nzo.journal_seq = QueueJournal.do.seq
+        if cfg.queue_db():
+            database.get_queue_handle().save_job(nzo)
+        else:
+            sabnzbd.save_data(nzo, nzo.nzo_id, nzo.workpath)
+        if not nzo.futuretype:
+            nzo.save_attribs()
+
+    def __journal_order(self):
+        self.__positions = None
+        self.__touch()
+        if QueueJournal.do.active:
+            QueueJournal.do.order([nzo.nzo_id for nzo in self.__nzo_list])
+
     @synchronized(NZBQUEUE_LOCK)
     def save(self, save_nzo=None):
         """ Save queue, all nzo's or just the specified one """
         logging.info("Saving queue")
+        if sabnzbd.LOG_ALL:
+            self.__check_totals()
 
         nzo_ids = []
+        headers = {}
         # Aggregate nzo_ids and save each nzo
         for nzo in self.__nzo_list:
             if nzo.new_caching:
                 nzo_ids.append(os.path.join(nzo.work_name, nzo.nzo_id))
             else:
                 nzo_ids.append(nzo.nzo_id)
+            if isinstance(nzo, NzbHeader):
+                # Job was not loaded, so the saved copy is still valid
+                headers[nzo.nzo_id] = nzo.info
+                continue
+            headers[nzo.nzo_id] = nzo.header_info()
             if save_nzo is None or nzo is save_nzo:
-                sabnzbd.save_data(nzo, nzo.nzo_id, nzo.workpath)
-                if not nzo.futuretype:
-                    nzo.save_attribs()
+                self.__save_nzo(nzo)
 
-        sabnzbd.save_admin((QUEUE_VERSION, nzo_ids, []), QUEUE_FILE_NAME)
+        if cfg.queue_db():
+            database.get_queue_handle().save_queue([nzo.nzo_id for nzo in self.__nzo_list], QueueJournal.do.seq)
+        else:
+            sabnzbd.save_admin((QUEUE_VERSION, nzo_ids, {'journal_seq' : QueueJournal.do.seq, 'headers' : headers}),
+                               QUEUE_FILE_NAME)
+        if save_nzo is None:
+            # Full snapshot, the journal is no longer needed
+            QueueJournal.do.reset()
+
+    def snapshot(self):
+        """ Save all jobs and the queue file, one job at a time,
+            so that the downloader is not blocked for the whole queue
+        """
+        NZBQUEUE_LOCK.acquire()
+        try:
+            nzos = self.__nzo_list[:]
+        finally:
+            NZBQUEUE_LOCK.release()
+        for nzo in nzos:
+            NZBQUEUE_LOCK.acquire()
+            try:
+                if not (nzo.deleted or isinstance(nzo, NzbHeader)):
+                    self.__save_nzo(nzo)
+                    if cfg.queue_db():
+                        database.get_queue_handle().commit()
+            finally:
+                NZBQUEUE_LOCK.release()
+        self.save('x')
 
     @synchronized(NZBQUEUE_LOCK)
     def set_top_only(self, value):
@@ -263,6 +496,7 @@ class NzbQueue(TryList):
                 try:
                     future.__init__(filename, msgid, pp, scr, nzb=data, futuretype=False, cat=categ, priority=priority, nzbname=nzbname, nzo_info=nzo_info)
                     future.nzo_id = nzo_id
+                    self.__set_totals(future)
                     self.save(future)
                 except ValueError:
                     self.remove(nzo_id, False)
@@ -286,43 +520,72 @@ class NzbQueue(TryList):
             logging.info("Item %s no longer in queue, omitting",
                          nzo_id)
 
+    def __get_job(self, nzo_id):
+        """ Return the complete job for `nzo_id` or None """
+        if nzo_id in self.__nzo_table:
+            # Caller may change the job
+            nzo = self.__load(self.__nzo_table[nzo_id])
+            self.__touch(nzo)
+            return nzo
+        else:
+            return None
+
     @synchronized(NZBQUEUE_LOCK)
     def change_opts(self, nzo_ids, pp):
         for nzo_id in [item.strip() for item in nzo_ids.split(',')]:
-            if nzo_id in self.__nzo_table:
-                self.__nzo_table[nzo_id].set_pp(pp)
+            nzo = self.__get_job(nzo_id)
+            if nzo:
+                nzo.set_pp(pp)
 
     @synchronized(NZBQUEUE_LOCK)
     def change_script(self, nzo_ids, script):
         for nzo_id in [item.strip() for item in nzo_ids.split(',')]:
-            if nzo_id in self.__nzo_table:
-                self.__nzo_table[nzo_id].script = script
+            nzo = self.__get_job(nzo_id)
+            if nzo:
+                nzo.script = script
 
     @synchronized(NZBQUEUE_LOCK)
     def change_cat(self, nzo_ids, cat):
         for nzo_id in [item.strip() for item in nzo_ids.split(',')]:
-            if nzo_id in self.__nzo_table:
-                nzo = self.__nzo_table[nzo_id]
+            nzo = self.__get_job(nzo_id)
+            if nzo:
                 nzo.cat, pp, nzo.script, prio = cat_to_opts(cat)
                 nzo.set_pp(pp)
                 self.set_priority(nzo_id, prio)
 
     @synchronized(NZBQUEUE_LOCK)
     def change_name(self, nzo_id, name):
-        if nzo_id in self.__nzo_table:
-            nzo = self.__nzo_table[nzo_id]
+        nzo = self.__get_job(nzo_id)
+        if nzo:
             if not nzo.futuretype:
                 nzo.set_final_name_pw(name)
             else:
                 # Reset url fetch wait time
                 nzo.wait = None
 
+    @synchronized(NZBQUEUE_LOCK)
+    def change_speed_limit(self, nzo_id, limit):
+        """ Set bandwidth limit of job in KB/s (0 = none) """
+        nzo = self.__get_job(nzo_id)
+        if nzo:
+            nzo.speed_limit = max(0, int_conv(limit))
+            return True
+        return False
+
     @synchronized(NZBQUEUE_LOCK)
     def get_nzo(self, nzo_id):
-        if nzo_id in self.__nzo_table:
-            return self.__nzo_table[nzo_id]
+        return self.__get_job(nzo_id)
+
+    @synchronized(NZBQUEUE_LOCK)
+    def get_files(self, nzo_id, statuses=None, start=0, limit=0):
+        """ Return (total, files) for one page of the file list of a job,
+            see NzbObject.gather_files
+        """
+        nzo = self.__load(self.__nzo_table.get(nzo_id))
+        if nzo:
+            return nzo.gather_files(statuses, start, limit)
         else:
-            return None
+            return 0, []
 
     @synchronized(NZBQUEUE_LOCK)
     def add(self, nzo, save=True, quiet=False):
@@ -341,34 +604,9 @@ class NzbQueue(TryList):
 
         if nzo.nzo_id:
             nzo.deleted = False
-            priority = nzo.priority
             self.__nzo_table[nzo.nzo_id] = nzo
-            if priority > HIGH_PRIORITY:
-                #Top and repair priority items are added to the top of the queue
-                self.__nzo_list.insert(0, nzo)
-            elif priority == LOW_PRIORITY:
-                self.__nzo_list.append(nzo)
-            else:
-                #for high priority we need to add the item at the bottom
-                #of any other high priority items above the normal priority
-                #for normal priority we need to add the item at the bottom
-                #of the normal priority items above the low priority
-                if self.__nzo_list:
-                    pos = 0
-                    added = False
-                    for position in self.__nzo_list:
-                        if position.priority < priority:
-                            self.__nzo_list.insert(pos, nzo)
-                            added = True
-                            break
-                        pos += 1
-                    if not added:
-                        #if there are no other items classed as a lower priority
-                        #then it will be added to the bottom of the queue
-                        self.__nzo_list.append(nzo)
-                else:
-                    #if the queue is empty then simple append the item to the bottom
-                    self.__nzo_list.append(nzo)
+            self.__insert(nzo)
+            self.__set_totals(nzo)
             if save:
                 self.save(nzo)
 
@@ -379,12 +617,54 @@ class NzbQueue(TryList):
             self.sort_by_avg_age()
         return nzo.nzo_id
 
+    def __insert(self, nzo):
+        """ Put job in the list, at the position that matches its priority """
+        self.__positions = None
+        priority = nzo.priority
+        if priority > HIGH_PRIORITY:
+            #Top and repair priority items are added to the top of the queue
+            self.__nzo_list.insert(0, nzo)
+        elif priority == LOW_PRIORITY:
+            self.__nzo_list.append(nzo)
+        else:
+            #for high priority we need to add the item at the bottom
+            #of any other high priority items above the normal priority
+            #for normal priority we need to add the item at the bottom
+            #of the normal priority items above the low priority
+            if self.__nzo_list:
+                pos = 0
+                added = False
+                for position in self.__nzo_list:
+                    if position.priority < priority:
+                        self.__nzo_list.insert(pos, nzo)
+                        added = True
+                        break
+                    pos += 1
+                if not added:
+                    #if there are no other items classed as a lower priority
+                    #then it will be added to the bottom of the queue
+                    self.__nzo_list.append(nzo)
+            else:
+                #if the queue is empty then simple append the item to the bottom
+                self.__nzo_list.append(nzo)
+
+    def __get_removable(self, nzo_id, full=False):
+        """ Return job or header for `nzo_id` that can be removed,
+            the job is only loaded when `full` or when its header can't clean up
+        """
+        nzo = self.__nzo_table.get(nzo_id)
+        if isinstance(nzo, NzbHeader) and (full or not nzo.new_caching or nzo.futuretype):
+            nzo = self.__load(nzo)
+        return nzo
+
     @synchronized(NZBQUEUE_LOCK)
     def remove(self, nzo_id, add_to_history = True, save=True, cleanup=True, keep_basic=False, del_files=False):
-        if nzo_id in self.__nzo_table:
+        if self.__get_removable(nzo_id, full=add_to_history):
             nzo = self.__nzo_table.pop(nzo_id)
             nzo.deleted = True
             self.__nzo_list.remove(nzo)
+            self.__positions = None
+            self.__set_totals(nzo, remove=True)
 
             sabnzbd.remove_data(nzo_id, nzo.workpath)
 
@@ -416,9 +696,13 @@ class NzbQueue(TryList):
         for nzo_id in self.__nzo_table:
             lst.append(nzo_id)
         for nzo_id in lst:
+            if not self.__get_removable(nzo_id):
+                continue
             nzo = self.__nzo_table.pop(nzo_id)
             nzo.deleted = True
             self.__nzo_list.remove(nzo)
+            self.__positions = None
+            self.__set_totals(nzo, remove=True)
             sabnzbd.remove_data(nzo_id, nzo.workpath)
             self.cleanup_nzo(nzo)
         del lst
@@ -426,12 +710,14 @@ class NzbQueue(TryList):
 
     @synchronized(NZBQUEUE_LOCK)
     def remove_nzf(self, nzo_id, nzf_id):
-        if nzo_id in self.__nzo_table:
-            nzo = self.__nzo_table[nzo_id]
+        nzo = self.__get_job(nzo_id)
+        if nzo:
             nzf = nzo.get_nzf_by_id(nzf_id)
 
             if nzf:
                 post_done = nzo.remove_nzf(nzf)
+                if QueueJournal.do.active:
+                    QueueJournal.do.file_done(nzf)
                 if post_done:
                     if nzo.finished_files:
                         self.end_job(nzo)
@@ -446,8 +732,8 @@ class NzbQueue(TryList):
 
     @synchronized(NZBQUEUE_LOCK)
     def pause_nzo(self, nzo_id):
-        if nzo_id in self.__nzo_table:
-            nzo = self.__nzo_table[nzo_id]
+        nzo = self.__get_job(nzo_id)
+        if nzo:
             nzo.pause()
             logging.debug("Paused nzo: %s", nzo_id)
 
@@ -458,8 +744,8 @@ class NzbQueue(TryList):
 
     @synchronized(NZBQUEUE_LOCK)
     def resume_nzo(self, nzo_id):
-        if nzo_id in self.__nzo_table:
-            nzo = self.__nzo_table[nzo_id]
+        nzo = self.__get_job(nzo_id)
+        if nzo:
             nzo.resume()
             nzo.reset_all_try_lists()
             logging.debug("Resumed nzo: %s", nzo_id)
@@ -479,6 +765,9 @@ class NzbQueue(TryList):
         except KeyError:
             # One or both jobs missing
             return (-1, 0)
+        nzo1 = self.__load(nzo1)
+        if not nzo1:
+            return (-1, 0)
 
         #get the priorities of the two items
         nzo1_priority = nzo1.priority
@@ -495,62 +784,72 @@ class NzbQueue(TryList):
                 nzo1.priority = nzo2_priority
         except:
             nzo1.priority = nzo2_priority
-        item_id_pos1 = -1
-        item_id_pos2 = -1
-        for i in xrange(len(self.__nzo_list)):
-            if item_id_1 == self.__nzo_list[i].nzo_id:
-                item_id_pos1 = i
-            elif item_id_2 == self.__nzo_list[i].nzo_id:
-                item_id_pos2 = i
-            if (item_id_pos1 > -1) and (item_id_pos2 > -1):
-                item = self.__nzo_list[item_id_pos1]
-                del self.__nzo_list[item_id_pos1]
-                self.__nzo_list.insert(item_id_pos2, item)
-                return (item_id_pos2, nzo1.priority)
+        if nzo1.priority != nzo1_priority and QueueJournal.do.active:
+            QueueJournal.do.priority(nzo1)
+        item_id_pos1 = self.__position(item_id_1)
+        item_id_pos2 = self.__position(item_id_2)
+        if (item_id_pos1 > -1) and (item_id_pos2 > -1) and item_id_1 != item_id_2:
+            item = self.__nzo_list[item_id_pos1]
+            del self.__nzo_list[item_id_pos1]
+            self.__nzo_list.insert(item_id_pos2, item)
+            self.__journal_order()
+            return (item_id_pos2, nzo1.priority)
         # If moving failed/no movement took place
         return (-1, nzo1.priority)
 
     @synchronized(NZBQUEUE_LOCK)
     def get_position(self, nzb_id):
-        for i in xrange(len(self.__nzo_list)):
-            if nzb_id == self.__nzo_list[i].nzo_id:
-                return i
-        return -1
+        return self.__position(nzb_id)
+
+    def __position(self, nzo_id):
+        """ Return index of the job in the queue or -1,
+            the index table is rebuilt after each change in the order
+        """
+        if self.__positions is None:
+            self.__positions = dict([(self.__nzo_list[i].nzo_id, i) for i in xrange(len(self.__nzo_list))])
+        return self.__positions.get(nzo_id, -1)
 
     @synchronized(NZBQUEUE_LOCK)
     def move_up_bulk(self, nzo_id, nzf_ids):
-        if nzo_id in self.__nzo_table:
-            self.__nzo_table[nzo_id].move_up_bulk(nzf_ids)
+        nzo = self.__get_job(nzo_id)
+        if nzo:
+            nzo.move_up_bulk(nzf_ids)
 
     @synchronized(NZBQUEUE_LOCK)
     def move_top_bulk(self, nzo_id, nzf_ids):
-        if nzo_id in self.__nzo_table:
-            self.__nzo_table[nzo_id].move_top_bulk(nzf_ids)
+        nzo = self.__get_job(nzo_id)
+        if nzo:
+            nzo.move_top_bulk(nzf_ids)
 
     @synchronized(NZBQUEUE_LOCK)
     def move_down_bulk(self, nzo_id, nzf_ids):
-        if nzo_id in self.__nzo_table:
-            self.__nzo_table[nzo_id].move_down_bulk(nzf_ids)
+        nzo = self.__get_job(nzo_id)
+        if nzo:
+            nzo.move_down_bulk(nzf_ids)
 
     @synchronized(NZBQUEUE_LOCK)
     def move_bottom_bulk(self, nzo_id, nzf_ids):
-        if nzo_id in self.__nzo_table:
-            self.__nzo_table[nzo_id].move_bottom_bulk(nzf_ids)
+        nzo = self.__get_job(nzo_id)
+        if nzo:
+            nzo.move_bottom_bulk(nzf_ids)
 
     @synchronized(NZBQUEUE_LOCK)
     def sort_by_avg_age(self, reverse=False):
         logging.info("Sorting by average date...(reversed:%s)", reverse)
-        self.__nzo_list = sort_queue_function(self.__nzo_list, _nzo_date_cmp, reverse)
+        self.__nzo_list = sort_queue_function(self.__nzo_list, _nzo_date_key, reverse)
+        self.__journal_order()
 
     @synchronized(NZBQUEUE_LOCK)
     def sort_by_name(self, reverse=False):
         logging.info("Sorting by name...(reversed:%s)", reverse)
-        self.__nzo_list = sort_queue_function(self.__nzo_list, _nzo_name_cmp, reverse)
+        self.__nzo_list = sort_queue_function(self.__nzo_list, _nzo_name_key, reverse)
+        self.__journal_order()
 
     @synchronized(NZBQUEUE_LOCK)
     def sort_by_size(self, reverse=False):
         logging.info("Sorting by size...(reversed:%s)", reverse)
-        self.__nzo_list = sort_queue_function(self.__nzo_list, _nzo_size_cmp, reverse)
+        self.__nzo_list = sort_queue_function(self.__nzo_list, _nzo_size_key, reverse)
+        self.__journal_order()
 
 
     @synchronized(NZBQUEUE_LOCK)
@@ -575,7 +874,8 @@ class NzbQueue(TryList):
         """ Sets the priority on the nzo and places it in the queue at the approrioate position """
         try:
             priority = int(priority)
-            nzo = self.__nzo_table[nzo_id]
+            nzo = self.__load(self.__nzo_table[nzo_id])
+            self.__touch(nzo)
             nzo_id_pos1 = -1
             pos = -1
 
@@ -585,10 +885,7 @@ class NzbQueue(TryList):
                 return
 
             # Get the current position in the queue
-            for i in xrange(len(self.__nzo_list)):
-                if nzo_id == self.__nzo_list[i].nzo_id:
-                    nzo_id_pos1 = i
-                    break
+            nzo_id_pos1 = self.__position(nzo_id)
 
             # Don't change priority and order if priority is the same as asked
             if priority == self.__nzo_list[nzo_id_pos1].priority:
@@ -596,9 +893,12 @@ class NzbQueue(TryList):
 
             nzo.priority = priority
             nzo.save_attribs()
+            if QueueJournal.do.active:
+                QueueJournal.do.priority(nzo)
 
             if nzo_id_pos1 != -1:
                 del self.__nzo_list[nzo_id_pos1]
+                self.__positions = None
                 if priority == TOP_PRIORITY:
                     #A top priority item (usually a completed download fetching pars)
                     #is added to the top of the queue
@@ -657,10 +957,21 @@ class NzbQueue(TryList):
     @synchronized(NZBQUEUE_LOCK)
     def reset_all_try_lists(self):
         for nzo in self.__nzo_list:
-            nzo.reset_all_try_lists()
+            # Jobs that are not loaded yet only have their own try list
+            if isinstance(nzo, NzbHeader):
+                nzo.reset_try_list()
+            else:
+                nzo.reset_all_try_lists()
         self.reset_try_list()
 
 
+    def __skip_job(self, nzo, server):
+        """ Return True when `nzo` has nothing for `server`, decided without loading it """
+        if nzo.status in (Status.PAUSED, Status.GRABBING) or nzo.server_in_try_list(server):
+            return True
+        # An unloaded job has no articles released to fill servers yet
+        return isinstance(nzo, NzbHeader) and server.fillserver and sabnzbd.active_primaries()
+
     @synchronized(NZBQUEUE_LOCK)
     def has_articles_for(self, server):
         ''' Check whether there are any pending articles for the downloader '''
@@ -670,7 +981,7 @@ class NzbQueue(TryList):
             for nzo in self.__nzo_list:
                 # Ignore any items that are in a paused or grabbing state
                 if nzo.status not in (Status.PAUSED, Status.GRABBING):
-                    return not nzo.server_in_try_list(server)
+                    return not self.__skip_job(nzo, server)
         else:
             return not self.server_in_try_list(server)
 
@@ -689,14 +1000,22 @@ class NzbQueue(TryList):
             if self.__nzo_list:
                 for nzo in self.__nzo_list:
                     if nzo.status not in (Status.PAUSED, Status.GRABBING):
-                        article = nzo.get_article(server)
+                        if self.__skip_job(nzo, server):
+                            continue
+                        # Job reached the top of the queue, load it completely
+                        nzo = self.__load(nzo)
+                        article = nzo and nzo.get_article(server)
                         if article:
                             return article
 
         else:
             for nzo in self.__nzo_list:
                 # Don't try to get an article if server is in try_list of nzo
-                if not nzo.server_in_try_list(server) and nzo.status not in (Status.PAUSED, Status.GRABBING):
+                if self.__skip_job(nzo, server):
+                    continue
+                # Job reached the top of the queue, load it completely
+                nzo = self.__load(nzo)
+                if nzo:
                     article = nzo.get_article(server)
                     if article:
                         return article
@@ -704,6 +1023,20 @@ class NzbQueue(TryList):
             # No articles for this server, block server (until reset issued)
             self.add_to_try_list(server)
 
+    @synchronized(NZBQUEUE_LOCK)
+    def get_articles(self, server, nzo, count):
+        """ Get up to `count` more articles of the same job for `server`,
+            used to pipeline the STAT commands of a pre-check
+        """
+        articles = []
+        if nzo.nzo_id in self.__nzo_table and nzo.status not in (Status.PAUSED, Status.GRABBING):
+            while len(articles) < count:
+                article = nzo.get_article(server)
+                if not article:
+                    break
+                articles.append(article)
+        return articles
+
     @synchronized(NZBQUEUE_LOCK)
     def register_article(self, article, found=True):
         nzf = article.nzf
@@ -714,6 +1047,11 @@ class NzbQueue(TryList):
             return
 
         file_done, post_done, reset = nzo.remove_article(article, found)
+        self.__touch(nzo)
+
+        journal = QueueJournal.do.active
+        if journal:
+            QueueJournal.do.article_done(article, found)
 
         filename = nzf.filename
 
@@ -721,8 +1059,11 @@ class NzbQueue(TryList):
             self.reset_try_list()
 
         if file_done:
+            if journal:
+                QueueJournal.do.file_done(nzf)
             if nzo.next_save is None or time.time() > nzo.next_save:
-                sabnzbd.save_data(nzo, nzo.nzo_id, nzo.workpath)
+                if not journal:
+                    sabnzbd.save_data(nzo, nzo.nzo_id, nzo.workpath)
                 BPSMeter.do.save()
                 if nzo.save_timeout is None:
                     nzo.next_save = None
@@ -749,7 +1090,7 @@ class NzbQueue(TryList):
         if self.actives(grabs=False) < 2 and cfg.autodisconnect():
             # This was the last job, close server connections
             if sabnzbd.downloader.Downloader.do:
-                sabnzbd.downloader.Downloader.do.disconnect()
+                sabnzbd.downloader.Downloader.do.disconnect(keep_warm=True)
 
         # Notify assembler to call postprocessor
         if not nzo.deleted:
@@ -786,47 +1127,142 @@ class NzbQueue(TryList):
 
     @synchronized(NZBQUEUE_LOCK)
     def queue_info(self, for_cli=False, max_jobs=0):
-        bytes_left = 0
-        bytes = 0
-        q_size = 0
-        pnfo_list = []
-        n = 0
-        for nzo in self.__nzo_list:
-            if not max_jobs or n < max_jobs:
-                pnfo = nzo.gather_info(for_cli = for_cli)
-                pnfo_list.append(pnfo)
-                if nzo.status != 'Paused':
-                    bytes += pnfo[PNFO_BYTES_FIELD]
-                    bytes_left += pnfo[PNFO_BYTES_LEFT_FIELD]
-                    q_size += 1
-            elif nzo.status != 'Paused':
-                b, b_left = nzo.total_and_remaining()
-                bytes += b
-                bytes_left += b_left
-                q_size += 1
-            n += 1
+        if max_jobs:
+            nzos = self.__nzo_list[:max_jobs]
+        else:
+            nzos = self.__nzo_list
+        pnfo_list = [nzo.gather_info(for_cli = for_cli) for nzo in nzos]
+        bytes, bytes_left, q_size, dummy = self.get_totals()
         return (bytes, bytes_left, pnfo_list, q_size)
 
 
+    def job_count(self):
+        """ Return number of jobs in the queue """
+        return len(self.__nzo_list)
+
+    def queue_page(self, start=0, limit=0, details=None):
+        """ Return info for one page of the queue: (q_size, lead, pnfo_list)
+            q_size:    number of jobs in the queue
+            lead:      (status, bytes_left) of each job before the page,
+                       used for the positions and ETA of the page
+            pnfo_list: info of the jobs on the page
+            Built from queue_snapshot(), so it doesn't wait for the queue lock.
+            Jobs that are not loaded have None as file lists, `details` (True
+            for all jobs or a list of nzo_ids) loads the jobs that need them.
+        """
+        pnfos = self.queue_snapshot()[QNFO_PNFO_LIST_FIELD]
+        if limit:
+            page = pnfos[start:start + limit]
+        else:
+            page = pnfos[start:]
+        lead = [(pnfo[PNFO_STATUS_FIELD], pnfo[PNFO_BYTES_LEFT_FIELD]) for pnfo in pnfos[:start]]
+        if details:
+            page = list(page)
+            for n, pnfo in enumerate(page):
+                nzo_id = pnfo[PNFO_NZO_ID_FIELD]
+                if pnfo[PNFO_ACTIVE_FILES_FIELD] is None and (details is True or nzo_id in details):
+                    page[n] = self.__loaded_info(nzo_id) or pnfo
+        return len(pnfos), lead, page
+
+    @synchronized(NZBQUEUE_LOCK)
+    def __loaded_info(self, nzo_id):
+        """ Return info with file lists of a job, loading it when needed """
+        nzo = self.__load(self.__nzo_table.get(nzo_id))
+        if nzo:
+            return nzo.gather_info()
+        return None
+
+
     @synchronized(NZBQUEUE_LOCK)
     def remaining(self):
         """ Return bytes left in the queue by non-paused items
         """
-        bytes_left = 0
-        for nzo in self.__nzo_list:
-            if nzo.status != 'Paused':
-                bytes_left += nzo.remaining()
-        return bytes_left
+        return self.get_totals()[1]
 
 
     @synchronized(NZBQUEUE_LOCK)
     def is_empty(self):
-        empty = True
+        return self.get_totals()[3] == 0
+
+
+    def __share(self, nzo):
+        """ Return the share of a job in the queue totals """
+        if nzo.status == Status.PAUSED:
+            return (0, 0, 0, 0)
+        return (nzo.bytes, nzo.remaining(), 1, int(not nzo.futuretype))
+
+    def __set_totals(self, nzo, remove=False):
+        """ Replace the share of the job in the queue totals """
+        old = self.__job_totals.pop(nzo.nzo_id, (0, 0, 0, 0))
+        if remove:
+            new = (0, 0, 0, 0)
+        else:
+            new = self.__job_totals[nzo.nzo_id] = self.__share(nzo)
+        self.__totals = tuple([total - o + n for total, o, n in zip(self.__totals, old, new)])
+        self.__touch(nzo)
+
+    @synchronized(NZBQUEUE_LOCK)
+    def update_totals(self, nzo):
+        """ Called by a job when its totals or paused state change """
+        if self.__nzo_table.get(nzo.nzo_id) is nzo:
+            self.__set_totals(nzo)
+
+    def get_totals(self):
+        """ Return (bytes, bytes_left, active jobs, active real jobs)
+            of all non-paused jobs. Needs no lock, the tuple is replaced as a whole.
+        """
+        return self.__totals
+
+    def __check_totals(self):
+        """ Verify the running totals against a full count (debug aid),
+            only reports differences, the totals are left alone
+        """
+        for nzo in self.__nzo_list:
+            if isinstance(nzo, NzbObject) and nzo.count_totals() != nzo.total_and_remaining():
+                logging.debug('Running totals of %s are off %s != %s', nzo.nzo_id,
+                              nzo.total_and_remaining(), nzo.count_totals())
+        totals = (0, 0, 0, 0)
         for nzo in self.__nzo_list:
-            if not nzo.futuretype and nzo.status != 'Paused':
-                empty = False
-                break
-        return empty
+            totals = tuple([t + s for t, s in zip(totals, self.__share(nzo))])
+        if totals != self.__totals:
+            logging.debug('Running totals of queue are off %s != %s', self.__totals, totals)
+
+    def __touch(self, nzo=None):
+        """ Mark queue, and optionally one job, as changed since the last snapshot """
+        self.__version += 1
+        if nzo:
+            self.__dirty.add(nzo.nzo_id)
+
+    def queue_snapshot(self):
+        """ Return read-only version of queue_info():
+            (bytes, bytes_left, pnfo_list, q_size, version)
+            Meant for API readers, the result must not be modified.
+            Only jobs changed since the previous snapshot are gathered again.
+            Never waits for the queue lock when a snapshot exists,
+            a busy lock just returns the previous (slightly older) snapshot.
+        """
+        snapshot = self.__snapshot
+        if snapshot and snapshot[QNFO_VERSION_FIELD] == self.__version:
+            return snapshot
+        if not NZBQUEUE_LOCK.acquire(snapshot is None):
+            return snapshot
+        try:
+            cache = {}
+            pnfo_list = []
+            for nzo in self.__nzo_list:
+                pnfo = self.__pnfo_cache.get(nzo.nzo_id)
+                if pnfo is None or nzo.nzo_id in self.__dirty:
+                    pnfo = nzo.gather_info()
+                cache[nzo.nzo_id] = pnfo
+                pnfo_list.append(pnfo)
+            self.__pnfo_cache = cache
+            self.__dirty = set()
+            bytes, bytes_left, q_size, dummy = self.get_totals()
+            snapshot = (bytes, bytes_left, tuple(pnfo_list), q_size, self.__version)
+            self.__snapshot = snapshot
+        finally:
+            NZBQUEUE_LOCK.release()
+        return snapshot
 
     @synchronized(NZBQUEUE_LOCK)
     def cleanup_nzo(self, nzo, keep_basic=False, del_files=False):
@@ -840,6 +1276,8 @@ class NzbQueue(TryList):
         """
         empty = []
         for nzo in self.__nzo_list:
+            if isinstance(nzo, NzbHeader):
+                continue
             if not nzo.futuretype and not nzo.files and nzo.status not in (Status.PAUSED, Status.GRABBING):
                 empty.append(nzo)
         for nzo in empty:
@@ -871,50 +1309,72 @@ class NzbQueue(TryList):
 
 #-------------------------------------------------------------------------------
 
-def _nzo_date_cmp(nzo1, nzo2):
-    avg_date1 = nzo1.avg_date
-    avg_date2 = nzo2.avg_date
-
-    if avg_date1 is None and avg_date2 is None:
-        return 0
-
-    if avg_date1 is None:
-        avg_date1 = datetime.datetime.now()
-    elif avg_date2 is None:
-        avg_date2 = datetime.datetime.now()
+def usable_header(info):
+    """ Return True when the job can be represented by its header until needed """
+    return bool(info and info.get('file_count') and not info.get('futuretype'))
+
+
+def read_job_file(_id, path):
+    """ Read a job from disk without taking the global IO lock,
+        only used for parallel loading of the queue at startup
+    """
+    path = os.path.join(path, _id)
+    if not os.path.exists(path):
+        logging.info("%s missing", path)
+        return None
+    try:
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+        if cfg.use_pickle():
+            return pickle.loads(data)
+        else:
+            return cPickle.loads(data)
+    except:
+        logging.error(Ta('Loading %s failed'), path)
+        logging.info("Traceback: ", exc_info = True)
+        return None
+
+
+def use_queue_db():
+    """ Return True when the queue should be read from the database,
+        which is when it is more recent than the queue file.
+        The option doesn't matter, the store written last holds the queue.
+    """
+    db_path = database.queue_db_path()
+    if not os.path.exists(db_path):
+        return False
+    q_path = os.path.join(cfg.admin_dir.get_path(), QUEUE_FILE_NAME)
+    return not os.path.exists(q_path) or os.path.getmtime(db_path) >= os.path.getmtime(q_path)
 
-    return cmp(avg_date1, avg_date2)
+def _nzo_date_key(nzo):
+    # Jobs without a date count as 'now'
+    if nzo.avg_date is None:
+        return datetime.datetime.now()
+    return nzo.avg_date
 
-def _nzo_name_cmp(nzo1, nzo2):
-    return cmp(nzo1.filename, nzo2.filename)
+def _nzo_name_key(nzo):
+    return nzo.filename
 
-def _nzo_size_cmp(nzo1, nzo2):
-    return cmp(nzo1.bytes, nzo2.bytes)
+def _nzo_size_key(nzo):
+    return nzo.bytes
 
-def sort_queue_function(nzo_list, method, reverse):
-    ultra_high_priority = [nzo for nzo in nzo_list if nzo.priority == REPAIR_PRIORITY]
-    super_high_priority = [nzo for nzo in nzo_list if nzo.priority == TOP_PRIORITY]
-    high_priority = [nzo for nzo in nzo_list if nzo.priority == HIGH_PRIORITY]
-    normal_priority = [nzo for nzo in nzo_list if nzo.priority == NORMAL_PRIORITY]
-    low_priority = [nzo for nzo in nzo_list if nzo.priority == LOW_PRIORITY]
+SORT_PRIORITIES = (REPAIR_PRIORITY, TOP_PRIORITY, HIGH_PRIORITY, NORMAL_PRIORITY, LOW_PRIORITY)
 
-    ultra_high_priority.sort(cmp=method, reverse=reverse)
-    super_high_priority.sort(cmp=method, reverse=reverse)
-    high_priority.sort(cmp=method, reverse=reverse)
-    normal_priority.sort(cmp=method, reverse=reverse)
-    low_priority.sort(cmp=method, reverse=reverse)
+def sort_queue_function(nzo_list, key, reverse):
+    """ Sort jobs within each priority, using `key` on each job once """
+    groups = dict([(priority, []) for priority in SORT_PRIORITIES])
+    left_over = []
+    for nzo in nzo_list:
+        groups.get(nzo.priority, left_over).append(nzo)
 
-    new_list = ultra_high_priority
-    new_list.extend(super_high_priority)
-    new_list.extend(high_priority)
-    new_list.extend(normal_priority)
-    new_list.extend(low_priority)
+    new_list = []
+    for priority in SORT_PRIORITIES:
+        groups[priority].sort(key=key, reverse=reverse)
+        new_list.extend(groups[priority])
 
     # Make sure any left-over jobs enter the new list
-    for item in nzo_list:
-        if item not in new_list:
-            new_list.append(item)
-
+    new_list.extend(left_over)
     return new_list
 
 
@@ -22,6 +22,8 @@ sabnzbd.nzbstuff - misc
 import os
 import time
 import re
+import math
+import random
 import logging
 import datetime
 import xml.sax
@@ -37,16 +39,17 @@ import sabnzbd
 from sabnzbd.constants import sample_match, GIGI, ATTRIB_FILE, JOB_ADMIN, \
                               DEFAULT_PRIORITY, LOW_PRIORITY, NORMAL_PRIORITY, \
                               HIGH_PRIORITY, PAUSED_PRIORITY, TOP_PRIORITY, DUP_PRIORITY, \
-                              RENAMES_FILE, Status
+                              RENAMES_FILE, PRECHECK_MIN_SAMPLE, Status
 from sabnzbd.misc import to_units, cat_to_opts, cat_convert, sanitize_foldername, \
                          get_unique_path, get_admin_path, remove_all, format_source_url, \
                          sanitize_filename, globber, sanitize_foldername, int_conv, \
-                         set_permissions
+                         set_permissions, wilson_interval
 import sabnzbd.cfg as cfg
+import sabnzbd.database as database
 from sabnzbd.trylist import TryList
 from sabnzbd.encoding import unicoder, platform_encode, latin1, name_fixer
 
-__all__ = ['Article', 'NzbFile', 'NzbObject']
+__all__ = ['Article', 'NzbFile', 'NzbObject', 'NzbHeader']
 
 # Name potterns
 RE_NEWZBIN = re.compile(r"msgid_(\w+) (.+)(\.nzb)$", re.I)
@@ -155,7 +158,9 @@ NzbFileMapper = (
     ('import_finished',              'import_finished'),
     ('md5sum',                       'md5sum'),
     ('valid',                        'valid'),
-    ('completed',                    'completed')
+    ('completed',                    'completed'),
+    ('stamp',                        'stamp'),
+    ('full_bytes',                   'full_bytes')
 )
 
 
@@ -167,6 +172,7 @@ class NzbFile(TryList):
         TryList.__init__(self)
 
         self.date = date
+        self.stamp = time.mktime(date.timetuple())  # Posting time, for retention checks
         self.subject = subject
         self.filename = None
         self.type = None
@@ -186,6 +192,7 @@ class NzbFile(TryList):
 
         self.bytes = bytes
         self.bytes_left = bytes
+        self.full_bytes = None      # Size of all articles, while only a sample is loaded
         self.article_count = 0
 
         self.nzo = nzo
@@ -197,19 +204,32 @@ class NzbFile(TryList):
         self.import_finished = False
 
         self.md5sum = None
+        self.__sort_key = None      # Cached (stamp, key) for sorting (not saved)
 
         self.valid = bool(article_db)
 
         if self.valid and self.nzf_id:
-            sabnzbd.save_data(article_db, self.nzf_id, nzo.workpath)
+            if cfg.queue_db():
+                database.get_queue_handle().save_segments(nzo.workpath, self.nzf_id, article_db)
+            else:
+                sabnzbd.save_data(article_db, self.nzf_id, nzo.workpath)
 
     def finish_import(self):
         """ Load the article objects from disk """
         logging.debug("Finishing import on %s", self.subject)
 
-        article_db = sabnzbd.load_data(self.nzf_id, self.nzo.workpath, remove=False)
+        article_db = None
+        if cfg.queue_db():
+            article_db = database.get_queue_handle().load_segments(self.nzo.workpath, self.nzf_id)
+        if not article_db:
+            article_db = sabnzbd.load_data(self.nzf_id, self.nzo.workpath, remove=False)
+        if not article_db and not cfg.queue_db() and os.path.exists(database.queue_db_path()):
+            # Stored while the queue database was in use, read only
+            # so that the database stays older than the queue file
+            article_db = database.get_queue_handle().load_segments(self.nzo.workpath, self.nzf_id)
         if article_db:
-            for partnum in article_db:
+            sample = self.nzo.precheck_sample is not None and cfg.precheck_sample()
+            for partnum in (sample and sample_parts(article_db, sample) or article_db):
                 art_id = article_db[partnum][0]
                 bytes = article_db[partnum][1]
 
@@ -218,10 +238,29 @@ class NzbFile(TryList):
                 self.articles.append(article)
                 self.decodetable[partnum] = article
 
+            if len(self.articles) < len(article_db):
+                # Only the sample will be fetched, count only its size
+                if self.full_bytes is None:
+                    self.full_bytes = self.bytes
+                self.set_totals(sum([article.bytes for article in self.articles]))
+            elif self.full_bytes is not None:
+                # Sampled before, now all articles are back
+                self.set_totals(self.full_bytes)
+                self.full_bytes = None
+
             # Look for article with lowest number
             self.initial_article = self.decodetable[self.lowest_partnum]
             self.import_finished = True
 
+    def set_totals(self, bytes):
+        """ Set size and remaining size of the file, adjusting the job totals """
+        nzo = self.nzo
+        if self in nzo.files:
+            nzo.files_bytes += bytes - self.bytes
+            nzo.bytes_left += bytes - self.bytes_left
+        self.bytes = self.bytes_left = bytes
+        nzo.totals_changed()
+
     def remove_article(self, article, found):
         """ Handle completed article, possibly end of file """
         if article in self.articles:
@@ -242,6 +281,15 @@ class NzbFile(TryList):
 
         return (done, reset)
 
+    def sort_key(self, ext_list, name=True):
+        """ Return key for sorting the files of a job, see nzf_sort_key.
+            Cached until the filename or the priority extensions change.
+        """
+        stamp = (self.filename, ext_list, name)
+        if not self.__sort_key or self.__sort_key[0] != stamp:
+            self.__sort_key = (stamp, nzf_sort_key(self, ext_list, name))
+        return self.__sort_key[1]
+
     def set_par2(self, setname, vol, blocks):
         """ Designate this this file as a par2 file """
         self.is_par2 = True
@@ -264,6 +312,10 @@ class NzbFile(TryList):
 
         self.add_to_try_list(server)
 
+    def in_retention(self, retention, now=None):
+        """ Is this file within `retention` seconds (0 = unlimited)? """
+        return not retention or self.stamp >= (now or time.time()) - retention
+
     def reset_all_try_lists(self):
         """ Clear all lists of visited servers """
         for art in self.articles:
@@ -282,6 +334,8 @@ class NzbFile(TryList):
 
     def remove_admin(self):
         """ Remove article database from disk (sabnzbd_nzf_<id>)"""
+        if cfg.queue_db():
+            database.get_queue_handle().remove_segments(self.nzo.workpath, self.nzf_id)
         try:
             os.remove(os.path.join(self.nzo.workpath, self.nzf_id))
         except:
@@ -302,7 +356,10 @@ class NzbFile(TryList):
             except KeyError:
                 # Handle new attributes
                 self.__dict__[tup[1]] = None
+        if self.stamp is None and self.date:
+            self.stamp = time.mktime(self.date.timetuple())
         TryList.__init__(self)
+        self.__sort_key = None
 
     def __repr__(self):
         return "<NzbFile: filename=%s, type=%s>" % (self.filename, self.type)
@@ -501,7 +558,11 @@ NzbObjectMapper = (
     ('oversized',                    'oversized'),     # Was detected as oversized
     ('create_group_folder',          'create_group_folder'),
     ('precheck',                     'precheck'),
-    ('incomplete',                   'incomplete')     # Was detected as incomplete
+    ('incomplete',                   'incomplete'),    # Was detected as incomplete
+    ('journal_seq',                  'journal_seq'),   # Last queue journal record in this snapshot
+    ('precheck_sample',              'precheck_sample'),  # [checked, missing] articles of sampling pre-check
+    ('discovery',                    'discovery'),     # Fetching the first article of each file first
+    ('speed_limit',                  'speed_limit')    # Bandwidth limit of this job in KB/s (0 = none)
 )
 
 class NzbObject(TryList):
@@ -561,6 +622,8 @@ class NzbObject(TryList):
 
         self.files = []             # List of all NZFs
         self.files_table = {}       # Dictionary of NZFs indexed using NZF_ID
+        self.files_bytes = 0        # Running totals of the active files (not saved)
+        self.bytes_left = 0
 
         self.finished_files = []    # List of al finished NZFs
 
@@ -587,11 +650,16 @@ class NzbObject(TryList):
         self.duplicate = False
         self.oversized = False
         self.precheck = False
+        self.precheck_sample = None
+        self.discovery = False
+        self.speed_limit = 0
         self.incomplete = False
         if self.status == Status.QUEUED and not reuse:
             self.precheck = cfg.pre_check()
             if self.precheck:
                 self.status = Status.CHECKING
+                if cfg.precheck_sample():
+                    self.precheck_sample = [0, 0]
 
         # Store one line responses for filejoin/par2/unrar/unzip here for history display
         self.action_line = ''
@@ -613,6 +681,7 @@ class NzbObject(TryList):
         self.save_timeout = None
         self.new_caching = True
         self.encrypted = 0
+        self.journal_seq = 0L
         self.wait = None
         self.pp_active = False  # Signals active post-processing (not saved)
 
@@ -774,15 +843,32 @@ class NzbObject(TryList):
         if reuse:
             self.check_existing_files(wdir)
 
-        if cfg.auto_sort():
-            self.files.sort(cmp=nzf_cmp_date)
-        else:
-            self.files.sort(cmp=nzf_cmp_name)
+        self.sort_files()
+
+        # Fetch the first article of each file before the rest,
+        # so that real names and par2 sets are known early
+        self.discovery = cfg.header_first() and not self.precheck and len(self.files) > 1
 
         # Set nzo save-delay to 6 sec per GB with a max of 5 min
         self.save_timeout = min(6.0 * float(self.bytes) / GIGI, 300.0)
+        self.update_totals()
 
 
+    def sort_files(self):
+        """ Sort the files by date or by name """
+        ext_list = tuple(get_ext_list())
+        if cfg.auto_sort():
+            self.files.sort(key=lambda nzf: nzf.sort_key(ext_list, name=False))
+        else:
+            self.files.sort(key=lambda nzf: nzf.sort_key(ext_list))
+
+    def end_discovery(self):
+        """ All first articles are done, sort by the real names now """
+        logging.debug('First articles of %s done', self.final_name)
+        self.discovery = False
+        self.sort_files()
+        self.reset_try_list()
+
     def check_for_dupe(self, nzf):
         filename = nzf.filename
 
@@ -809,6 +895,7 @@ class NzbObject(TryList):
             self.finished_files.append(nzf)
             nzf.import_finished = True
             nzf.deleted = True
+            self.update_totals()
         return not bool(self.files)
 
     def reset_all_try_lists(self):
@@ -832,6 +919,7 @@ class NzbObject(TryList):
                     self.extrapars[parset].append(xnzf)
                     if not self.precheck:
                         self.files.remove(xnzf)
+        self.update_totals()
 
     def handle_par2(self, nzf, file_done):
         """ Check if file is a par2 and build up par2 collection
@@ -870,6 +958,7 @@ class NzbObject(TryList):
                                 if nzf not in self.extrapars[head]: self.extrapars[head].append(nzf)
                             else:
                                 nzf.reset_try_list()
+                        self.update_totals()
 
                     ## No par2file in this set yet, set this as
                     ## initialparfile
@@ -886,13 +975,27 @@ class NzbObject(TryList):
 
     def remove_article(self, article, found):
         nzf = article.nzf
+        bytes_left = nzf.bytes_left
+        if self.precheck_sample is not None:
+            self.precheck_sample[0] += 1
+            if not found:
+                self.precheck_sample[1] += 1
         file_done, reset = nzf.remove_article(article, found)
 
+        if nzf.bytes_left != bytes_left:
+            # Only par2 files can have left the active list while downloading
+            if not nzf.is_par2 or nzf in self.files:
+                self.bytes_left -= bytes_left - nzf.bytes_left
+                self.totals_changed()
+
         if file_done:
             self.remove_nzf(nzf)
 
         if reset:
             self.reset_try_list()
+            if self.discovery and not file_done:
+                # Real name is known now, so the par2 sets can be built up
+                self.handle_par2(nzf, file_done)
 
         if file_done:
             self.handle_par2(nzf, file_done)
@@ -1004,6 +1107,7 @@ class NzbObject(TryList):
 
     def pause(self):
         self.status = 'Paused'
+        self.totals_changed()
         # Prevent loss of paused state when terminated
         if self.nzo_id:
             sabnzbd.save_data(self, self.nzo_id, self.workpath)
@@ -1017,21 +1121,21 @@ class NzbObject(TryList):
         self.duplicate = False
         self.oversized = False
         self.incomplete = False
+        self.totals_changed()
 
     def add_parfile(self, parfile):
         if parfile not in self.files:
             self.files.append(parfile)
         if parfile.extrapars and parfile in parfile.extrapars:
             parfile.extrapars.remove(parfile)
+        self.update_totals()
 
     def remove_parset(self, setname):
         self.partable.pop(setname)
 
     __re_quick_par2_check = re.compile('\.par2\W*', re.I)
-    def check_quality(self):
-        """ Determine amount of articles present on servers
-            and return (gross available, nett) bytes
-        """
+    def __quality_sizes(self):
+        """ Return (need, pars, short, anypars) bytes for check_quality """
         need = 0L
         pars = 0L
         short = 0L
@@ -1040,11 +1144,23 @@ class NzbObject(TryList):
             nzf = self.files_table[nzf_id]
             assert isinstance(nzf, NzbFile)
             short += nzf.bytes_left
+            bytes = nzf.full_bytes or nzf.bytes
             if self.__re_quick_par2_check.search(nzf.subject):
-                pars += nzf.bytes
+                pars += bytes
                 anypars = True
             else:
-                need += nzf.bytes
+                need += bytes
+        if self.precheck_sample and self.precheck_sample[0]:
+            # Only a sample was checked, estimate the missing part from it
+            checked, missing = self.precheck_sample
+            short = long((need + pars) * missing / checked)
+        return need, pars, short, anypars
+
+    def check_quality(self):
+        """ Determine amount of articles present on servers
+            and return (gross available, nett) bytes
+        """
+        need, pars, short, anypars = self.__quality_sizes()
         have = need + pars - short
         ratio = float(have) / float(max(1, need))
         if anypars:
@@ -1052,8 +1168,25 @@ class NzbObject(TryList):
         else:
             enough = have >= need
         logging.debug('Download Quality: enough=%s, have=%s, need=%s, ratio=%s', enough, have, need, ratio)
+        interval = self.quality_interval()
+        if interval:
+            logging.debug('Download Quality: estimated from %s articles, ratio between %.3f and %.3f',
+                          self.precheck_sample[0], interval[0], interval[1])
         return enough, ratio
 
+    def quality_interval(self):
+        """ Return (low, high) bounds of the ratio of check_quality,
+            when the pre-check used a sample. Otherwise return None.
+        """
+        if not (self.precheck_sample and self.precheck_sample[0]):
+            return None
+        checked, missing = self.precheck_sample
+        need, pars, short, anypars = self.__quality_sizes()
+        low, high = wilson_interval(checked - missing, checked)
+        total = float(need + pars)
+        need = float(max(1, need))
+        return total * low / need, total * high / need
+
 
     def set_download_report(self):
         if self.avg_bps_total and self.bytes_downloaded and self.avg_bps_freq:
@@ -1094,8 +1227,19 @@ class NzbObject(TryList):
             self.nzo_info[log] = [txt]
 
     def get_article(self, server):
+        if self.discovery:
+            article = self.__get_first_article(server)
+            if article or self.discovery:
+                if not article:
+                    # Wait for the pending first articles
+                    self.add_to_try_list(server)
+                return article
+
         article = None
         nzf_remove_list = []
+        if server.retention:
+            now = time.time()
+            longest = sabnzbd.max_retention()
 
         for nzf in self.files:
             assert isinstance(nzf, NzbFile)
@@ -1104,6 +1248,11 @@ class NzbObject(TryList):
             else:
                 # Don't try to get an article if server is in try_list of nzf
                 if not nzf.server_in_try_list(server):
+                    if server.retention and not nzf.in_retention(server.retention, now) and \
+                       nzf.in_retention(longest, now):
+                        # Too old for this server, but another server can have it
+                        nzf.add_to_try_list(server)
+                        continue
                     if not nzf.import_finished:
                         # Only load NZF when it's a primary server
                         # or when it's a backup server without active primaries
@@ -1126,6 +1275,8 @@ class NzbObject(TryList):
             nzf.deleted = True
             nzf.completed = True
             self.files.remove(nzf)
+        if nzf_remove_list:
+            self.update_totals()
         # If cleanup emptied the active files list, end this job
         if nzf_remove_list and not self.files:
             sabnzbd.NzbQueue.do.end_job(self)
@@ -1135,37 +1286,48 @@ class NzbObject(TryList):
             self.add_to_try_list(server)
         return article
 
+    def __get_first_article(self, server):
+        """ Return a pending first article of any file,
+            end the discovery phase when there are none left
+        """
+        pending = False
+        for nzf in self.files:
+            if nzf.deleted:
+                continue
+            if not nzf.import_finished:
+                if not (server.fillserver ^ sabnzbd.active_primaries()):
+                    pending = True
+                    continue
+                nzf.finish_import()
+                if not nzf.import_finished:
+                    # Will be removed by the normal get_article
+                    continue
+            if nzf.initial_article:
+                pending = True
+                article = nzf.initial_article.get_article(server)
+                if article:
+                    return article
+        if not pending:
+            self.end_discovery()
+        return None
+
     def move_top_bulk(self, nzf_ids):
         self.cleanup_nzf_ids(nzf_ids)
         if nzf_ids:
-            target = range(len(nzf_ids))
-
-            while 1:
-                self.move_up_bulk(nzf_ids, cleanup = False)
-
-                pos_nzf_table = self.build_pos_nzf_table(nzf_ids)
-
-                keys = pos_nzf_table.keys()
-                keys.sort()
-
-                if target == keys:
-                    break
+            # Stable partition, same result as moving up repeatedly
+            ids = set(nzf_ids)
+            selected = [nzf for nzf in self.files if nzf.nzf_id in ids]
+            others = [nzf for nzf in self.files if nzf.nzf_id not in ids]
+            self.files[:] = selected + others
 
     def move_bottom_bulk(self, nzf_ids):
         self.cleanup_nzf_ids(nzf_ids)
         if nzf_ids:
-            target = range(len(self.files)-len(nzf_ids), len(self.files))
-
-            while 1:
-                self.move_down_bulk(nzf_ids, cleanup = False)
-
-                pos_nzf_table = self.build_pos_nzf_table(nzf_ids)
-
-                keys = pos_nzf_table.keys()
-                keys.sort()
-
-                if target == keys:
-                    break
+            # Stable partition, same result as moving down repeatedly
+            ids = set(nzf_ids)
+            selected = [nzf for nzf in self.files if nzf.nzf_id in ids]
+            others = [nzf for nzf in self.files if nzf.nzf_id not in ids]
+            self.files[:] = others + selected
 
     def move_up_bulk(self, nzf_ids, cleanup = True):
         if cleanup:
@@ -1221,6 +1383,8 @@ class NzbObject(TryList):
     def purge_data(self, keep_basic=False, del_files=False):
         """ Remove all admin info, 'keep_basic' preserves attribs and nzb """
         wpath = self.workpath
+        if cfg.queue_db():
+            database.get_queue_handle().remove_segments(wpath)
         for nzf in self.files:
             sabnzbd.remove_data(nzf.nzf_id, wpath)
 
@@ -1247,13 +1411,14 @@ class NzbObject(TryList):
 
     def remaining(self):
         """ Return remaining bytes """
-        bytes_left = 0
-        for nzf in self.files:
-            bytes_left += nzf.bytes_left
-        return bytes_left
+        return self.bytes_left
 
     def total_and_remaining(self):
         """ Return total and remaining bytes """
+        return self.files_bytes, self.bytes_left
+
+    def count_totals(self):
+        """ Return total and remaining bytes, counted from the active files """
         bytes = 0
         bytes_left = 0
         for nzf in self.files:
@@ -1261,13 +1426,27 @@ class NzbObject(TryList):
             bytes_left += nzf.bytes_left
         return bytes, bytes_left
 
-    def gather_info(self, for_cli = False):
+    def update_totals(self):
+        """ Recount the running totals, needed when the list of active files changes """
+        self.files_bytes, self.bytes_left = self.count_totals()
+        self.totals_changed()
+
+    def totals_changed(self):
+        """ Let the queue adjust its totals to the new state of this job """
+        if self.nzo_id and sabnzbd.NzbQueue.do:
+            sabnzbd.NzbQueue.do.update_totals(self)
+
+    def gather_info(self, for_cli = False, files = True):
+        """ Return job info, without the file lists when `files` is False """
         bytes_left_all = 0
 
         active_files = []
         queued_files = []
         finished_files = []
 
+        if not files:
+            return self.__job_info(for_cli, self.bytes_left, finished_files, active_files, queued_files)
+
         for nzf in self.finished_files:
             bytes = nzf.bytes
             filename = nzf.filename
@@ -1305,6 +1484,9 @@ class NzbObject(TryList):
 
                 queued_files.append((_set, bytes_left, bytes, filename, date))
 
+        return self.__job_info(for_cli, bytes_left_all, finished_files, active_files, queued_files)
+
+    def __job_info(self, for_cli, bytes_left_all, finished_files, active_files, queued_files):
         avg_date = self.avg_date
         if for_cli:
             avg_date = time.mktime(avg_date.timetuple())
@@ -1317,6 +1499,76 @@ class NzbObject(TryList):
                 len(self.nzo_info.get('missing_art_log', []))
                 )
 
+    def gather_files(self, statuses=None, start=0, limit=0):
+        """ Return (total, files) for one page of the file list of this job.
+            The list holds the 'finished', 'active' and 'queued' files, in that
+            order, optionally limited to the given statuses.
+            Each file is (n, status, set, bytes_left, bytes, filename, date, nzf_id),
+            where n is the position in the complete list.
+        """
+        queued = []
+        for _set in self.extrapars:
+            for nzf in self.extrapars[_set]:
+                queued.append((_set, nzf))
+
+        total = 0
+        n = 0
+        files = []
+        for status, lst in (('finished', self.finished_files), ('active', self.files), ('queued', queued)):
+            if statuses and status not in statuses:
+                n += len(lst)
+                continue
+            first = max(0, start - total)
+            if limit:
+                last = max(first, start + limit - total)
+            else:
+                last = len(lst)
+            for i in xrange(first, min(last, len(lst))):
+                if status == 'queued':
+                    _set, nzf = lst[i]
+                else:
+                    _set, nzf = '', lst[i]
+                if status == 'finished':
+                    bytes_left = 0
+                else:
+                    bytes_left = nzf.bytes_left
+                files.append((n + i, status, _set, bytes_left, nzf.bytes, nzf.filename or nzf.subject,
+                              nzf.date, nzf.nzf_id))
+            total += len(lst)
+            n += len(lst)
+        return total, files
+
+    def header_info(self):
+        """ Return dictionary with the summary needed to show
+            this job in the queue without loading it (see NzbHeader)
+        """
+        files_bytes, bytes_left = self.total_and_remaining()
+        return {'nzo_id' : self.nzo_id,
+                'filename' : self.filename,
+                'work_name' : self.work_name,
+                'final_name_pw' : self.final_name_pw,
+                'new_caching' : self.new_caching,
+                'futuretype' : self.futuretype,
+                'bytes' : self.bytes,
+                'files_bytes' : files_bytes,
+                'bytes_left' : bytes_left,
+                'file_count' : len(self.files),
+                'priority' : self.priority,
+                'status' : self.status,
+                'cat' : self.cat,
+                'avg_date' : self.avg_date,
+                'repair' : self.repair,
+                'unpack' : self.unpack,
+                'delete' : self.delete,
+                'script' : self.script,
+                'msgid' : self.msgid,
+                'url' : self.url,
+                'precheck' : self.precheck,
+                'missing' : len(self.nzo_info.get('missing_art_log', [])),
+                'journal_seq' : self.journal_seq,
+                'downpath' : self.downpath
+               }
+
     def get_nzf_by_id(self, nzf_id):
         if nzf_id in self.files_table:
             return self.files_table[nzf_id]
@@ -1358,21 +1610,19 @@ class NzbObject(TryList):
         set_attrib_file(self.workpath, (self.cat, self.pp, self.script, self.priority, self.final_name_pw_clean, self.url))
 
     def build_pos_nzf_table(self, nzf_ids):
+        ids = set(nzf_ids)
         pos_nzf_table = {}
-        for nzf_id in nzf_ids:
-            if nzf_id in self.files_table:
-                nzf = self.files_table[nzf_id]
-                pos = self.files.index(nzf)
+        for pos in xrange(len(self.files)):
+            nzf = self.files[pos]
+            if nzf.nzf_id in ids:
                 pos_nzf_table[pos] = nzf
 
         return pos_nzf_table
 
     def cleanup_nzf_ids(self, nzf_ids):
+        active = set([nzf.nzf_id for nzf in self.files])
         for nzf_id in nzf_ids[:]:
-            if nzf_id in self.files_table:
-                if self.files_table[nzf_id] not in self.files:
-                    nzf_ids.remove(nzf_id)
-            else:
+            if nzf_id not in active:
                 nzf_ids.remove(nzf_id)
 
     def __getstate__(self):
@@ -1394,12 +1644,84 @@ class NzbObject(TryList):
         self.avg_stamp = time.mktime(self.avg_date.timetuple())
         self.wait = None
         TryList.__init__(self)
+        self.files_bytes, self.bytes_left = self.count_totals()
 
 
     def __repr__(self):
         return "<NzbObject: filename=%s>" % self.filename
 
 
+################################################################################
+# NzbHeader                                                                    #
+################################################################################
+class NzbHeader(TryList, object):
+    """ Summary of a queued job, stands in for the NzbObject until
+        the job is needed by the downloader or the details are requested.
+        Must be treated as read-only, the queue replaces it by the real
+        job before making any changes.
+        The try list only lives for this session, like that of the NzbObject.
+    """
+    def __init__(self, info, from_db=False):
+        TryList.__init__(self)
+        self.info = info
+        self.downpath = None
+        self.__dict__.update(info)
+        self.deleted = False
+        self.from_db = from_db
+        # Nothing of an unloaded job is in the article cache
+        self.saved_articles = []
+
+    def purge_data(self, keep_basic=False, del_files=False):
+        """ Remove all admin info without loading the job,
+            only possible for jobs with new_caching (see NzbObject.purge_data)
+        """
+        assert self.new_caching and not self.futuretype
+        wpath = self.workpath
+        if cfg.queue_db():
+            database.get_queue_handle().remove_segments(wpath)
+        if keep_basic:
+            remove_all(wpath, 'SABnzbd_nz?_*')
+            remove_all(wpath, 'SABnzbd_article_*')
+        else:
+            remove_all(wpath, recursive=True)
+        if self.downpath:
+            if del_files:
+                remove_all(self.downpath, recursive=True)
+            else:
+                try:
+                    os.rmdir(self.downpath)
+                except:
+                    pass
+
+    @property
+    def workpath(self):
+        return get_admin_path(self.new_caching, self.work_name, self.futuretype)
+
+    def remaining(self):
+        return self.bytes_left
+
+    def total_and_remaining(self):
+        return self.files_bytes, self.bytes_left
+
+    def gather_info(self, for_cli = False, files = True):
+        """ Same as NzbObject.gather_info, but the file lists are None,
+            they are only known when the job is loaded
+        """
+        avg_date = self.avg_date
+        if for_cli:
+            avg_date = time.mktime(avg_date.timetuple())
+        return (self.repair, self.unpack, self.delete, self.script,
+                self.nzo_id, self.final_name_pw, {},
+                self.msgid, self.cat, self.url,
+                self.bytes_left, self.bytes, avg_date,
+                None, None, None, self.status, self.priority,
+                self.missing
+                )
+
+    def __repr__(self):
+        return "<NzbHeader: filename=%s>" % self.filename
+
+
 #-------------------------------------------------------------------------------
 
 def nzf_get_filename(nzf):
@@ -1435,63 +1757,51 @@ def ext_on_list(name, lst):
     return False
 
 
-def nzf_cmp_date(nzf1, nzf2):
-    """ Compare files based on date, but give vol-par files preference.
-        Wrapper needed, because `cmp` function doesn't handle extra parms.
+def sample_parts(partnums, percentage):
+    """ Return a random selection of `percentage` % of the article numbers
+        of a file (at least PRECHECK_MIN_SAMPLE), always including the first one
     """
-    return nzf_cmp_name(nzf1, nzf2, name=False)
+    partnums = list(partnums)
+    size = max(PRECHECK_MIN_SAMPLE, int(math.ceil(len(partnums) * percentage / 100.0)))
+    if size >= len(partnums):
+        return partnums
+    first = min(partnums)
+    partnums.remove(first)
+    return [first] + random.sample(partnums, size - 1)
 
 
 RE_RAR = re.compile(r'(\.rar|\.r\d\d|\.s\d\d|\.t\d\d|\.u\d\d|\.v\d\d)$', re.I)
 
-def nzf_cmp_name(nzf1, nzf2, name=True):
-    # The comparison will sort .par2 files to the top of the queue followed by .rar files,
-    # they will then be sorted by name.
-    name1 = nzf_get_filename(nzf1)
-    name2 = nzf_get_filename(nzf2)
+def nzf_sort_key(nzf, ext_list, name=True):
+    """ Return sort key for the files of a job.
+        Mini-par2 files go first and vol-par files last.
+        Anything with a priority extension goes before other files.
+        Then sort by name, with .rar files first, or by date.
+    """
+    fname = nzf_get_filename(nzf)
 
     # Determine vol-pars
-    is_par1 = '.vol' in name1 and '.par2' in name1
-    is_par2 = '.vol' in name2 and '.par2' in name2
-
-    # mini-par2 in front
-    if not is_par1 and name1.endswith('.par2'):
-        return -1
-    if not is_par2 and name2.endswith('.par2'):
-        return 1
-
-    # vol-pars go to the back
-    if is_par1 and not is_par2:
-        return 1
-    if is_par2 and not is_par1:
-        return -1
+    is_vol = '.vol' in fname and '.par2' in fname
+    if is_vol:
+        kind = 2
+    elif fname.endswith('.par2'):
+        kind = 0
+    else:
+        kind = 1
 
     # Anything with a priority extention goes first
-    ext_list = get_ext_list()
-    if ext_list:
-        onlist1 = ext_on_list(name1, ext_list)
-        onlist2 = ext_on_list(name2, ext_list)
-        if onlist1 and not onlist2:
-            return -1
-        if onlist2 and not onlist1:
-            return 1
+    not_listed = not (ext_list and ext_on_list(fname, ext_list))
 
     if name:
         # Prioritise .rar files above any other type of file (other than vol-par)
         # Useful for nzb streaming
-        m1 = RE_RAR.search(name1)
-        m2 = RE_RAR.search(name2)
-        if  m1 and not (is_par2 or m2):
-            return -1
-        elif m2 and not (is_par1 or m1):
-            return 1
+        m = RE_RAR.search(fname)
         # Force .rar to come before 'r00'
-        if m1 and m1.group(1) == '.rar': name1 = name1.replace('.rar', '.r//')
-        if m2 and m2.group(1) == '.rar': name2 = name2.replace('.rar', '.r//')
-        return cmp(name1, name2)
+        if m and m.group(1) == '.rar':
+            fname = fname.replace('.rar', '.r//')
+        return (kind, not_listed, is_vol or not m, fname)
     else:
-        # Do date comparision
-        return cmp(nzf1.date, nzf2.date)
+        return (kind, not_listed, nzf.date)
 
 #-------------------------------------------------------------------------------
 
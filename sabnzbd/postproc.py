@@ -48,6 +48,11 @@ import sabnzbd.nzbqueue
 import sabnzbd.database as database
 import sabnzbd.growler as growler
 
+# Stages of post-processing, each with its own resource class:
+# verify/repair uses CPU, unpack uses the disks (limited per disk),
+# finish (move, script, history) is mostly I/O
+STAGES = ('verify', 'unpack', 'finish')
+
 
 #------------------------------------------------------------------------------
 class PostProcessor(Thread):
@@ -78,6 +83,10 @@ class PostProcessor(Thread):
         PostProcessor.do = self
 
         self.__busy = False # True while a job is being processed
+        self.__waiting = dict([(stage, []) for stage in STAGES])  # Jobs waiting for a stage
+        self.__running = {}     # Job -> stage running in a worker thread
+        self.__active = []      # Jobs that started post-processing and didn't finish yet
+        self.__disks = {}       # Disk -> number of running unpack stages
 
     def save(self):
         """ Save postproc queue """
@@ -149,198 +158,362 @@ class PostProcessor(Thread):
         return None
 
     def run(self):
-        """ Actual processing """
+        """ Dispatch jobs over the stages, each stage of a job runs in a worker thread.
+            The queue receives new jobs, None as stop signal and (job, stage, proceed)
+            when a worker is done.
+        """
         check_eoq = False
 
-        while not self.__stop:
-            self.__busy = False
-
-            if self.paused:
-                time.sleep(5)
-                continue
+        # On stop, no new jobs are started but started jobs are completed
+        while not (self.__stop and not self.__active):
+            self.__busy = bool(self.__active) or any(self.__waiting.values())
+            self.__schedule()
 
             try:
-                nzo = self.queue.get(timeout=3)
+                item = self.queue.get(timeout=3)
             except Queue.Empty:
-                if check_eoq:
+                if check_eoq and not self.__busy:
                     check_eoq = False
                     handle_empty_queue()
                 continue
 
             ## Stop job
-            if not nzo:
+            if not item:
+                continue
+
+            if isinstance(item, tuple):
+                job, stage, proceed = item
+                self.__stage_done(job, stage)
+                next_stage = STAGES.index(stage) + 1
+                if proceed and next_stage < len(STAGES):
+                    self.__waiting[STAGES[next_stage]].append(job)
+                else:
+                    self.__active.remove(job)
+                    self.remove(job.nzo)
+                    check_eoq = True
+                    if not self.__active:
+                        ## Allow download to proceed
+                        sabnzbd.downloader.Downloader.do.resume_from_postproc()
                 continue
 
             ## Job was already deleted.
-            if not nzo.work_name:
+            if not item.work_name:
                 check_eoq = True
                 continue
 
-            ## Flag NZO as being processed
-            nzo.pp_active = True
-
-            ## Pause downloader, if users wants that
-            if cfg.pause_on_post_processing():
-                sabnzbd.downloader.Downloader.do.wait_for_postproc()
+            self.__waiting[STAGES[0]].append(item)
 
-            self.__busy = True
-            process_job(nzo)
-            self.remove(nzo)
-            check_eoq = True
-
-            ## Allow download to proceed
-            sabnzbd.downloader.Downloader.do.resume_from_postproc()
+    def __schedule(self):
+        """ Start waiting stages as far as their resource class allows,
+            later stages first so that started jobs get done
+        """
+        self.__drop_deleted()
+        if self.paused and not self.__stop:
+            return
+        for stage in reversed(STAGES):
+            waiting = self.__waiting[stage]
+            for job in waiting[:]:
+                if stage == STAGES[0] and self.__stop:
+                    break
+                if not self.__free(job, stage):
+                    if stage == 'unpack':
+                        # A job on another disk may still fit
+                        continue
+                    break
+                waiting.remove(job)
+                if stage == STAGES[0]:
+                    job = self.__start_job(job)
+                self.__start(job, stage)
+
+    def __drop_deleted(self):
+        """ Forget jobs that were deleted while waiting for a stage """
+        for stage in STAGES:
+            waiting = self.__waiting[stage]
+            for job in waiting[:]:
+                # The first stage holds the nzo itself
+                if isinstance(job, PostJob):
+                    nzo = job.nzo
+                else:
+                    nzo = job
+                if not nzo.work_name:
+                    waiting.remove(job)
+                    if job in self.__active:
+                        self.__active.remove(job)
+                        if not self.__active:
+                            ## Allow download to proceed
+                            sabnzbd.downloader.Downloader.do.resume_from_postproc()
+
+    def __free(self, job, stage):
+        """ Return True when the resource class of stage has room for job """
+        running = len([1 for name in self.__running.itervalues() if name == stage])
+        if stage == 'verify':
+            return running < cfg.pp_verify_jobs()
+        elif stage == 'unpack':
+            return self.__disks.get(job.disk, 0) < cfg.pp_unpack_jobs()
+        else:
+            return running < cfg.pp_finish_jobs()
+
+    def __start_job(self, nzo):
+        """ Setup job for a new nzo """
+        ## Flag NZO as being processed
+        nzo.pp_active = True
+
+        ## Pause downloader, if users wants that
+        if cfg.pause_on_post_processing():
+            sabnzbd.downloader.Downloader.do.wait_for_postproc()
+
+        job = PostJob(nzo)
+        self.__active.append(job)
+        self.__busy = True
+        return job
+
+    def __start(self, job, stage):
+        """ Run stage of job in a worker thread """
+        self.__running[job] = stage
+        if stage == 'unpack':
+            self.__disks[job.disk] = self.__disks.get(job.disk, 0) + 1
+        worker = Thread(target=self.__run_stage, args=(job, stage))
+        worker.start()
+
+    def __stage_done(self, job, stage):
+        """ Release the resources of a finished stage """
+        self.__running.pop(job, None)
+        if stage == 'unpack':
+            self.__disks[job.disk] -= 1
+            if not self.__disks[job.disk]:
+                del self.__disks[job.disk]
+
+    def __run_stage(self, job, stage):
+        """ Worker thread for one stage """
+        proceed = False
+        try:
+            proceed = getattr(job, stage)()
+        except:
+            logging.error(Ta('Post Processing Failed for %s (%s)'), job.filename, stage)
+            logging.info("Traceback: ", exc_info = True)
+        self.queue.put((job, stage, proceed))
 
 #end PostProcessor class
 
 
 #------------------------------------------------------------------------------
-def process_job(nzo):
-    """ Process one job """
-    assert isinstance(nzo, sabnzbd.nzbstuff.NzbObject)
-    start = time.time()
+def disk_of(path):
+    """ Return device id of path or of its nearest existing parent, None when unknown """
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    try:
+        return os.stat(path).st_dev
+    except (OSError, TypeError):
+        return None
 
-    # keep track of whether we can continue
-    all_ok = True
-    # keep track of par problems
-    par_error = False
-    # keep track of any unpacking errors
-    unpack_error = False
-    # Signal empty download, for when 'empty_postproc' is enabled
-    empty = False
-    nzb_list = []
-    # These need to be initialised incase of a crash
-    workdir_complete = ''
-    postproc_time = 0
-    script_log = ''
-    script_line = ''
-    crash_msg = ''
-
-    ## Get the job flags
-    nzo.save_attribs()
-    flag_repair, flag_unpack, flag_delete = nzo.repair_opts
-    # Normalize PP
-    if flag_delete: flag_unpack = True
-    if flag_unpack: flag_repair = True
-
-    # Get the NZB name
-    filename = nzo.final_name
-    msgid = nzo.msgid
 
-    if cfg.allow_streaming() and not (flag_repair or flag_unpack or flag_delete):
-        # After streaming, force +D
-        nzo.set_pp(3)
-        nzo.status = Status.FAILED
+class PostJob(object):
+    """ State of one job while it passes the stages of post-processing:
+        verify (repair), unpack and finish (move, script, history)
+    """
+    def __init__(self, nzo):
+        assert isinstance(nzo, sabnzbd.nzbstuff.NzbObject)
+        self.nzo = nzo
+        self.start = time.time()
+
+        # keep track of whether we can continue
+        self.all_ok = True
+        # keep track of par problems
+        self.par_error = False
+        # keep track of any unpacking errors
+        self.unpack_error = False
+        # Signal empty download, for when 'empty_postproc' is enabled
+        self.empty = False
+        # Set when post-processing crashed, skips to the history stage
+        self.crashed = False
+        # Set when the unpack stage has prepared the final folder
+        self.prepared = False
+        self.nzb_list = []
+        # These need to be initialised incase of a crash
+        self.workdir = nzo.downpath
+        self.workdir_complete = ''
+        self.tmp_workdir_complete = None
+        self.dirname = nzo.final_name
+        self.marker_file = None
+        self.one_folder = False
+        self.file_sorter = None
+        self.newfiles = []
+        self.script_log = ''
+        self.script_line = ''
+        self.crash_msg = ''
+
+        ## Get the job flags
         nzo.save_attribs()
-        all_ok = False
-
-    try:
-
-        # Get the folder containing the download result
-        workdir = nzo.downpath
-        tmp_workdir_complete = None
-
-        # if no files are present (except __admin__), fail the job
-        if len(globber(workdir)) < 2:
-            if nzo.precheck:
-                enough, ratio = nzo.check_quality()
-                req_ratio = float(cfg.req_completion_rate()) / 100.0
-                # Make sure that rounded ratio doesn't equal required ratio
-                # when it is actually below required
-                if (ratio < req_ratio) and (req_ratio - ratio) < 0.001:
-                    ratio = req_ratio - 0.001
-                emsg = '%.1f%%' % (ratio * 100.0)
-                emsg2 = '%.1f%%' % float(cfg.req_completion_rate())
-                emsg = T('Download might fail, only %s of required %s available') % (emsg, emsg2)
-            else:
-                emsg = T('Download failed - Out of your server\'s retention?')
-                empty = True
-            nzo.fail_msg = emsg
-            nzo.set_unpack_info('Fail', emsg)
+        self.flag_repair, self.flag_unpack, self.flag_delete = nzo.repair_opts
+        # Normalize PP
+        if self.flag_delete: self.flag_unpack = True
+        if self.flag_unpack: self.flag_repair = True
+
+        # Get the NZB name
+        self.filename = nzo.final_name
+        self.msgid = nzo.msgid
+        self.script = nzo.script
+        self.cat = nzo.cat
+
+        # Disks read and written by the unpack stage
+        self.disk = (disk_of(self.workdir), disk_of(self.complete_root()))
+
+    def complete_root(self):
+        """ Return the base of the final folder, used to find its disk """
+        if cfg.create_group_folders():
+            return cfg.complete_dir.get_path()
+        catdir = config.get_categories(self.cat).dir().strip('*')
+        return real_path(cfg.complete_dir.get_path(), catdir)
+
+    def verify(self):
+        """ Stage 1: check the download and repair it
+            Return False when the job was sent back to the queue for more par2 files
+        """
+        nzo = self.nzo
+        if cfg.allow_streaming() and not (self.flag_repair or self.flag_unpack or self.flag_delete):
+            # After streaming, force +D
+            nzo.set_pp(3)
             nzo.status = Status.FAILED
-            # do not run unpacking or parity verification
-            flag_repair = flag_unpack = False
-            all_ok = cfg.empty_postproc() and empty
-            if not all_ok:
-                par_error = unpack_error = True
-
-        script = nzo.script
-        cat = nzo.cat
-
-        logging.info('Starting PostProcessing on %s' + \
-                     ' => Repair:%s, Unpack:%s, Delete:%s, Script:%s, Cat:%s',
-                     filename, flag_repair, flag_unpack, flag_delete, script, cat)
-
-        ## Par processing, if enabled
-        if flag_repair:
-            par_error, re_add = parring(nzo, workdir)
-            if re_add:
-                # Try to get more par files
-                return False
-
-        ## Check if user allows unsafe post-processing
-        if flag_repair and cfg.safe_postproc():
-            all_ok = all_ok and not par_error
-
-        # Set complete dir to workdir in case we need to abort
-        workdir_complete = workdir
-        dirname = nzo.final_name
-        marker_file = None
-
-        if all_ok:
-            one_folder = False
-            ## Determine class directory
-            if cfg.create_group_folders():
-                complete_dir = addPrefixes(cfg.complete_dir.get_path(), nzo.dirprefix)
-                complete_dir = create_dirs(complete_dir)
-            else:
-                catdir = config.get_categories(cat).dir()
-                if catdir.endswith('*'):
-                    catdir = catdir.strip('*')
-                    one_folder = True
-                complete_dir = real_path(cfg.complete_dir.get_path(), catdir)
-
-            ## TV/Movie/Date Renaming code part 1 - detect and construct paths
-            file_sorter = Sorter(cat)
-            complete_dir = file_sorter.detect(dirname, complete_dir)
-            if file_sorter.sort_file:
-                one_folder = False
-
-            if one_folder:
-                workdir_complete = create_dirs(complete_dir)
-            else:
-                workdir_complete = get_unique_path(os.path.join(complete_dir, dirname), create_dir=True)
-                marker_file = set_marker(workdir_complete)
+            nzo.save_attribs()
+            self.all_ok = False
 
-            if not workdir_complete or not os.path.exists(workdir_complete):
-                crash_msg = T('Cannot create final folder %s') % unicoder(os.path.join(complete_dir, dirname))
-                raise IOError
+        try:
+            workdir = self.workdir
+
+            # if no files are present (except __admin__), fail the job
+            if len(globber(workdir)) < 2:
+                if nzo.precheck:
+                    enough, ratio = nzo.check_quality()
+                    req_ratio = float(cfg.req_completion_rate()) / 100.0
+                    # Make sure that rounded ratio doesn't equal required ratio
+                    # when it is actually below required
+                    if (ratio < req_ratio) and (req_ratio - ratio) < 0.001:
+                        ratio = req_ratio - 0.001
+                    emsg = '%.1f%%' % (ratio * 100.0)
+                    emsg2 = '%.1f%%' % float(cfg.req_completion_rate())
+                    emsg = T('Download might fail, only %s of required %s available') % (emsg, emsg2)
+                    interval = nzo.quality_interval()
+                    if interval:
+                        emsg += ' ' + T('(estimated from a sample: %s to %s)') % \
+                                ('%.1f%%' % (interval[0] * 100.0), '%.1f%%' % (interval[1] * 100.0))
+                else:
+                    emsg = T('Download failed - Out of your server\'s retention?')
+                    self.empty = True
+                nzo.fail_msg = emsg
+                nzo.set_unpack_info('Fail', emsg)
+                nzo.status = Status.FAILED
+                # do not run unpacking or parity verification
+                self.flag_repair = self.flag_unpack = False
+                self.all_ok = cfg.empty_postproc() and self.empty
+                if not self.all_ok:
+                    self.par_error = self.unpack_error = True
+
+            logging.info('Starting PostProcessing on %s' + \
+                         ' => Repair:%s, Unpack:%s, Delete:%s, Script:%s, Cat:%s',
+                         self.filename, self.flag_repair, self.flag_unpack, self.flag_delete,
+                         self.script, self.cat)
+
+            ## Par processing, if enabled
+            if self.flag_repair:
+                self.par_error, re_add = parring(nzo, workdir)
+                if re_add:
+                    # Try to get more par files
+                    return False
+
+            ## Check if user allows unsafe post-processing
+            if self.flag_repair and cfg.safe_postproc():
+                self.all_ok = self.all_ok and not self.par_error
+        except:
+            self.crash()
+        return True
+
+    def unpack(self):
+        """ Stage 2: create the final folder and unpack into it """
+        if self.crashed:
+            return True
+        nzo = self.nzo
+        try:
+            # Set complete dir to workdir in case we need to abort
+            self.workdir_complete = self.workdir
+
+            if self.all_ok:
+                ## Determine class directory
+                if cfg.create_group_folders():
+                    complete_dir = addPrefixes(cfg.complete_dir.get_path(), nzo.dirprefix)
+                    complete_dir = create_dirs(complete_dir)
+                else:
+                    catdir = config.get_categories(self.cat).dir()
+                    if catdir.endswith('*'):
+                        catdir = catdir.strip('*')
+                        self.one_folder = True
+                    complete_dir = real_path(cfg.complete_dir.get_path(), catdir)
+
+                ## TV/Movie/Date Renaming code part 1 - detect and construct paths
+                self.file_sorter = Sorter(self.cat)
+                complete_dir = self.file_sorter.detect(self.dirname, complete_dir)
+                if self.file_sorter.sort_file:
+                    self.one_folder = False
+
+                if self.one_folder:
+                    self.workdir_complete = create_dirs(complete_dir)
+                else:
+                    self.workdir_complete = get_unique_path(os.path.join(complete_dir, self.dirname), create_dir=True)
+                    self.marker_file = set_marker(self.workdir_complete)
 
-            if cfg.folder_rename() and not one_folder:
-                tmp_workdir_complete = prefix(workdir_complete, '_UNPACK_')
-                try:
-                    renamer(workdir_complete, tmp_workdir_complete)
-                except:
-                    pass # On failure, just use the original name
-            else:
-                tmp_workdir_complete = workdir_complete
-
-            newfiles = []
-            ## Run Stage 2: Unpack
-            if flag_unpack:
-                if all_ok:
-                    #set the current nzo status to "Extracting...". Used in History
-                    nzo.status = Status.EXTRACTING
-                    logging.info("Running unpack_magic on %s", filename)
-                    unpack_error, newfiles = unpack_magic(nzo, workdir, tmp_workdir_complete, flag_delete, one_folder, (), (), (), ())
-                    logging.info("unpack_magic finished on %s", filename)
+                if not self.workdir_complete or not os.path.exists(self.workdir_complete):
+                    self.crash_msg = T('Cannot create final folder %s') % unicoder(os.path.join(complete_dir, self.dirname))
+                    raise IOError
+
+                if cfg.folder_rename() and not self.one_folder:
+                    self.tmp_workdir_complete = prefix(self.workdir_complete, '_UNPACK_')
+                    try:
+                        renamer(self.workdir_complete, self.tmp_workdir_complete)
+                    except:
+                        pass # On failure, just use the original name
                 else:
-                    nzo.set_unpack_info('Unpack', T('No post-processing because of failed verification'))
+                    self.tmp_workdir_complete = self.workdir_complete
+
+                ## Run Stage 2: Unpack
+                if self.flag_unpack:
+                    if self.all_ok:
+                        #set the current nzo status to "Extracting...". Used in History
+                        nzo.status = Status.EXTRACTING
+                        logging.info("Running unpack_magic on %s", self.filename)
+                        self.unpack_error, self.newfiles = unpack_magic(nzo, self.workdir, self.tmp_workdir_complete,
+                                                                        self.flag_delete, self.one_folder, (), (), (), ())
+                        logging.info("unpack_magic finished on %s", self.filename)
+                    else:
+                        nzo.set_unpack_info('Unpack', T('No post-processing because of failed verification'))
+                self.prepared = True
+        except:
+            self.crash()
+        return True
 
+    def finish(self):
+        """ Stage 3: move the files, run the user script and add the job to the history """
+        if not self.crashed:
+            try:
+                self.move()
+                self.run_script()
+            except:
+                self.crash()
+        self.to_history()
+        return False
+
+    def move(self):
+        """ Move any left-over files to the final folder and clean up """
+        nzo = self.nzo
+        workdir = self.workdir
+        tmp_workdir_complete = self.tmp_workdir_complete
+
+        if self.prepared:
             if cfg.safe_postproc():
-                all_ok = all_ok and not unpack_error
+                self.all_ok = self.all_ok and not self.unpack_error
 
-            if all_ok:
+            if self.all_ok:
                 ## Move any (left-over) files to destination
                 nzo.status = Status.MOVING
                 nzo.set_action_line(T('Moving'), '...')
@@ -350,93 +523,99 @@ def process_job(nzo):
                             path = os.path.join(root, file_)
                             new_path = path.replace(workdir, tmp_workdir_complete)
                             ok, new_path = move_to_path(path, new_path)
-                            newfiles.append(new_path)
+                            self.newfiles.append(new_path)
                             if not ok:
                                 nzo.set_unpack_info('Unpack', T('Failed moving %s to %s') % (unicoder(path), unicoder(new_path)))
-                                all_ok = False
+                                self.all_ok = False
                                 break
 
             ## Set permissions right
             set_permissions(tmp_workdir_complete)
 
-            if all_ok and marker_file:
-                del_marker(os.path.join(tmp_workdir_complete, marker_file))
-                remove_from_list(marker_file, newfiles)
+            if self.all_ok and self.marker_file:
+                del_marker(os.path.join(tmp_workdir_complete, self.marker_file))
+                remove_from_list(self.marker_file, self.newfiles)
 
-            if all_ok:
+            if self.all_ok:
                 ## Remove files matching the cleanup list
                 cleanup_list(tmp_workdir_complete, True)
 
                 ## Check if this is an NZB-only download, if so redirect to queue
                 ## except when PP was Download-only
-                if flag_repair:
-                    nzb_list = nzb_redirect(tmp_workdir_complete, nzo.final_name, nzo.pp, script, cat, priority=nzo.priority)
+                if self.flag_repair:
+                    self.nzb_list = nzb_redirect(tmp_workdir_complete, nzo.final_name, nzo.pp, self.script, self.cat, priority=nzo.priority)
                 else:
-                    nzb_list = None
-                if nzb_list:
-                    nzo.set_unpack_info('Download', T('Sent %s to queue') % unicoder(nzb_list))
+                    self.nzb_list = None
+                if self.nzb_list:
+                    nzo.set_unpack_info('Download', T('Sent %s to queue') % unicoder(self.nzb_list))
                     cleanup_empty_directories(tmp_workdir_complete)
                 else:
                     cleanup_list(tmp_workdir_complete, False)
 
+    def run_script(self):
+        """ Rename the final folder, run the user script and send the email """
+        nzo = self.nzo
+        script = self.script
+        script_log = ''
         script_output = ''
         script_ret = 0
-        if not nzb_list:
+        if not self.nzb_list:
             ## Give destination its final name
-            if cfg.folder_rename() and tmp_workdir_complete and not one_folder:
-                if not all_ok:
-                    workdir_complete = tmp_workdir_complete.replace('_UNPACK_', '_FAILED_')
-                    workdir_complete = get_unique_path(workdir_complete, n=0, create_dir=False)
+            if cfg.folder_rename() and self.tmp_workdir_complete and not self.one_folder:
+                if not self.all_ok:
+                    self.workdir_complete = self.tmp_workdir_complete.replace('_UNPACK_', '_FAILED_')
+                    self.workdir_complete = get_unique_path(self.workdir_complete, n=0, create_dir=False)
                 try:
-                    collapse_folder(tmp_workdir_complete, workdir_complete)
+                    collapse_folder(self.tmp_workdir_complete, self.workdir_complete)
                 except:
-                    logging.error(Ta('Error renaming "%s" to "%s"'), tmp_workdir_complete, workdir_complete)
+                    logging.error(Ta('Error renaming "%s" to "%s"'), self.tmp_workdir_complete, self.workdir_complete)
                     logging.info("Traceback: ", exc_info = True)
 
-            if empty:
+            if self.empty:
                 job_result = -1
             else:
-                job_result = int(par_error) + int(unpack_error)*2
+                job_result = int(self.par_error) + int(self.unpack_error)*2
 
             if cfg.ignore_samples() > 0:
-                remove_samples(workdir_complete)
+                remove_samples(self.workdir_complete)
 
             ## TV/Movie/Date Renaming code part 2 - rename and move files to parent folder
-            if all_ok and file_sorter.sort_file:
-                if newfiles:
-                    file_sorter.rename(newfiles, workdir_complete)
-                    workdir_complete, ok = file_sorter.move(workdir_complete)
+            if self.all_ok and self.file_sorter.sort_file:
+                if self.newfiles:
+                    self.file_sorter.rename(self.newfiles, self.workdir_complete)
+                    self.workdir_complete, ok = self.file_sorter.move(self.workdir_complete)
                 else:
-                    workdir_complete, ok = file_sorter.rename_with_ext(workdir_complete)
+                    self.workdir_complete, ok = self.file_sorter.rename_with_ext(self.workdir_complete)
                 if not ok:
                     nzo.set_unpack_info('Unpack', T('Failed to move files'))
-                    all_ok = False
+                    self.all_ok = False
 
             ## Run the user script
             script_path = make_script_path(script)
-            if all_ok and (not nzb_list) and script_path:
+            if self.all_ok and (not self.nzb_list) and script_path:
                 #set the current nzo status to "Ext Script...". Used in History
                 nzo.status = Status.RUNNING
                 nzo.set_action_line(T('Running script'), unicoder(script))
                 nzo.set_unpack_info('Script', T('Running user script %s') % unicoder(script), unique=True)
-                script_log, script_ret = external_processing(script_path, workdir_complete, nzo.filename,
-                                                             msgid, dirname, cat, nzo.group, job_result)
-                script_line = get_last_line(script_log)
+                script_log, script_ret = external_processing(script_path, self.workdir_complete, nzo.filename,
+                                                             self.msgid, self.dirname, self.cat, nzo.group, job_result)
+                self.script_log = script_log
+                self.script_line = get_last_line(script_log)
                 if script_log:
                     script_output = nzo.nzo_id
-                if script_line:
-                    nzo.set_unpack_info('Script', unicoder(script_line), unique=True)
+                if self.script_line:
+                    nzo.set_unpack_info('Script', unicoder(self.script_line), unique=True)
                 else:
                     nzo.set_unpack_info('Script', T('Ran %s') % unicoder(script), unique=True)
             else:
                 script = ""
-                script_line = ""
+                self.script_line = ""
                 script_ret = 0
 
         ## Email the results
-        if (not nzb_list) and cfg.email_endjob():
-            if (cfg.email_endjob() == 1) or (cfg.email_endjob() == 2 and (unpack_error or par_error)):
-                emailer.endjob(dirname, msgid, cat, all_ok, workdir_complete, nzo.bytes_downloaded,
+        if (not self.nzb_list) and cfg.email_endjob():
+            if (cfg.email_endjob() == 1) or (cfg.email_endjob() == 2 and (self.unpack_error or self.par_error)):
+                emailer.endjob(self.dirname, self.msgid, self.cat, self.all_ok, self.workdir_complete, nzo.bytes_downloaded,
                                nzo.unpack_info, script, TRANS(script_log), script_ret)
 
         if script_output:
@@ -445,9 +624,9 @@ def process_job(nzo):
                 script_ret = 'Exit(%s) ' % script_ret
             else:
                 script_ret = ''
-            if script_line:
+            if self.script_line:
                 nzo.set_unpack_info('Script',
-                                    u'%s%s <a href="./scriptlog?name=%s">(%s)</a>' % (script_ret, unicoder(script_line), urllib.quote(script_output),
+                                    u'%s%s <a href="./scriptlog?name=%s">(%s)</a>' % (script_ret, unicoder(self.script_line), urllib.quote(script_output),
                                      T('More')), unique=True)
             else:
                 nzo.set_unpack_info('Script',
@@ -455,76 +634,92 @@ def process_job(nzo):
                                     T('View script output')), unique=True)
 
         ## Cleanup again, including NZB files
-        if all_ok:
-            cleanup_list(workdir_complete, False)
+        if self.all_ok:
+            cleanup_list(self.workdir_complete, False)
 
         ## Remove newzbin bookmark, if any
-        if msgid and all_ok:
-            Bookmarks.do.del_bookmark(msgid)
-        elif all_ok and isinstance(nzo.url, str):
+        if self.msgid and self.all_ok:
+            Bookmarks.do.del_bookmark(self.msgid)
+        elif self.all_ok and isinstance(nzo.url, str):
             sabnzbd.proxy_rm_bookmark(nzo.url)
 
         ## Show final status in history
-        if all_ok:
-            growler.send_notification(T('Download Completed'), filename, 'complete')
+        if self.all_ok:
+            growler.send_notification(T('Download Completed'), self.filename, 'complete')
             nzo.status = Status.COMPLETED
         else:
-            growler.send_notification(T('Download Failed'), filename, 'complete')
+            growler.send_notification(T('Download Failed'), self.filename, 'complete')
             nzo.status = Status.FAILED
 
-    except:
-        logging.error(Ta('Post Processing Failed for %s (%s)'), filename, crash_msg)
-        if not crash_msg:
+    def crash(self):
+        """ Handle an exception in any of the stages """
+        nzo = self.nzo
+        self.crashed = True
+        logging.error(Ta('Post Processing Failed for %s (%s)'), self.filename, self.crash_msg)
+        if not self.crash_msg:
             logging.info("Traceback: ", exc_info = True)
-            crash_msg = T('see logfile')
-        nzo.fail_msg = T('PostProcessing was aborted (%s)') % unicoder(crash_msg)
-        growler.send_notification(T('Download Failed'), filename, 'complete')
+            self.crash_msg = T('see logfile')
+        nzo.fail_msg = T('PostProcessing was aborted (%s)') % unicoder(self.crash_msg)
+        growler.send_notification(T('Download Failed'), self.filename, 'complete')
         nzo.status = Status.FAILED
-        par_error = True
-        all_ok = False
+        self.par_error = True
+        self.all_ok = False
         info = nzo.unpack_info.copy()
         info['fail'] = [nzo.fail_msg]
         if cfg.email_endjob():
-            emailer.endjob(dirname, msgid, cat, all_ok, workdir_complete, nzo.bytes_downloaded,
+            emailer.endjob(self.dirname, self.msgid, self.cat, self.all_ok, self.workdir_complete, nzo.bytes_downloaded,
                            info, '', '', 0)
 
-
-    if all_ok:
-        # If the folder only contains one file OR folder, have that as the path
-        # Be aware that series/generic/date sorting may move a single file into a folder containing other files
-        workdir_complete = one_file_or_folder(workdir_complete)
-        workdir_complete = os.path.normpath(workdir_complete)
-
-    # Log the overall time taken for postprocessing
-    postproc_time = int(time.time() - start)
-
-    # Create the history DB instance
-    history_db = database.get_history_handle()
-    # Add the nzo to the database. Only the path, script and time taken is passed
-    # Other information is obtained from the nzo
-    history_db.add_history_db(nzo, workdir_complete, nzo.downpath, postproc_time, script_log, script_line)
-    # The connection is only used once, so close it here
-    history_db.close()
-
-    ## Clean up the NZO
-    try:
-        logging.info('Cleaning up %s (keep_basic=%s)', filename, str(not all_ok))
-        sabnzbd.nzbqueue.NzbQueue.do.cleanup_nzo(nzo, keep_basic=not all_ok)
-    except:
-        logging.error(Ta('Cleanup of %s failed.'), nzo.final_name)
-        logging.info("Traceback: ", exc_info = True)
-
-    ## Remove download folder
-    if all_ok:
+    def to_history(self):
+        """ Add the job to the history and clean up """
+        nzo = self.nzo
+        workdir = self.workdir
+        workdir_complete = self.workdir_complete
+
+        if self.all_ok:
+            # If the folder only contains one file OR folder, have that as the path
+            # Be aware that series/generic/date sorting may move a single file into a folder containing other files
+            workdir_complete = one_file_or_folder(workdir_complete)
+            workdir_complete = os.path.normpath(workdir_complete)
+
+        # Log the overall time taken for postprocessing
+        postproc_time = int(time.time() - self.start)
+
+        # Create the history DB instance
+        history_db = database.get_history_handle()
+        # Add the nzo to the database. Only the path, script and time taken is passed
+        # Other information is obtained from the nzo
+        history_db.add_history_db(nzo, workdir_complete, nzo.downpath, postproc_time, self.script_log, self.script_line)
+        # The connection is only used once, so close it here
+        history_db.close()
+
+        ## Clean up the NZO
         try:
-            if os.path.exists(workdir):
-                logging.debug('Removing workdir %s', workdir)
-                remove_all(workdir, recursive=True)
+            logging.info('Cleaning up %s (keep_basic=%s)', self.filename, str(not self.all_ok))
+            sabnzbd.nzbqueue.NzbQueue.do.cleanup_nzo(nzo, keep_basic=not self.all_ok)
         except:
-            logging.error(Ta('Error removing workdir (%s)'), workdir)
+            logging.error(Ta('Cleanup of %s failed.'), nzo.final_name)
             logging.info("Traceback: ", exc_info = True)
 
-    return True
+        ## Remove download folder
+        if self.all_ok:
+            try:
+                if os.path.exists(workdir):
+                    logging.debug('Removing workdir %s', workdir)
+                    remove_all(workdir, recursive=True)
+            except:
+                logging.error(Ta('Error removing workdir (%s)'), workdir)
+                logging.info("Traceback: ", exc_info = True)
+
+
+def process_job(nzo):
+    """ Process one job, running all stages in the calling thread """
+    job = PostJob(nzo)
+    if job.verify():
+        job.unpack()
+        job.finish()
+        return True
+    return False
 
 
 
@@ -396,12 +396,6 @@ def pause_check():
         sabnzbd.unpause_all()
 
 
-#------------------------------------------------------------------------------
-def plan_server(action, parms, interval):
-    """ Plan to re-activate server after "interval" minutes
-    """
-    __SCHED.add_single_task(action, '', interval*60, kronos.method.sequential, parms, None)
-
 #------------------------------------------------------------------------------
 def force_rss():
     """ Add a one-time RSS scan, one second from now
@@ -471,6 +471,12 @@ SKIN_TEXT = {
     'srv-timeout' : TT('Timeout'), #: Server timeout
     'srv-connections' : TT('Connections'), #: Server: amount of connections
     'srv-retention' : TT('Retention time'), #: Server's retention time in days
+    'srv-speedlimit' : TT('Speed limit'), #: Server's maximum download speed (0 = no limit)
+    'srv-autotune' : TT('Tune connections'), #: Server: adjust amount of connections automatically
+    'explain-autotune' : TT('Adjust the number of connections in use to the one that gives the best speed, between the minimum and the maximum.'),
+    'srv-min_connections' : TT('Minimum connections'), #: Server: lowest amount of connections when tuning
+    'srv-bind_ips' : TT('Local addresses'), #: Server: local IP addresses to connect from, used in turn
+    'srv-compress' : TT('Compression'), #: Server: use NNTP COMPRESS DEFLATE when the server supports it
     'srv-ssl' : TT('SSL'), #: Server SSL tickbox
     'srv-fillserver' : TT('Backup server'), #: Backup server tickbox
     'srv-optional' : TT('Optional'), #: Server optional tickbox
@@ -124,11 +124,13 @@ class RarInfo:
 
 class RarFile:
     '''Rar archive handling.'''
-    def __init__(self, rarfile, mode="r", charset='cp850', info_callback=None, all_names=False):
+    def __init__(self, rarfile, mode="r", charset='cp850', info_callback=None, all_names=False, data=None):
         # 'all_names' = show names of 'split' files too
+        # 'data' = only parse the headers in this string (start of a volume)
         self.rarfile = rarfile
         self.charset = charset
         self.all_names = all_names
+        self.data = data
 
         self.info_list = []
         self.is_solid = 0
@@ -232,7 +234,10 @@ class RarFile:
 
     # read rar
     def _parse(self):
-        fd = open(self.rarfile, "rb")
+        if self.data is None:
+            fd = open(self.rarfile, "rb")
+        else:
+            fd = StringIO(self.data)
         id = fd.read(len(RAR_ID))
         if id != RAR_ID:
             raise Exception("Not a Rar")
@@ -242,7 +247,7 @@ class RarFile:
         while 1:
             h = self._parse_header(fd)
             if not h:
-                if more_vols:
+                if more_vols and self.data is None:
                     volume += 1
                     try:
                         fd = open(self._gen_volname(volume), "rb")
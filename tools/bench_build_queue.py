@@ -0,0 +1,83 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+# Copyright 2008-2012 The SABnzbd-Team <team@sabnzbd.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Measure the queue part of an API queue request on a large queue:
+# the paged path used by build_queue against the full queue_info().
+# Pages come from the queue snapshot, which is only gathered again
+# for jobs that changed since the previous request.
+#
+# Usage: python tools/bench_build_queue.py [jobs] [limit] [rounds]
+# Run from the root of the source tree.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.getcwd())
+
+from sabnzbd.nzbqueue import NzbQueue
+from sabnzbd.nzbstuff import NzbObject
+from bench_queue_startup import setup, make_nzb
+
+
+def timed(func, rounds):
+    """ Return average latency of func() in msec """
+    start = time.time()
+    for n in xrange(rounds):
+        func()
+    return (time.time() - start) * 1000.0 / rounds
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    base = tempfile.mkdtemp(prefix='sabbench')
+    try:
+        setup(base)
+        print 'Creating queue of %d jobs' % jobs
+        NzbQueue()
+        for job in xrange(jobs):
+            nzo = NzbObject('job%d.nzb' % job, 0, 3, None, make_nzb(job, 10, 5))
+            NzbQueue.do.add(nzo, save=False, quiet=True)
+
+        queue = NzbQueue.do
+        middle = jobs / 2
+
+        def changed_page():
+            # A progressing download changes one job between API calls
+            queue.update_totals(nzo)
+            queue.queue_page(0, limit)
+
+        print '%-36s %8.3f msec' % ('queue_info (all jobs)', timed(queue.queue_info, rounds))
+        print '%-36s %8.3f msec' % ('queue_page %d-%d' % (0, limit),
+                                    timed(lambda: queue.queue_page(0, limit), rounds))
+        print '%-36s %8.3f msec' % ('queue_page %d-%d' % (middle, middle + limit),
+                                    timed(lambda: queue.queue_page(middle, limit), rounds))
+        print '%-36s %8.3f msec' % ('queue_page %d-%d, one job changed' % (0, limit),
+                                    timed(changed_page, rounds))
+        print '%-36s %8.3f msec' % ('get_totals', timed(queue.get_totals, rounds))
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+# Copyright 2008-2012 The SABnzbd-Team <team@sabnzbd.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Measure download throughput end to end, offline.
+# A fake news server (tools/fakenntp.py) runs in its own process, the job
+# goes through Downloader, Decoder, ArticleCache and Assembler up to the
+# hand-over to post-processing, which is not run.
+# Reports MB/s, CPU seconds per MB and the peak RSS of this process.
+#
+# Usage: python tools/bench_download.py [options]
+# Run from the root of the source tree, takes the options of fakenntp.py
+# plus --connections, --cache, --rounds and --timeout; see --help.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.getcwd())
+
+import sabnzbd
+import sabnzbd.cfg as cfg
+import sabnzbd.config as config
+import sabnzbd.downloader
+from sabnzbd.downloader import Downloader
+from sabnzbd.nzbqueue import NzbQueue
+from sabnzbd.nzbstuff import NzbObject
+from sabnzbd.assembler import Assembler
+from sabnzbd.postproc import PostProcessor
+from sabnzbd.articlecache import ArticleCache
+from bench_queue_startup import setup
+from fakenntp import option_parser, make_server
+
+
+def cpu_time():
+    """ User plus system CPU seconds of this process """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss():
+    """ Peak resident size in MB, ru_maxrss is in KB on Linux and in bytes on OSX """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 1048576.0
+    return rss / 1024.0
+
+
+def add_server(port, options):
+    """ Define the fake server in the configuration """
+    name = '127.0.0.1:%d' % port
+    config.ConfigServer(name, {'host' : '127.0.0.1', 'port' : port,
+                               'connections' : options.connections,
+                               'username' : options.username or '',
+                               'password' : options.password or '',
+                               'compress' : int(options.compress)})
+
+
+def download(nzb, round, timeout):
+    """ Queue the NZB and wait until the Assembler hands it to post-processing,
+        return (seconds, cpu seconds, bytes) or None on timeout
+    """
+    nzo = NzbObject('fakenntp%d.nzb' % round, 0, 0, None, nzb)
+    start = time.time()
+    cpu = cpu_time()
+    NzbQueue.do.add(nzo, save=False, quiet=True)
+    while nzo not in PostProcessor.do.history_queue:
+        if time.time() - start > timeout:
+            return None
+        time.sleep(0.05)
+    return time.time() - start, cpu_time() - cpu, nzo.bytes_downloaded
+
+
+def main():
+    parser = option_parser()
+    parser.set_usage('%prog [options]')
+    parser.add_option('--connections', type='int', default=8, help='Connections to the server (default %default)')
+    parser.add_option('--cache', default='64M', help='Article cache size (default %default)')
+    parser.add_option('--rounds', type='int', default=3, help='Number of downloads (default %default)')
+    parser.add_option('--timeout', type='int', default=600, help='Give up a round after this many seconds')
+    options, args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix='sabbench')
+    process = None
+    try:
+        setup(base)
+        # No desktop notifications from a benchmark
+        cfg.growl_enable.set(False)
+        cfg.ntfosd_enable.set(False)
+        cfg.cache_limit.set(options.cache)
+        ArticleCache.do.new_limit(cfg.cache_limit.get_int())
+
+        # Separate process, so the server doesn't compete for the GIL
+        server = make_server(options, port=0)
+        port = server.server_address[1]
+        nzb = server.catalogue.nzb()
+        process = multiprocessing.Process(target=server.serve_forever)
+        process.daemon = True
+        process.start()
+        add_server(port, options)
+
+        NzbQueue()
+        PostProcessor()
+        Assembler()
+        Assembler.do.start()
+        Downloader()
+        Downloader.do.start()
+
+        size = server.catalogue.total_bytes() / 1048576.0
+        print 'Downloading %.1f MB in %d articles over %d connections' % \
+              (size, len(server.catalogue.table), options.connections)
+        for n in xrange(options.rounds):
+            result = download(nzb, n, options.timeout)
+            if not result:
+                print 'round %d: timeout after %d sec' % (n + 1, options.timeout)
+                break
+            elapsed, cpu, done = result
+            mb = max(done / 1048576.0, 0.001)
+            print 'round %d: %8.1f MB/s  %6.3f CPU sec/MB  %6.1f MB done  peak RSS %6.1f MB' % \
+                  (n + 1, mb / elapsed, cpu / mb, mb, peak_rss())
+    finally:
+        if Downloader.do:
+            sabnzbd.downloader.stop()
+        if Assembler.do:
+            Assembler.do.stop()
+            Assembler.do.join()
+        if process:
+            process.terminate()
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
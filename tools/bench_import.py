@@ -0,0 +1,51 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+# Copyright 2008-2012 The SABnzbd-Team <team@sabnzbd.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Measure the import time of sabnzbd.newswrapper in a fresh interpreter,
+# and the time of the IPv6 probe that used to run during that import.
+#
+# Usage: python tools/bench_import.py [rounds]
+# Run from the root of the source tree.
+
+import os
+import sys
+import time
+import subprocess
+
+sys.path.insert(0, os.getcwd())
+
+IMPORT = 'import time; start = time.time(); import sabnzbd.newswrapper; print time.time() - start'
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    total = 0.0
+    for n in xrange(rounds):
+        output = subprocess.Popen([sys.executable, '-c', IMPORT], stdout=subprocess.PIPE).communicate()[0]
+        total += float(output.strip().split()[-1])
+    print 'import sabnzbd.newswrapper     %8.1f msec' % (total * 1000.0 / rounds)
+
+    import sabnzbd.newswrapper
+    start = time.time()
+    result = sabnzbd.newswrapper.test_ipv6()
+    print 'test_ipv6() (%-5s)            %8.1f msec' % (result, (time.time() - start) * 1000.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+# Copyright 2008-2012 The SABnzbd-Team <team@sabnzbd.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Measure queue startup time, with and without lazy loading of jobs
+#
+# Usage: python tools/bench_queue_startup.py [jobs] [files-per-job] [articles-per-file]
+# Run from the root of the source tree.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.getcwd())
+
+import sabnzbd
+import sabnzbd.cfg as cfg
+import sabnzbd.config as config
+from sabnzbd.nzbqueue import NzbQueue
+from sabnzbd.nzbstuff import NzbObject
+
+NZB_HEAD = '<?xml version="1.0" encoding="iso-8859-1" ?>\n' \
+           '<nzb xmlns="http://www.newzbin.com/DTD/2003/nzb">\n'
+NZB_FILE = '<file poster="bench" date="1300000000" subject="&quot;job%d.part%03d.rar&quot; yEnc (1/%d)">\n' \
+           '<groups><group>alt.binaries.test</group></groups>\n<segments>\n%s</segments>\n</file>\n'
+NZB_SEGMENT = '<segment bytes="768000" number="%d">%d.%d.%d@bench</segment>\n'
+
+
+def make_nzb(job, files, articles):
+    """ Return synthetic NZB text """
+    data = [NZB_HEAD]
+    for n in xrange(files):
+        segs = ''.join([NZB_SEGMENT % (a + 1, job, n, a) for a in xrange(articles)])
+        data.append(NZB_FILE % (job, n, articles, segs))
+    data.append('</nzb>\n')
+    return ''.join(data)
+
+
+def setup(base):
+    """ Use a fresh INI file and point all work folders to a temporary location """
+    config.read_config(os.path.join(base, 'sabnzbd.ini'))
+    for option in (cfg.admin_dir, cfg.download_dir, cfg.complete_dir, cfg.cache_dir):
+        option.set_root(base)
+    sabnzbd.__INITIALIZED__ = True
+
+
+def fill_queue(jobs, files, articles):
+    NzbQueue()
+    for job in xrange(jobs):
+        name = 'job%d.nzb' % job
+        nzo = NzbObject(name, 0, 3, None, make_nzb(job, files, articles))
+        NzbQueue.do.add(nzo, save=False, quiet=True)
+    NzbQueue.do.save()
+
+
+def measure(lazy):
+    cfg.lazy_queue.set(lazy)
+    NzbQueue()
+    start = time.time()
+    NzbQueue.do.read_queue(0)
+    loaded = time.time() - start
+    start = time.time()
+    NzbQueue.do.queue_info()
+    info = time.time() - start
+    return loaded, info
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    articles = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    base = tempfile.mkdtemp(prefix='sabbench')
+    try:
+        setup(base)
+        print 'Creating queue of %d jobs (%d files, %d articles each)' % (jobs, files, articles)
+        fill_queue(jobs, files, articles)
+        for lazy in (False, True):
+            loaded, info = measure(lazy)
+            print '%-6s read_queue %8.3f sec   queue_info %8.3f sec' % \
+                  (lazy and 'lazy' or 'eager', loaded, info)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+# Copyright 2008-2012 The SABnzbd-Team <team@sabnzbd.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Measure reconnect storms: open many SSL connections at once to a local
+# server and drive them with one select loop, the way the downloader does.
+# Reports the time until all greetings are in, the longest loop pass (without
+# the select wait) and the longest single connect step, which shows whether
+# connection setup stalls the loop.
+#
+# Usage: python tools/bench_reconnect.py [connections] [rounds] [ssl]
+# Run from the root of the source tree, needs the openssl command line tool.
+
+import os
+import sys
+import time
+import shutil
+import socket
+import select
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.getcwd())
+
+import ssl
+from sabnzbd.newswrapper import NewsWrapper, GetServerParms
+from bench_queue_startup import setup
+
+
+class BenchServer(object):
+    """ The parts of downloader.Server used by NewsWrapper """
+    def __init__(self, port, sslenabled):
+        self.id = 'bench'
+        self.host = self.hostip = '127.0.0.1'
+        self.port = port
+        self.ssl = sslenabled
+        self.ssl_session = None
+        self.bad_ips = {}
+        self.info = GetServerParms(self.host, port)
+        self.username = self.password = None
+        self.timeout = 60
+        self.warning = ''
+        self.oddball = False
+        self.compress = False
+        self.bytes_wire = self.bytes_data = 0
+
+    def source_address(self, af, thrdnum):
+        return None
+
+
+def make_cert(base):
+    """ Create a self-signed certificate, return (certfile, keyfile) """
+    cert = os.path.join(base, 'cert.pem')
+    key = os.path.join(base, 'key.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                           '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return cert, key
+
+
+def serve(listener, cert, key):
+    """ Accept connections, greet each one in its own thread """
+    def greet(conn):
+        try:
+            if cert:
+                conn = ssl.wrap_socket(conn, certfile=cert, keyfile=key, server_side=True)
+            conn.sendall('200 Bench server ready\r\n')
+            while conn.recv(1024):
+                pass
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    while True:
+        conn, addr = listener.accept()
+        thread = threading.Thread(target=greet, args=(conn,))
+        thread.daemon = True
+        thread.start()
+
+
+def storm(server, count):
+    """ Connect count wrappers at once,
+        return (total, longest pass, longest single step, failures)
+    """
+    read_fds = {}
+    write_fds = {}
+    pending = set()
+    failed = 0
+    start = time.time()
+    wrappers = []
+    for n in xrange(count):
+        nw = NewsWrapper(server, n)
+        wrappers.append(nw)
+        nw.init_connect(write_fds)
+        pending.add(nw)
+
+    longest = step = 0.0
+    while pending and time.time() - start < server.timeout:
+        read, write, error = select.select(read_fds.keys(), write_fds.keys(), write_fds.keys(), 1.0)
+        stamp = time.time()
+        for fileno in set(write).union(error).union(read):
+            nw = write_fds.pop(fileno, None) or read_fds.pop(fileno, None)
+            if not nw:
+                continue
+            if nw.nntp.connecting or nw.nntp.handshaking:
+                begin = time.time()
+                try:
+                    want = nw.nntp.connect_step()
+                except (socket.error, ssl.SSLError):
+                    failed += 1
+                    pending.discard(nw)
+                    continue
+                step = max(step, time.time() - begin)
+                if want == 'write':
+                    write_fds[fileno] = nw
+                else:
+                    read_fds[fileno] = nw
+                continue
+            bytes, done, skip = nw.recv_chunk()
+            if skip:
+                read_fds[fileno] = nw
+            elif nw.lines:
+                pending.discard(nw)
+            elif bytes:
+                read_fds[fileno] = nw
+            else:
+                failed += 1
+                pending.discard(nw)
+        longest = max(longest, time.time() - stamp)
+
+    total = time.time() - start
+    for nw in wrappers:
+        nw.terminate()
+    return total, longest, step, failed + len(pending)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    sslenabled = (sys.argv[3] != '0') if len(sys.argv) > 3 else True
+
+    base = tempfile.mkdtemp(prefix='sabbench')
+    try:
+        setup(base)
+        cert = key = None
+        if sslenabled:
+            cert, key = make_cert(base)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(count)
+        # Separate process, so the server's handshakes don't compete for the GIL
+        process = multiprocessing.Process(target=serve, args=(listener, cert, key))
+        process.daemon = True
+        process.start()
+
+        server = BenchServer(listener.getsockname()[1], sslenabled)
+        print 'Reconnect storms of %d %s connections' % (count, sslenabled and 'SSL' or 'plain')
+        for n in xrange(rounds):
+            total, longest, step, failed = storm(server, count)
+            print 'round %d: all greeted %8.1f msec, longest pass %7.1f msec, longest step %5.1f msec, failed %d' % \
+                  (n + 1, total * 1000.0, longest * 1000.0, step * 1000.0, failed)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
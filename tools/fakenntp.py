@@ -0,0 +1,339 @@
+#!/usr/bin/python -OO
+# -*- coding: utf-8 -*-
+# Copyright 2008-2012 The SABnzbd-Team <team@sabnzbd.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Local stand-in for a news server, serving synthetic yEnc articles.
+# All articles of a catalogue carry the same random block, so the server
+# encodes it only once and spends its time on the socket, not on yEnc.
+# Latency, bandwidth, missing articles, CRC errors, authentication and a
+# connection limit can be set, to benchmark the downloader offline.
+#
+# Usage: python tools/fakenntp.py [options] nzbfile
+# Writes the NZB for the catalogue to nzbfile, then serves it until Ctrl-C.
+# Use "python tools/fakenntp.py --help" for the options.
+
+import os
+import sys
+import time
+import zlib
+import socket
+import binascii
+import threading
+import SocketServer
+from optparse import OptionParser
+
+NZB_HEAD = '<?xml version="1.0" encoding="iso-8859-1" ?>\n' \
+           '<nzb xmlns="http://www.newzbin.com/DTD/2003/nzb">\n'
+NZB_FILE = '<file poster="fakenntp" date="%d" subject="&quot;%s&quot; yEnc (1/%d)">\n' \
+           '<groups><group>alt.binaries.test</group></groups>\n<segments>\n%s</segments>\n</file>\n'
+NZB_SEGMENT = '<segment bytes="%d" number="%d">%s</segment>\n'
+
+LINE_LENGTH = 128
+CHUNK = 16384
+
+
+def yenc_encode(data):
+    """ Return list of yEnc lines for data """
+    lines = []
+    line = []
+    length = 0
+    for char in data:
+        code = (ord(char) + 42) % 256
+        if code in (0, 10, 13, 61) or (code == 46 and length == 0):
+            line.append('=' + chr((code + 64) % 256))
+            length += 2
+        else:
+            line.append(chr(code))
+            length += 1
+        if length >= LINE_LENGTH:
+            lines.append(''.join(line))
+            line = []
+            length = 0
+    if line:
+        lines.append(''.join(line))
+    return lines
+
+
+def rate_hit(msgid, rate, salt):
+    """ Deterministic selection of a fraction rate of the message-ids """
+    return rate > 0.0 and (zlib.crc32(salt + msgid) & 0xffff) < rate * 0x10000
+
+
+class Catalogue(object):
+    """ Synthetic set of files, each file cut in equally sized articles """
+    def __init__(self, files=10, articles=50, size=750000, name='fake'):
+        self.name = name
+        self.size = size
+        self.files = []
+        self.table = {}     # message-id -> (filename, part, total)
+        for n in xrange(files):
+            filename = '%s.part%03d.rar' % (name, n + 1)
+            ids = []
+            for part in xrange(articles):
+                msgid = '%s.%d.%d@fakenntp' % (name, n, part)
+                self.table[msgid] = (filename, part + 1, articles)
+                ids.append(msgid)
+            self.files.append((filename, ids))
+
+        block = os.urandom(size)
+        self.crc = binascii.crc32(block) & 0xffffffff
+        self.lines = yenc_encode(block)
+        self.body = '\r\n'.join(self.lines) + '\r\n'
+
+    def total_bytes(self):
+        return len(self.table) * self.size
+
+    def nzb(self):
+        """ Return NZB text for the catalogue """
+        data = [NZB_HEAD]
+        stamp = int(time.time())
+        for filename, ids in self.files:
+            segs = ''.join([NZB_SEGMENT % (self.size, n + 1, msgid) for n, msgid in enumerate(ids)])
+            data.append(NZB_FILE % (stamp, filename, len(ids), segs))
+        data.append('</nzb>\n')
+        return ''.join(data)
+
+    def article(self, msgid, corrupt=False):
+        """ Return yEnc body of msgid, with a wrong part CRC when corrupt is set """
+        filename, part, total = self.table[msgid]
+        begin = (part - 1) * self.size + 1
+        crc = self.crc
+        if corrupt:
+            crc ^= 0x55aa55aa
+        return ''.join(('=ybegin part=%d total=%d line=%d size=%d name=%s\r\n' %
+                            (part, total, LINE_LENGTH, total * self.size, filename),
+                        '=ypart begin=%d end=%d\r\n' % (begin, begin + self.size - 1),
+                        self.body,
+                        '=yend size=%d part=%d pcrc32=%08x\r\n' % (self.size, part, crc)))
+
+
+class FakeHandler(SocketServer.BaseRequestHandler):
+    """ One client connection """
+
+    def setup(self):
+        self.user = None
+        self.authenticated = not self.server.username
+        self.compressor = None
+        self.decompressor = None
+        self.sent = 0
+        self.start = time.time()
+
+    def send(self, data):
+        """ Send data, paced to the bandwidth limit """
+        if self.compressor:
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.request.sendall(data)
+            return
+        for n in xrange(0, len(data), CHUNK):
+            chunk = data[n:n+CHUNK]
+            self.request.sendall(chunk)
+            self.sent += len(chunk)
+            delay = self.start + float(self.sent) / bandwidth - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def handle(self):
+        server = self.server
+        if not server.enter():
+            try:
+                self.request.sendall('502 Too many connections\r\n')
+            except socket.error:
+                pass
+            return
+        try:
+            self.send('200 Fake NNTP server ready\r\n')
+            pending = ''
+            while True:
+                data = self.request.recv(CHUNK)
+                if not data:
+                    break
+                if self.decompressor:
+                    data = self.decompressor.decompress(data)
+                pending += data
+                while '\r\n' in pending:
+                    line, pending = pending.split('\r\n', 1)
+                    if server.latency:
+                        time.sleep(server.latency)
+                    if not self.command(line):
+                        return
+        except socket.error:
+            pass
+        finally:
+            server.leave()
+
+    def command(self, line):
+        """ Answer one command line, return False to close the connection """
+        server = self.server
+        parts = line.split()
+        verb = parts and parts[0].upper() or ''
+        arg = len(parts) > 1 and parts[1] or ''
+
+        if verb == 'QUIT':
+            self.send('205 Bye\r\n')
+            return False
+        if verb == 'AUTHINFO' and arg.upper() == 'USER':
+            self.user = len(parts) > 2 and parts[2] or ''
+            self.send('381 Password required\r\n')
+            return True
+        if verb == 'AUTHINFO' and arg.upper() == 'PASS':
+            password = len(parts) > 2 and parts[2] or ''
+            if self.user == server.username and password == server.password:
+                self.authenticated = True
+                self.send('281 Authentication accepted\r\n')
+            else:
+                self.send('481 Authentication failed\r\n')
+            return True
+        if verb == 'DATE':
+            self.send('111 %s\r\n' % time.strftime('%Y%m%d%H%M%S', time.gmtime()))
+            return True
+        if not self.authenticated:
+            self.send('480 Authentication required\r\n')
+            return True
+
+        if verb == 'COMPRESS' and arg.upper() == 'DEFLATE' and server.compress and not self.compressor:
+            self.send('206 Compression active\r\n')
+            self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        elif verb == 'GROUP':
+            self.send('211 %d 1 %d %s\r\n' % (len(server.catalogue.table), len(server.catalogue.table), arg))
+        elif verb in ('BODY', 'ARTICLE', 'STAT'):
+            msgid = arg.strip('<>')
+            if msgid not in server.catalogue.table or rate_hit(msgid, server.missing, 'missing'):
+                server.count('missing')
+                self.send('430 No such article\r\n')
+            elif verb == 'STAT':
+                self.send('223 0 <%s>\r\n' % msgid)
+            else:
+                corrupt = rate_hit(msgid, server.corrupt, 'corrupt')
+                if corrupt:
+                    server.count('corrupt')
+                server.count('served')
+                if verb == 'BODY':
+                    head = '222 0 <%s>\r\n' % msgid
+                else:
+                    head = '220 0 <%s>\r\nMessage-ID: <%s>\r\nSubject: fakenntp\r\n\r\n' % (msgid, msgid)
+                self.send(head + server.catalogue.article(msgid, corrupt) + '.\r\n')
+        else:
+            self.send('500 Command not recognized\r\n')
+        return True
+
+
+class FakeNNTP(SocketServer.ThreadingTCPServer):
+    """ Threaded server for a Catalogue
+        latency:     seconds of delay before each answer
+        bandwidth:   bytes per second per connection, 0 is unlimited
+        missing:     fraction of articles answered with 430
+        corrupt:     fraction of articles sent with a wrong CRC
+        username:    when set, AUTHINFO with username/password is required
+        max_conn:    connections above this get "502 Too many connections"
+        compress:    accept COMPRESS DEFLATE
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 100
+
+    def __init__(self, catalogue, host='127.0.0.1', port=0, latency=0.0, bandwidth=0,
+                 missing=0.0, corrupt=0.0, username=None, password=None, max_conn=0,
+                 compress=False):
+        SocketServer.ThreadingTCPServer.__init__(self, (host, port), FakeHandler)
+        self.catalogue = catalogue
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.missing = missing
+        self.corrupt = corrupt
+        self.username = username
+        self.password = password
+        self.max_conn = max_conn
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.counters = {'missing' : 0, 'corrupt' : 0, 'served' : 0, 'refused' : 0}
+
+    def enter(self):
+        """ Register a new connection, False when over the limit """
+        self.lock.acquire()
+        try:
+            if self.max_conn and self.connections >= self.max_conn:
+                self.counters['refused'] += 1
+                return False
+            self.connections += 1
+            return True
+        finally:
+            self.lock.release()
+
+    def leave(self):
+        self.lock.acquire()
+        self.connections -= 1
+        self.lock.release()
+
+    def count(self, name):
+        self.lock.acquire()
+        self.counters[name] += 1
+        self.lock.release()
+
+
+def option_parser():
+    parser = OptionParser(usage='%prog [options] nzbfile')
+    parser.add_option('--port', type='int', default=11119, help='Port to listen on (default %default)')
+    parser.add_option('--files', type='int', default=10, help='Files in the NZB (default %default)')
+    parser.add_option('--articles', type='int', default=50, help='Articles per file (default %default)')
+    parser.add_option('--size', type='int', default=750000, help='Bytes per article (default %default)')
+    parser.add_option('--latency', type='float', default=0.0, help='Seconds of delay per answer')
+    parser.add_option('--bandwidth', type='int', default=0, help='Bytes per second per connection, 0 is unlimited')
+    parser.add_option('--missing', type='float', default=0.0, help='Fraction of missing articles')
+    parser.add_option('--corrupt', type='float', default=0.0, help='Fraction of articles with a CRC error')
+    parser.add_option('--username', default=None, help='Require AUTHINFO with this username')
+    parser.add_option('--password', default='', help='Password for --username')
+    parser.add_option('--max-conn', type='int', default=0, dest='max_conn', help='Connection limit, 0 is unlimited')
+    parser.add_option('--compress', action='store_true', default=False, help='Accept COMPRESS DEFLATE')
+    return parser
+
+
+def make_server(options, port=None):
+    """ Return FakeNNTP for parsed options """
+    catalogue = Catalogue(options.files, options.articles, options.size)
+    if port is None:
+        port = options.port
+    return FakeNNTP(catalogue, port=port, latency=options.latency, bandwidth=options.bandwidth,
+                    missing=options.missing, corrupt=options.corrupt, username=options.username,
+                    password=options.password, max_conn=options.max_conn, compress=options.compress)
+
+
+def main():
+    parser = option_parser()
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('Missing name of the NZB file to write')
+
+    server = make_server(options)
+    f = open(args[0], 'w')
+    f.write(server.catalogue.nzb())
+    f.close()
+    print 'Serving %d articles (%.1f MB) on port %d, NZB in %s' % \
+          (len(server.catalogue.table), server.catalogue.total_bytes() / 1048576.0,
+           server.server_address[1], args[0])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print 'Served %(served)d, missing %(missing)d, corrupt %(corrupt)d, refused %(refused)d' % server.counters
+
+
+if __name__ == '__main__':
+    main()